@@ -0,0 +1,96 @@
+# backend/almacenamiento.py
+# Almacenamiento de los PDFs sellados en la nube.
+#
+# ALMACEN elige el backend:
+#  - "supabase": bucket "facturas" de Supabase Storage (por defecto si hay SUPABASE_URL).
+#  - "local": sustituto en disco con la misma interfaz (ALMACEN_LOCAL_DIR), para
+#    desarrollo, tests y benchmarks sin red.
+#  - "ninguno": los PDFs solo se guardan en uploads/.
+
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "facturas")
+ALMACEN = os.getenv("ALMACEN", "supabase" if SUPABASE_URL else "ninguno")
+ALMACEN_LOCAL_DIR = os.getenv("ALMACEN_LOCAL_DIR", "almacen_local")
+
+Contenido = Union[bytes, Path]
+
+
+class AlmacenSupabase:
+    def __init__(self, url: str, key: str, bucket: str = SUPABASE_BUCKET):
+        from supabase import create_client
+        self.cliente = create_client(url, key)
+        self.bucket = bucket
+
+    def _bucket(self):
+        return self.cliente.storage.from_(self.bucket)
+
+    def subir(self, ruta: str, contenido: Contenido):
+        # bytes se suben tal cual; una Path se envía leyendo el archivo
+        opciones = {"content-type": "application/pdf", "upsert": "true"}
+        if isinstance(contenido, Path):
+            with open(contenido, "rb") as f:
+                self._bucket().upload(path=ruta, file=f, file_options=opciones)
+        else:
+            self._bucket().upload(path=ruta, file=contenido, file_options=opciones)
+
+    def url_publica(self, ruta: str) -> str:
+        return self._bucket().get_public_url(ruta)
+
+    def urls_firmadas(self, rutas: List[str], caducidad_s: int) -> Dict[str, str]:
+        # Una sola llamada a la API para todas las rutas
+        respuesta = self._bucket().create_signed_urls(rutas, caducidad_s)
+        return {r["path"]: r["signedURL"] for r in respuesta if not r.get("error")}
+
+
+class AlmacenLocal:
+    """Sustituto local del bucket: mismas operaciones, archivos en un directorio."""
+
+    def __init__(self, directorio: str = ALMACEN_LOCAL_DIR):
+        self.directorio = Path(directorio)
+        self.directorio.mkdir(parents=True, exist_ok=True)
+
+    def subir(self, ruta: str, contenido: Contenido):
+        destino = self.directorio / ruta
+        if isinstance(contenido, Path):
+            shutil.copyfile(contenido, destino)
+        else:
+            destino.write_bytes(contenido)
+
+    def url_publica(self, ruta: str) -> str:
+        return (self.directorio / ruta).resolve().as_uri()
+
+    def urls_firmadas(self, rutas: List[str], caducidad_s: int) -> Dict[str, str]:
+        return {ruta: self.url_publica(ruta) for ruta in rutas}
+
+
+_almacen = None
+_inicializado = False
+_lock = threading.Lock()
+
+
+def obtener_almacen() -> Optional[object]:
+    """Backend configurado, creado en el primer uso (None si no hay nube)."""
+    global _almacen, _inicializado
+    with _lock:
+        if not _inicializado and ALMACEN != "ninguno":
+            _inicializado = True
+            try:
+                if ALMACEN == "local":
+                    _almacen = AlmacenLocal()
+                else:
+                    _almacen = AlmacenSupabase(SUPABASE_URL, SUPABASE_KEY)
+            except Exception as e:
+                print(f"Advertencia: Supabase no configurado correctamente: {e}")
+        return _almacen
+
+
+def ruta_en_nube(registro) -> str:
+    # ID + Nombre para evitar duplicados y facilitar la búsqueda en el bucket
+    return f"{registro.id}_{registro.nombre_archivo}"
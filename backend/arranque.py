@@ -0,0 +1,72 @@
+# backend/arranque.py
+# Arranque en dos fases y tiempos por subsistema.
+#
+# Importar main.py ya no carga reportlab/pypdf (pdf_factura), numpy (filtro_hashes),
+# passlib ni PyJWT, ni crea el cliente de Supabase: cada uno se importa en su primer
+# uso. Al arrancar solo se espera a las migraciones; el resto (evento de bitácora,
+# filtro de hashes, módulos pesados, outbox de subidas, sellador Merkle) se "calienta"
+# en un hilo después de que el worker ya responde. /api/salud informa de cada paso.
+
+import importlib
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+# Momento de importar este módulo (de los primeros de main.py)
+INICIO = time.perf_counter()
+
+
+class Arranque:
+
+    def __init__(self):
+        self.tiempos = {}   # subsistema -> segundos que tardó
+        self.errores = {}   # subsistema -> error
+        self.listo_en = None  # segundos desde INICIO hasta terminar el calentamiento
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def medir(self, nombre: str, funcion: Callable, *args):
+        t = time.perf_counter()
+        try:
+            return funcion(*args)
+        except Exception as e:
+            self.errores[nombre] = str(e)
+            print(f"❌ Error al arrancar {nombre}: {e}")
+        finally:
+            self.tiempos[nombre] = round(time.perf_counter() - t, 4)
+
+    def calentar(self, pasos: List[Tuple[str, Callable]]):
+        """Ejecuta los pasos en orden en un hilo aparte (no retrasa el arranque)."""
+        with self._lock:
+            if self._hilo is not None:
+                return
+            self._hilo = threading.Thread(target=self._calentar, args=(pasos,), name="calentamiento", daemon=True)
+            self._hilo.start()
+
+    def _calentar(self, pasos):
+        for nombre, funcion in pasos:
+            self.medir(nombre, funcion)
+        self.listo_en = round(time.perf_counter() - INICIO, 4)
+        print(f"Calentamiento terminado en {self.listo_en}s")
+
+    def esperar(self, timeout: Optional[float] = None) -> bool:
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join(timeout)
+        return self.listo_en is not None
+
+    def estado(self) -> dict:
+        return {
+            "listo": self.listo_en is not None,
+            "listo_en_s": self.listo_en,
+            "subsistemas": dict(self.tiempos),
+            "errores": dict(self.errores),
+        }
+
+
+def importar(modulo: str) -> Callable:
+    """Paso de calentamiento que solo importa un módulo pesado."""
+    return lambda: importlib.import_module(modulo)
+
+
+arranque = Arranque()
@@ -0,0 +1,193 @@
+# backend/autenticacion.py
+# Resolución del usuario autenticado con caché en memoria.
+#
+# get_current_user se ejecuta en cada petición protegida. El usuario del token se
+# guarda como una instantánea ligera (id, email) en un TTLCache por email (el "sub"
+# del JWT): con la caché caliente no se abre sesión ni se consulta la base de datos.
+# Las altas y cambios de Usuario invalidan su entrada (eventos del mapper); entre
+# workers distintos la entrada caduca como mucho a los AUTH_CACHE_TTL_S.
+#
+# Aquí viven también el hash de contraseñas y la limitación de intentos de login.
+
+import asyncio
+import functools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from cachetools import TTLCache
+from fastapi import HTTPException
+from sqlalchemy import event, inspect
+
+from models import SessionLocal, Usuario
+
+AUTH_CACHE_TTL_S = int(os.getenv("AUTH_CACHE_TTL_S", "60"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "10000"))
+
+
+@dataclass(frozen=True)
+class UsuarioActual:
+    """Lo que los endpoints necesitan del usuario autenticado (no es un objeto ORM)."""
+    id: int
+    email: str
+
+
+_cache = TTLCache(maxsize=AUTH_CACHE_MAX, ttl=AUTH_CACHE_TTL_S)
+_lock = threading.Lock()
+
+
+def usuario_en_cache(email: str) -> Optional[UsuarioActual]:
+    with _lock:
+        return _cache.get(email)
+
+
+def cargar_usuario(email: str) -> Optional[UsuarioActual]:
+    """Consulta el usuario (solo id y email) en una sesión propia y lo cachea."""
+    db = SessionLocal()
+    try:
+        fila = db.query(Usuario.id, Usuario.email).filter(Usuario.email == email).first()
+    finally:
+        db.close()
+    if fila is None:
+        return None
+    usuario = UsuarioActual(id=fila.id, email=fila.email)
+    with _lock:
+        _cache[email] = usuario
+    return usuario
+
+
+def invalidar_usuario(*emails: str):
+    with _lock:
+        for email in emails:
+            _cache.pop(email, None)
+
+
+@event.listens_for(Usuario, "after_insert")
+@event.listens_for(Usuario, "after_update")
+@event.listens_for(Usuario, "after_delete")
+def _invalidar_al_cambiar(mapper, connection, usuario):
+    # Si cambió el email, también el anterior
+    historial = inspect(usuario).attrs.email.history
+    invalidar_usuario(usuario.email, *[e for e in historial.deleted if e])
+
+
+# --- CONTRASEÑAS (bcrypt fuera del event loop) ---
+# bcrypt tarda decenas de ms por intento: se ejecuta en un pool propio y acotado
+# (HASH_HILOS), separado del de E/S para que una ráfaga de logins no deje sin hilos
+# a la facturación. Si hay más de HASH_COLA_MAX trabajos pendientes se responde 503
+# en vez de encolar sin límite. Al cambiar BCRYPT_ROUNDS, los hashes antiguos se
+# rehacen en el siguiente login correcto (verify_and_update). passlib se importa en el
+# primer uso o en el calentamiento del arranque (arranque.py).
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_HILOS = int(os.getenv("HASH_HILOS", "4"))
+HASH_COLA_MAX = int(os.getenv("HASH_COLA_MAX", "64"))
+
+@functools.lru_cache(maxsize=1)
+def contexto_hash():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_pool_hash = ThreadPoolExecutor(max_workers=HASH_HILOS, thread_name_prefix="inaltera-bcrypt")
+_pendientes = 0
+_lock_pendientes = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _hash_ficticio() -> str:
+    # Para igualar el tiempo de respuesta cuando el email no existe
+    return contexto_hash().hash("inaltera-usuario-inexistente")
+
+
+def _terminado(_futuro):
+    global _pendientes
+    with _lock_pendientes:
+        _pendientes -= 1
+
+
+def _enviar(funcion, *args) -> Future:
+    global _pendientes
+    with _lock_pendientes:
+        if _pendientes >= HASH_COLA_MAX:
+            raise HTTPException(status_code=503, detail="Servidor ocupado, inténtelo de nuevo", headers={"Retry-After": "1"})
+        _pendientes += 1
+    futuro = _pool_hash.submit(funcion, *args)
+    futuro.add_done_callback(_terminado)
+    return futuro
+
+
+async def verificar_password(password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(correcta, hash nuevo si hay que rehacerlo). Con hashed=None siempre es False."""
+    ok, nuevo = await asyncio.wrap_future(_enviar(contexto_hash().verify_and_update, password, hashed or _hash_ficticio()))
+    return (ok and hashed is not None), nuevo
+
+
+def calentar():
+    """Importa passlib y calcula el hash ficticio antes del primer login."""
+    _hash_ficticio()
+
+
+def hashear_password(password: str) -> str:
+    """Para endpoints síncronos (ya corren en un hilo): espera al pool de bcrypt."""
+    return _enviar(contexto_hash().hash, password).result()
+
+
+# --- LIMITACIÓN DE INTENTOS ---
+# Login: fallos por cuenta (LOGIN_MAX_FALLOS_CUENTA) y por IP (LOGIN_MAX_FALLOS_IP) en
+# una ventana de LOGIN_VENTANA_S. Altas: cada registro cuenta para su IP en un limitador
+# aparte (REGISTRO_MAX_IP por REGISTRO_VENTANA_S), así registrar cuentas no bloquea el
+# login de esa IP. Superado el límite se responde 429 antes de gastar bcrypt. Los
+# contadores son por proceso.
+
+LOGIN_VENTANA_S = int(os.getenv("LOGIN_VENTANA_S", "300"))
+LOGIN_MAX_FALLOS_CUENTA = int(os.getenv("LOGIN_MAX_FALLOS_CUENTA", "5"))
+LOGIN_MAX_FALLOS_IP = int(os.getenv("LOGIN_MAX_FALLOS_IP", "20"))
+REGISTRO_VENTANA_S = int(os.getenv("REGISTRO_VENTANA_S", "3600"))
+REGISTRO_MAX_IP = int(os.getenv("REGISTRO_MAX_IP", "20"))
+
+
+class LimitadorIntentos:
+
+    def __init__(self, ventana_s: int = LOGIN_VENTANA_S, max_ip: int = LOGIN_MAX_FALLOS_IP,
+                 max_cuenta: int = LOGIN_MAX_FALLOS_CUENTA, max_claves: int = 100000):
+        self.ventana = ventana_s
+        self.max_ip = max_ip
+        self.max_cuenta = max_cuenta
+        # clave -> [contador, inicio de la ventana]; la entrada caduca con la ventana
+        self._contadores = TTLCache(maxsize=max_claves, ttl=ventana_s)
+        self._lock = threading.Lock()
+
+    def _espera(self, clave: str, maximo: int) -> int:
+        contador = self._contadores.get(clave)
+        if contador is None or contador[0] < maximo:
+            return 0
+        return max(1, int(contador[1] + self.ventana - time.monotonic()))
+
+    def comprobar(self, ip: str, email: Optional[str] = None):
+        with self._lock:
+            espera = max(
+                self._espera(f"ip:{ip}", self.max_ip),
+                self._espera(f"cuenta:{email}", self.max_cuenta) if email else 0,
+            )
+        if espera:
+            raise HTTPException(status_code=429, detail="Demasiados intentos, inténtelo más tarde", headers={"Retry-After": str(espera)})
+
+    def fallo(self, ip: str, email: Optional[str] = None):
+        with self._lock:
+            for clave in [f"ip:{ip}"] + ([f"cuenta:{email}"] if email else []):
+                contador = self._contadores.get(clave)
+                if contador is None:
+                    self._contadores[clave] = [1, time.monotonic()]
+                else:
+                    contador[0] += 1  # en el sitio: no reinicia la caducidad
+
+    def exito(self, email: str):
+        with self._lock:
+            self._contadores.pop(f"cuenta:{email}", None)
+
+
+limitador_login = LimitadorIntentos()
+limitador_registro = LimitadorIntentos(REGISTRO_VENTANA_S, max_ip=REGISTRO_MAX_IP)
@@ -0,0 +1,305 @@
+# backend/bench_api.py
+# Benchmark de extremo a extremo de la API: la app se ejecuta en este proceso (sin red)
+# contra una base de datos de usar y tirar y con ALMACEN=local en lugar de Supabase.
+#
+# Escenarios: login, emitir, subir-factura con PDFs de varios tamaños, verificar-hash
+# (existente e inexistente) y registros con historiales de distinta profundidad
+# (primera página, página por fecha y listado completo en streaming). De cada uno se
+# mide el rendimiento (peticiones/s) y la latencia p50/p95/p99 con N peticiones y C a
+# la vez. El resultado es JSON; con --comparar se contrasta con una ejecución anterior
+# y se sale con código 1 si algún escenario empeora más de --tolerancia.
+#
+# Uso: python bench_api.py [-n 200] [-c 8] [--escenario emitir ...] [--salida r.json]
+#                          [--comparar base.json] [--database-url postgresql://...]
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+ESCENARIOS = ("login", "emitir", "subir", "verificar", "registros")
+TAMANOS_PDF = {"10k": 10 * 1024, "1m": 1024 * 1024, "10m": 10 * 1024 * 1024}
+PROFUNDIDADES = (1000, 10000, 100000)
+COMPLETO_MAX = 10000  # el listado completo solo se mide hasta esta profundidad
+PASSWORD = "bench-inaltera"
+
+FACTURA = {
+    "cliente_nombre": "Cliente Benchmark S.L.",
+    "cliente_nif": "B00000000",
+    "items": [{"producto": f"Producto {i}", "cantidad": i + 1, "precio_unitario": 9.95 * (i + 1), "iva": 21} for i in range(5)],
+    "notas": "",
+}
+
+
+def _entorno(tmp: str, database_url: str = None):
+    # Antes de importar la app: models.py y almacenamiento.py leen el entorno al importarse
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{tmp}/bench.db"
+    os.environ["ALMACEN"] = "local"
+    os.environ["ALMACEN_LOCAL_DIR"] = os.path.join(tmp, "almacen")
+    os.environ.setdefault("LOGIN_MAX_FALLOS_IP", str(10 ** 9))
+    os.chdir(tmp)  # uploads/ se escribe en el directorio actual
+
+
+# --- MEDICIÓN ---
+
+def _percentil(ordenadas: list, p: float) -> float:
+    if len(ordenadas) == 1:
+        return ordenadas[0]
+    return statistics.quantiles(ordenadas, n=100, method="inclusive")[int(p) - 1]
+
+
+def resumen(latencias: list, estados: Counter, duracion: float, concurrencia: int) -> dict:
+    ordenadas = sorted(latencias)
+    ms = lambda s: round(s * 1000, 2)
+    return {
+        "n": len(latencias),
+        "concurrencia": concurrencia,
+        "estados": {str(k): v for k, v in sorted(estados.items())},
+        "errores": sum(v for k, v in estados.items() if k >= 400),
+        "rps": round(len(latencias) / duracion, 2) if duracion else None,
+        "p50_ms": ms(_percentil(ordenadas, 50)),
+        "p95_ms": ms(_percentil(ordenadas, 95)),
+        "p99_ms": ms(_percentil(ordenadas, 99)),
+        "media_ms": ms(statistics.fmean(ordenadas)),
+        "max_ms": ms(ordenadas[-1]),
+    }
+
+
+async def medir(cliente, peticion, n: int, concurrencia: int, calentamiento: int = 3) -> dict:
+    """`peticion(cliente, i)` hace una petición y devuelve la respuesta."""
+    for i in range(calentamiento):
+        await peticion(cliente, -1 - i)
+
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias, estados = [], Counter()
+
+    async def una(i):
+        async with semaforo:
+            t = time.perf_counter()
+            respuesta = await peticion(cliente, i)
+            latencias.append(time.perf_counter() - t)
+            estados[respuesta.status_code] += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(i) for i in range(n)))
+    return resumen(latencias, estados, time.perf_counter() - inicio, concurrencia)
+
+
+# --- DATOS ---
+
+def pdf_de_tamano(base: bytes, tamano: int) -> bytes:
+    """La factura `base` con un adjunto aleatorio hasta rondar `tamano` bytes."""
+    from pypdf import PdfReader, PdfWriter
+    escritor = PdfWriter(clone_from=PdfReader(io.BytesIO(base)))
+    relleno = tamano - len(base)
+    if relleno > 0:
+        escritor.add_attachment("relleno.bin", os.urandom(relleno))
+    salida = io.BytesIO()
+    escritor.write(salida)
+    return salida.getvalue()
+
+
+def preparar_usuario(db, email: str, plan: str = "Benchmark") -> int:
+    """Usuario con un plan sin límite práctico (no se tocan los planes existentes)."""
+    from models import Usuario, Suscripcion, PlanLimite
+    from autenticacion import hashear_password
+    if db.get(PlanLimite, plan) is None:
+        db.add(PlanLimite(plan=plan, facturas_mes=10 ** 9))
+    usuario = db.query(Usuario).filter(Usuario.email == email).first()
+    if usuario is None:
+        usuario = Usuario(email=email, hashed_password=hashear_password(PASSWORD))
+        db.add(usuario)
+        db.flush()
+    db.add(Suscripcion(usuario_id=usuario.id, plan=plan))
+    db.commit()
+    return usuario.id
+
+
+def sembrar_historial(db, usuario_id: int, filas: int, lote: int = 5000):
+    """Registros directos en la tabla (sin cadena ni PDF): solo para medir listados."""
+    from sqlalchemy import insert
+    from models import RegistroFactura
+    inicio = datetime.utcnow() - timedelta(seconds=filas)
+    for desde in range(0, filas, lote):
+        db.execute(insert(RegistroFactura), [
+            {
+                "nombre_archivo": f"H-{i}.pdf", "numero_factura": f"H-{i}", "cliente": "Histórico",
+                "total": 100.0, "tipo": "Alta", "estado": "Válida", "fecha_subida": inicio + timedelta(seconds=i),
+                "hash_anterior": "0" * 64, "hash_actual": secrets.token_hex(32),
+                "datos_qr": "", "usuario_id": usuario_id,
+            }
+            for i in range(desde, min(desde + lote, filas))
+        ])
+    db.commit()
+
+
+# --- ESCENARIOS ---
+
+async def ejecutar(args) -> dict:
+    import httpx
+    import main
+    from models import SessionLocal
+
+    sufijo = secrets.token_hex(4)  # no chocar con ejecuciones anteriores en la misma base
+    email = f"bench-{sufijo}@inaltera.local"
+    db = SessionLocal()
+    try:
+        preparar_usuario(db, email)
+    finally:
+        db.close()
+    cabeceras = {"Authorization": f"Bearer {main.crear_token_acceso({'sub': email})}"}
+
+    resultados = {}
+    transporte = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=None) as cliente:
+
+        async def escenario(nombre, peticion, n=args.n):
+            print(f"  {nombre}...", file=sys.stderr)
+            resultados[nombre] = await medir(cliente, peticion, n, args.concurrencia)
+
+        if "login" in args.escenario:
+            await escenario("login", lambda c, i: c.post("/api/login", data={"username": email, "password": PASSWORD}))
+
+        hashes = []
+        if "emitir" in args.escenario or "verificar" in args.escenario:
+            async def emitir(c, i):
+                r = await c.post("/api/emitir", json=FACTURA, headers=cabeceras)
+                if r.status_code == 200:
+                    hashes.append(r.json()["datos_trazabilidad"]["hash"])
+                return r
+            await escenario("emitir", emitir)
+
+        if "subir" in args.escenario:
+            from pdf_factura import generar_pdf_fisico
+            from schemas import DatosFactura
+            base = generar_pdf_fisico(DatosFactura(**FACTURA), None)
+            for nombre, tamano in args.tamanos.items():
+                pdf = pdf_de_tamano(base, tamano)
+                formulario = {"numero": "EXT-1", "cliente": "Proveedor", "total": "121.0", "fecha": datetime.utcnow().strftime("%Y-%m-%d")}
+                await escenario(
+                    f"subir_{nombre}",
+                    lambda c, i, pdf=pdf: c.post("/api/subir-factura", headers=cabeceras, data=formulario,
+                                                 files={"file": ("externa.pdf", pdf, "application/pdf")}),
+                    n=max(10, args.n // 10) if tamano >= 1024 * 1024 else args.n,
+                )
+
+        if "verificar" in args.escenario and hashes:
+            await escenario("verificar_existente", lambda c, i: c.get(f"/api/verificar-hash/{hashes[i % len(hashes)]}"))
+            await escenario("verificar_inexistente", lambda c, i: c.get(f"/api/verificar-hash/{secrets.token_hex(32)}"))
+
+        if "registros" in args.escenario:
+            for profundidad in args.profundidades:
+                email_h = f"bench-{sufijo}-{profundidad}@inaltera.local"
+                db = SessionLocal()
+                try:
+                    t = time.perf_counter()
+                    sembrar_historial(db, preparar_usuario(db, email_h), profundidad)
+                    print(f"  historial de {profundidad} registros sembrado en {time.perf_counter() - t:.1f}s", file=sys.stderr)
+                finally:
+                    db.close()
+                cab = {"Authorization": f"Bearer {main.crear_token_acceso({'sub': email_h})}"}
+                await escenario(f"registros_{profundidad}_pagina", lambda c, i, cab=cab: c.get("/api/registros", params={"limite": 50}, headers=cab))
+                await escenario(f"registros_{profundidad}_pagina_fecha", lambda c, i, cab=cab: c.get("/api/registros", params={"limite": 50, "orden": "-fecha"}, headers=cab))
+                if profundidad <= COMPLETO_MAX:
+                    await escenario(f"registros_{profundidad}_completo", lambda c, i, cab=cab: c.get("/api/registros", headers=cab), n=max(5, args.n // 20))
+
+    return resultados
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def comparar(base: dict, actual: dict, tolerancia: float) -> list:
+    """Escenarios que empeoran más de `tolerancia` en p95 o en peticiones/s."""
+    regresiones = []
+    for nombre, nuevo in actual["resultados"].items():
+        previo = base.get("resultados", {}).get(nombre)
+        if previo is None:
+            continue
+        if nuevo["p95_ms"] > previo["p95_ms"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {previo['p95_ms']} -> {nuevo['p95_ms']} ms")
+        if previo["rps"] and nuevo["rps"] < previo["rps"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: {previo['rps']} -> {nuevo['rps']} peticiones/s")
+    return regresiones
+
+
+def _tamanos(texto: str) -> dict:
+    unidades = {"k": 1024, "m": 1024 * 1024}
+    return {t: int(t[:-1]) * unidades[t[-1]] if t[-1] in unidades else int(t) for t in texto.lower().split(",")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo de la API de INALTERA")
+    parser.add_argument("-n", type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument("-c", "--concurrencia", type=int, default=8, help="Peticiones simultáneas")
+    parser.add_argument("--escenario", choices=ESCENARIOS, action="append", help="Escenario a medir (por defecto, todos)")
+    parser.add_argument("--tamanos", type=_tamanos, default=",".join(TAMANOS_PDF), help="Tamaños de PDF para subir-factura (p. ej. 10k,1m,10m)")
+    parser.add_argument("--profundidades", type=lambda s: [int(x) for x in s.split(",")], default=list(PROFUNDIDADES), help="Registros de historial para /api/registros")
+    parser.add_argument("--database-url", help="Base de datos a usar (por defecto, una SQLite temporal)")
+    parser.add_argument("--salida", help="Fichero JSON de resultados (por defecto, a la salida estándar)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior con la que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Empeoramiento admitido al comparar (0.2 = 20%%)")
+    args = parser.parse_args()
+    args.escenario = args.escenario or list(ESCENARIOS)
+    # Se trabaja dentro del directorio temporal: las rutas del usuario, absolutas
+    args.salida = args.salida and os.path.abspath(args.salida)
+    args.comparar = args.comparar and os.path.abspath(args.comparar)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _entorno(tmp, args.database_url)
+        from fastapi.testclient import TestClient
+        import main
+        from arranque import arranque
+        from autenticacion import BCRYPT_ROUNDS
+        from models import engine
+
+        # TestClient solo para el ciclo de vida (startup/shutdown); las peticiones van por httpx
+        with TestClient(main.app):
+            arranque.esperar()  # que el calentamiento no se mezcle con las medidas
+            inicio = time.perf_counter()
+            resultados = asyncio.run(ejecutar(args))
+            duracion = time.perf_counter() - inicio
+
+    informe = {
+        "meta": {
+            "fecha": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "cpus": os.cpu_count(),
+            "base_datos": engine.dialect.name,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "n": args.n,
+            "concurrencia": args.concurrencia,
+            "duracion_s": round(duracion, 2),
+        },
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            regresiones = comparar(json.load(f), informe, args.tolerancia)
+        for r in regresiones:
+            print(f"❌ Regresión: {r}", file=sys.stderr)
+        raise SystemExit(1 if regresiones else 0)
@@ -0,0 +1,128 @@
+# backend/bench_arranque.py
+# Mide el arranque en frío de un worker: importación por subsistema, tiempo hasta que
+# /api/salud responde y tiempo hasta terminar el calentamiento (arranque.py).
+#
+# Cada repetición es un proceso nuevo (importaciones en frío). Por defecto usa una base
+# SQLite temporal y ALMACEN=ninguno para no depender de la red; con --database-url se
+# mide contra una base existente (migraciones ya aplicadas, filtro con datos reales).
+#
+# Uso: python bench_arranque.py [-n 5] [--database-url URL] [--json]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# En el orden en que los carga main.py; se mide lo que añade cada uno
+SUBSISTEMAS = [
+    "fastapi", "sqlalchemy.orm", "pydantic", "models", "schemas", "metricas", "cadena", "bitacora",
+    "ejecutores", "almacenamiento", "subidas", "enlaces", "verificador", "merkle",
+    "autenticacion", "paginacion", "uso", "empresas", "totales", "exportacion", "migraciones", "arranque", "main",
+]
+# Lo que main.py ya no importa al arrancar (se mide aparte, tras "main")
+DIFERIDOS = ["jwt", "passlib.context", "numpy", "filtro_hashes", "pdf_factura"]
+
+
+def _hijo():
+    inicio = time.perf_counter()
+    importacion = {}
+    for modulo in SUBSISTEMAS:
+        t = time.perf_counter()
+        __import__(modulo)
+        importacion[modulo] = time.perf_counter() - t
+    total_importacion = time.perf_counter() - inicio
+    cargados = [m for m in DIFERIDOS if m in sys.modules]
+
+    from fastapi.testclient import TestClient
+    import main
+    from arranque import arranque
+
+    with TestClient(main.app) as cliente:
+        respuesta = cliente.get("/api/salud")
+        listo = time.perf_counter() - inicio
+        assert respuesta.status_code == 200, respuesta.text
+        arranque.esperar()
+        caliente = time.perf_counter() - inicio
+        calentamiento = dict(arranque.tiempos)
+
+    diferidos = {}
+    for modulo in DIFERIDOS:
+        t = time.perf_counter()
+        __import__(modulo)  # ya importados por el calentamiento: deberían salir ~0
+        diferidos[modulo] = time.perf_counter() - t
+
+    print(json.dumps({
+        "importacion": importacion,
+        "importacion_total": total_importacion,
+        "diferidos_cargados_al_importar": cargados,
+        "salud": listo,
+        "caliente": caliente,
+        "calentamiento": calentamiento,
+        "diferidos_tras_calentar": diferidos,
+    }))
+
+
+def _mediana(valores):
+    return round(statistics.median(valores) * 1000, 1)
+
+
+def medir(repeticiones: int, database_url: str = None) -> dict:
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    resultados = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(repeticiones):
+            entorno = dict(os.environ)
+            entorno.setdefault("ALMACEN", "ninguno")
+            entorno["DATABASE_URL"] = database_url or f"sqlite:///{tmp}/bench_{i}.db"
+            salida = subprocess.run(
+                [sys.executable, "-W", "ignore", os.path.abspath(__file__), "--hijo"],
+                cwd=tmp, env={**entorno, "PYTHONPATH": directorio}, capture_output=True, text=True, check=True,
+            )
+            resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    return {
+        "repeticiones": repeticiones,
+        "importacion_ms": {m: _mediana([r["importacion"][m] for r in resultados]) for m in SUBSISTEMAS},
+        "importacion_total_ms": _mediana([r["importacion_total"] for r in resultados]),
+        "diferidos_cargados_al_importar": sorted({m for r in resultados for m in r["diferidos_cargados_al_importar"]}),
+        "hasta_salud_ms": _mediana([r["salud"] for r in resultados]),
+        "hasta_caliente_ms": _mediana([r["caliente"] for r in resultados]),
+        "calentamiento_ms": {
+            paso: _mediana([r["calentamiento"].get(paso, 0) for r in resultados])
+            for paso in resultados[0]["calentamiento"]
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide el arranque en frío de la API de INALTERA")
+    parser.add_argument("-n", type=int, default=5, help="Repeticiones (procesos nuevos)")
+    parser.add_argument("--database-url", help="Base de datos a usar (por defecto, una SQLite temporal por repetición)")
+    parser.add_argument("--json", action="store_true", help="Salida en JSON")
+    parser.add_argument("--hijo", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        _hijo()
+        raise SystemExit(0)
+
+    informe = medir(args.n, args.database_url)
+    if args.json:
+        print(json.dumps(informe, indent=2))
+        raise SystemExit(0)
+    print(f"Mediana de {informe['repeticiones']} arranques en frío (ms)")
+    print("\nImportación (lo que añade cada módulo):")
+    for modulo, ms in informe["importacion_ms"].items():
+        print(f"  {modulo:<16} {ms:>8}")
+    print(f"  {'TOTAL':<16} {informe['importacion_total_ms']:>8}")
+    if informe["diferidos_cargados_al_importar"]:
+        print(f"\n⚠️  Cargados al importar (deberían ser diferidos): {', '.join(informe['diferidos_cargados_al_importar'])}")
+    print(f"\nHasta /api/salud:        {informe['hasta_salud_ms']:>8}")
+    print(f"Hasta fin calentamiento: {informe['hasta_caliente_ms']:>8}")
+    print("\nCalentamiento (en segundo plano):")
+    for paso, ms in informe["calentamiento_ms"].items():
+        print(f"  {paso:<16} {ms:>8}")
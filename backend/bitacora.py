@@ -0,0 +1,237 @@
+# backend/bitacora.py
+# Registro de eventos en la cadena de la bitácora (ChainLogs).
+#
+# Dos modos, elegidos con BITACORA_MODO:
+#  - "sincrono" (por defecto): cada evento se encadena y confirma en la misma petición.
+#  - "agrupado": los eventos se encolan en memoria y un hilo escritor los encadena en
+#    orden de llegada, confirmando cada lote en UNA transacción (group commit). Un lote
+#    se escribe como mucho BITACORA_ESPERA_MS después de su primer evento, y al apagar
+#    la aplicación se vacía la cola antes de salir.
+#
+# Ningún evento se descarta: un lote que no se confirma tras BITACORA_REINTENTOS
+# intentos se guarda en un archivo de BITACORA_RESPALDO_DIR (escritura atómica con
+# fsync) y el escritor lo vuelve a anexar cada BITACORA_RESPALDO_S y al arrancar, también
+# los que dejaron otros procesos o un reinicio. Cada archivo se reclama renombrándolo,
+# como las subidas del outbox: solo un proceso lo escribe en la cadena.
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, EventoBitacora
+from cadena import anexar, calcular_hash, CADENA_BITACORA
+from metricas import ETAPAS
+
+BITACORA_MODO = os.getenv("BITACORA_MODO", "sincrono")
+BITACORA_ESPERA_MS = int(os.getenv("BITACORA_ESPERA_MS", "50"))
+BITACORA_LOTE_MAX = int(os.getenv("BITACORA_LOTE_MAX", "500"))
+BITACORA_REINTENTOS = int(os.getenv("BITACORA_REINTENTOS", "5"))
+BITACORA_RESPALDO_DIR = os.getenv("BITACORA_RESPALDO_DIR", "bitacora_pendiente")
+BITACORA_RESPALDO_S = float(os.getenv("BITACORA_RESPALDO_S", "30"))
+BITACORA_RESPALDO_PLAZO_S = 300 # un archivo reclamado más antiguo se da por abandonado
+
+_FIN = object()
+
+
+def _construir_eventos(eventos: list):
+    """Devuelve el `construir` de `cadena.anexar` para una lista de eventos ya fechados."""
+    def construir(prev_hash):
+        objetos = []
+        for fecha, categoria, descripcion, nivel, usuario_id in eventos:
+            # Contenido a hashear: Timestamp + Datos (el timestamp se guarda tal cual en "fecha")
+            contenido = f"{fecha.isoformat()}{categoria}{descripcion}{usuario_id}".encode('utf-8')
+            nuevo_hash = calcular_hash(contenido, prev_hash)
+            objetos.append(EventoBitacora(
+                fecha=fecha,
+                categoria=categoria,
+                descripcion=descripcion,
+                nivel=nivel,
+                hash_anterior=prev_hash,
+                hash_actual=nuevo_hash,
+                usuario_id=usuario_id
+            ))
+            prev_hash = nuevo_hash
+        return prev_hash, objetos
+    return construir
+
+
+class EscritorBitacora:
+    """Hilo que agrupa los eventos encolados y los confirma por lotes."""
+
+    def __init__(self, session_factory=SessionLocal, espera_ms: int = BITACORA_ESPERA_MS, lote_max: int = BITACORA_LOTE_MAX,
+                 respaldo: str = BITACORA_RESPALDO_DIR):
+        self.session_factory = session_factory
+        self.espera = espera_ms / 1000
+        self.lote_max = lote_max
+        self.respaldo = Path(respaldo)
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def encolar(self, evento: tuple):
+        if self._hilo is None:
+            self.iniciar()
+        self._cola.put(evento)
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name="escritor-bitacora", daemon=True)
+                self._hilo.start()
+
+    def detener(self, timeout: float = 30):
+        """Vacía la cola de forma durable y para el hilo escritor."""
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        if hilo is None:
+            return
+        self._cola.put(_FIN)
+        hilo.join(timeout)
+
+    def _bucle(self):
+        self._reintentar_respaldo()  # lotes pendientes de antes de arrancar
+        proximo_respaldo = time.monotonic() + BITACORA_RESPALDO_S
+        terminar = False
+        while not terminar:
+            try:
+                primero = self._cola.get(timeout=BITACORA_RESPALDO_S)
+            except queue.Empty:
+                primero = None
+            if time.monotonic() >= proximo_respaldo:
+                self._reintentar_respaldo()
+                proximo_respaldo = time.monotonic() + BITACORA_RESPALDO_S
+            if primero is None:
+                continue
+            if primero is _FIN:
+                break
+            lote = [primero]
+            limite = time.monotonic() + self.espera
+            while len(lote) < self.lote_max:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    evento = self._cola.get(timeout=restante)
+                except queue.Empty:
+                    break
+                if evento is _FIN:
+                    terminar = True
+                    break
+                lote.append(evento)
+            self._escribir(lote)
+        # Lo que quede en la cola tras la señal de fin también se escribe
+        resto = []
+        while True:
+            try:
+                evento = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if evento is not _FIN:
+                resto.append(evento)
+        for i in range(0, len(resto), self.lote_max):
+            self._escribir(resto[i:i + self.lote_max])
+
+    def _escribir(self, lote: list):
+        for intento in range(BITACORA_REINTENTOS):
+            if self._anexar(lote, intento + 1):
+                return
+            time.sleep(min(0.1 * 2 ** intento, 5))
+        self._a_respaldo(lote)
+
+    def _anexar(self, lote: list, intento: int = 1) -> bool:
+        db = self.session_factory()
+        try:
+            with ETAPAS.medir("bitacora_lote"):
+                anexar(db, CADENA_BITACORA, _construir_eventos(lote))
+            return True
+        except Exception as e:
+            print(f"❌ Error escribiendo lote de bitácora ({len(lote)} eventos, intento {intento}): {e}")
+            return False
+        finally:
+            db.close()
+
+    def _a_respaldo(self, lote: list):
+        # El nombre ordena los archivos por momento del fallo
+        self.respaldo.mkdir(parents=True, exist_ok=True)
+        destino = self.respaldo / f"{time.time_ns()}-{os.getpid()}.jsonl"
+        temporal = destino.with_suffix(".tmp")
+        with open(temporal, "w", encoding="utf-8") as f:
+            for fecha, categoria, descripcion, nivel, usuario_id in lote:
+                f.write(json.dumps([fecha.isoformat(), categoria, descripcion, nivel, usuario_id], ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, destino)
+        print(f"⚠️ Lote de bitácora ({len(lote)} eventos) guardado en {destino}; se reintentará")
+
+    def reintentar_respaldo(self) -> int:
+        """Anexa a la cadena los lotes guardados en el respaldo. Devuelve cuántos eventos escribió."""
+        if not self.respaldo.is_dir():
+            return 0
+        # Reclamados por un proceso que no terminó (se cayó a mitad): vuelven a estar libres
+        for reclamado in self.respaldo.glob("*.jsonl.*"):
+            try:
+                if time.time() - reclamado.stat().st_mtime > BITACORA_RESPALDO_PLAZO_S:
+                    os.replace(reclamado, reclamado.with_name(reclamado.name.split(".jsonl.")[0] + ".jsonl"))
+            except FileNotFoundError:
+                pass
+        escritos = 0
+        for archivo in sorted(self.respaldo.glob("*.jsonl")):
+            reclamado = archivo.with_name(f"{archivo.name}.{os.getpid()}")
+            try:
+                os.replace(archivo, reclamado)  # solo un proceso lo consigue
+            except FileNotFoundError:
+                continue
+            os.utime(reclamado)
+            with open(reclamado, encoding="utf-8") as f:
+                lote = [(datetime.fromisoformat(fecha), categoria, descripcion, nivel, usuario_id)
+                        for fecha, categoria, descripcion, nivel, usuario_id in map(json.loads, f)]
+            if not self._anexar(lote):
+                os.replace(reclamado, archivo)  # la base de datos sigue sin responder
+                break
+            reclamado.unlink()
+            escritos += len(lote)
+        return escritos
+
+    def _reintentar_respaldo(self):
+        try:
+            escritos = self.reintentar_respaldo()
+            if escritos:
+                print(f"✅ Bitácora: {escritos} eventos del respaldo escritos en la cadena")
+        except Exception as e:
+            print(f"❌ Error reintentando el respaldo de la bitácora: {e}")
+
+
+escritor = EscritorBitacora()
+atexit.register(escritor.detener)
+
+
+def registrar_evento(db: Session, categoria: str, descripcion: str, nivel: str = "INFO", usuario_id: int = None):
+    """
+    Crea un registro inalterable en la cadena de eventos (Bitácora).
+    """
+    evento = (datetime.utcnow(), categoria, descripcion, nivel, usuario_id)
+    if BITACORA_MODO == "agrupado":
+        escritor.encolar(evento)
+    else:
+        anexar(db, CADENA_BITACORA, _construir_eventos([evento]))
+
+
+def registrar_evento_diferido(categoria: str, descripcion: str, nivel: str = "INFO", usuario_id: int = None):
+    """
+    Igual que `registrar_evento`, para BackgroundTasks: se ejecuta después de enviar
+    la respuesta y abre su propia sesión (la de la petición ya está cerrada).
+    """
+    db = SessionLocal()
+    try:
+        registrar_evento(db, categoria, descripcion, nivel, usuario_id)
+    except Exception as e:
+        print(f"❌ Error registrando evento diferido ({categoria}): {e}")
+    finally:
+        db.close()
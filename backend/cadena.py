@@ -0,0 +1,122 @@
+# backend/cadena.py
+# Cabezas de cadena: anexado O(1) y consistente entre workers.
+#
+# Cada cliente (usuario_id) tiene su propia cadena de facturas y la bitácora tiene
+# la suya. El hash anterior se lee de la fila de "cabezas_cadena" (bloqueada con
+# SELECT ... FOR UPDATE en PostgreSQL) y se actualiza con compare-and-swap sobre
+# "version", así dos peticiones concurrentes nunca bifurcan la misma cadena y
+# clientes distintos no compiten por la misma fila.
+#
+# Cada cadena nueva empieza en su propio génesis (derivado de su id): dos clientes
+# que registran los mismos datos no llegan al mismo hash, y un hash_actual identifica
+# un único registro. HASH_GENESIS es el génesis de la cadena global anterior.
+
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from models import CabezaCadena, RegistroFactura, EventoBitacora
+from metricas import CADENA_COMMIT, CADENA_CONFLICTOS, CADENA_ESPERA, tipo_cadena
+
+HASH_GENESIS = "0" * 64 # legado: génesis de la cadena única anterior a las cadenas por usuario
+CADENA_BITACORA = "bitacora"
+MAX_REINTENTOS = 8
+
+
+class ConflictoCadena(Exception):
+    """La cabeza de la cadena cambió en todos los reintentos (demasiada concurrencia)."""
+
+
+def calcular_hash(contenido_archivo: bytes, hash_anterior: str) -> str:
+    bloque_a_hashear = contenido_archivo + hash_anterior.encode('utf-8')
+    return hashlib.sha256(bloque_a_hashear).hexdigest()
+
+
+def cadena_facturas(usuario_id: int) -> str:
+    return f"facturas:{usuario_id}"
+
+
+def genesis(cadena: str) -> str:
+    """hash_anterior del primer eslabón de una cadena nueva."""
+    return hashlib.sha256(f"{cadena}:genesis".encode('utf-8')).hexdigest()
+
+
+def _hash_semilla(db: Session, cadena: str) -> str:
+    # La primera vez que se usa una cabeza continuamos desde el último registro
+    # existente, para no romper los datos anteriores a esta tabla; sin registros,
+    # la cadena empieza en su propio génesis.
+    if cadena == CADENA_BITACORA:
+        ultimo = db.query(EventoBitacora.hash_actual).order_by(EventoBitacora.id.desc()).first()
+    else:
+        usuario_id = int(cadena.split(":", 1)[1])
+        ultimo = db.query(RegistroFactura.hash_actual).filter(
+            RegistroFactura.usuario_id == usuario_id
+        ).order_by(RegistroFactura.id.desc()).first()
+    return ultimo[0] if ultimo else genesis(cadena)
+
+
+def _crear_cabeza(db: Session, cadena: str):
+    # Sesión aparte para no confirmar cambios pendientes de la petición
+    with Session(bind=db.get_bind()) as s:
+        try:
+            s.add(CabezaCadena(cadena=cadena, ultimo_hash=_hash_semilla(s, cadena), version=0))
+            s.commit()
+        except IntegrityError:
+            # Otro worker la creó a la vez: nos vale la suya
+            s.rollback()
+
+
+def _leer_cabeza(db: Session, cadena: str) -> CabezaCadena:
+    consulta = db.query(CabezaCadena).filter(CabezaCadena.cadena == cadena).with_for_update().populate_existing()
+    cabeza = consulta.first()
+    if cabeza is None:
+        _crear_cabeza(db, cadena)
+        cabeza = consulta.first()
+    return cabeza
+
+
+def anexar(db: Session, cadena: str, construir) -> list:
+    """
+    Anexa uno o varios eslabones a la cadena y confirma la transacción.
+
+    `construir(hash_anterior)` devuelve `(ultimo_hash, objetos)`: los objetos ORM a
+    insertar (ya encadenados entre sí) y el hash que pasa a ser la nueva cabeza.
+    Si otra petición movió la cabeza entre la lectura y la escritura se deshace
+    todo y se vuelve a llamar a `construir` con el hash correcto.
+    """
+    error_bloqueo = None
+    tipo = tipo_cadena(cadena)
+    for _ in range(MAX_REINTENTOS):
+        try:
+            with CADENA_ESPERA.medir(tipo):
+                cabeza = _leer_cabeza(db, cadena)
+            ultimo_hash, objetos = construir(cabeza.ultimo_hash)
+            db.add_all(objetos)
+            resultado = db.execute(
+                update(CabezaCadena)
+                .where(CabezaCadena.cadena == cadena, CabezaCadena.version == cabeza.version)
+                .values(
+                    ultimo_hash=ultimo_hash,
+                    version=CabezaCadena.version + 1,
+                    fecha_actualizacion=datetime.utcnow(),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if resultado.rowcount == 1:
+                with CADENA_COMMIT.medir(tipo):
+                    db.commit()
+                return objetos
+        except OperationalError as e:
+            # SQLite bloqueado por otro escritor: se trata como un CAS fallido
+            error_bloqueo = e
+        except Exception:
+            db.rollback()
+            raise
+        db.rollback()
+        CADENA_CONFLICTOS.inc(tipo)
+    if error_bloqueo is not None:
+        raise error_bloqueo
+    raise ConflictoCadena(cadena)
@@ -0,0 +1,97 @@
+# backend/ejecutores.py
+# Capa de ejecutores para sacar el trabajo pesado del event loop de asyncio.
+#
+#  - Pool de HILOS (EJECUTOR_HILOS): E/S bloqueante (sesión SQLAlchemy, disco, Supabase).
+#  - Pool de PROCESOS (PDF_PROCESOS): CPU (renderizado y estampado de PDFs con
+#    reportlab/pypdf), que con hilos seguiría compitiendo por el GIL.
+#    Con PDF_PROCESOS=0 el trabajo de CPU va también al pool de hilos (útil en
+#    máquinas de 1 CPU o en entornos que no permiten procesos hijo).
+
+import asyncio
+import functools
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+EJECUTOR_HILOS = int(os.getenv("EJECUTOR_HILOS", "16"))
+PDF_PROCESOS = int(os.getenv("PDF_PROCESOS", str(os.cpu_count() or 1)))
+
+_pool_hilos = None
+_pool_procesos = None
+_lock = threading.Lock()
+
+
+def pool_hilos() -> ThreadPoolExecutor:
+    global _pool_hilos
+    with _lock:
+        if _pool_hilos is None:
+            _pool_hilos = ThreadPoolExecutor(max_workers=EJECUTOR_HILOS, thread_name_prefix="inaltera-io")
+        return _pool_hilos
+
+
+def pool_procesos():
+    # Se crea en el primer uso: arrancar procesos cuesta y no todos los workers emiten
+    global _pool_procesos
+    if PDF_PROCESOS <= 0:
+        return pool_hilos()
+    with _lock:
+        if _pool_procesos is None:
+            _pool_procesos = ProcessPoolExecutor(
+                max_workers=PDF_PROCESOS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool_procesos
+
+
+async def en_hilo(funcion, *args, **kwargs):
+    """Ejecuta E/S bloqueante en el pool de hilos sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool_hilos(), functools.partial(funcion, *args, **kwargs))
+
+
+async def en_proceso(funcion, *args):
+    """Ejecuta trabajo de CPU en el pool de procesos. `funcion` y sus argumentos deben
+    poder serializarse con pickle (funciones de módulo y schemas, no objetos ORM)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool_procesos(), funcion, *args)
+
+
+def en_proceso_sync(funcion, *args):
+    """Igual que `en_proceso`, para endpoints síncronos (ya corren en un hilo)."""
+    return pool_procesos().submit(funcion, *args).result()
+
+
+async def mapear_en_procesos(funcion, *iterables) -> list:
+    """Como `map`, pero repartido en el pool de procesos y sin bloquear el event loop.
+    Los resultados se devuelven en el mismo orden que la entrada."""
+    return await asyncio.gather(*[en_proceso(funcion, *args) for args in zip(*iterables)])
+
+
+async def mapear_en_hilos(funcion, *iterables) -> list:
+    return await asyncio.gather(*[en_hilo(funcion, *args) for args in zip(*iterables)])
+
+
+def _importar(modulos):
+    for modulo in modulos:
+        importlib.import_module(modulo)
+
+
+def calentar_procesos(*modulos):
+    """Arranca los procesos del pool y les importa `modulos` antes del primer trabajo."""
+    if PDF_PROCESOS <= 0:
+        return
+    pool = pool_procesos()
+    for futuro in [pool.submit(_importar, modulos) for _ in range(PDF_PROCESOS)]:
+        futuro.result()
+
+
+def cerrar():
+    global _pool_hilos, _pool_procesos
+    with _lock:
+        pools = [_pool_procesos, _pool_hilos]
+        _pool_hilos = _pool_procesos = None
+    for pool in pools:
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -0,0 +1,62 @@
+# backend/empresas.py
+# Configuración de empresa en memoria.
+#
+# Cada emisión necesita los datos del emisor (razón social, NIF, dirección, web). Se
+# guardan como DatosEmpresa (plano, se puede enviar al pool de procesos) en un TTLCache
+# por usuario_id: con la caché caliente no se consulta ConfiguracionEmpresa. guardar_config
+# invalida la entrada tras el commit (y los eventos del mapper en cualquier otro cambio);
+# entre workers distintos la entrada caduca como mucho a los EMPRESA_CACHE_TTL_S.
+#
+# La plantilla del PDF (pdf_factura.py) se cachea en cada proceso por el contenido de
+# estos datos, así que al cambiarlos no hace falta invalidarla.
+
+import os
+import threading
+from typing import Optional
+
+from cachetools import TTLCache
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import ConfiguracionEmpresa
+from schemas import DatosEmpresa
+
+EMPRESA_CACHE_TTL_S = int(os.getenv("EMPRESA_CACHE_TTL_S", "300"))
+EMPRESA_CACHE_MAX = int(os.getenv("EMPRESA_CACHE_MAX", "10000"))
+
+_SIN_CACHE = object()
+_cache = TTLCache(maxsize=EMPRESA_CACHE_MAX, ttl=EMPRESA_CACHE_TTL_S)
+_lock = threading.Lock()
+
+
+def datos_empresa(config: Optional[ConfiguracionEmpresa]) -> Optional[DatosEmpresa]:
+    # Copia plana de la configuración, serializable para el pool de procesos
+    if not config:
+        return None
+    return DatosEmpresa(razon_social=config.razon_social, nif=config.nif, direccion=config.direccion, web=config.web)
+
+
+def obtener_empresa(db: Session, usuario_id: int) -> Optional[DatosEmpresa]:
+    """Datos de empresa del usuario (None si no la configuró), de la caché si están."""
+    with _lock:
+        empresa = _cache.get(usuario_id, _SIN_CACHE)
+    if empresa is not _SIN_CACHE:
+        return empresa
+    config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.usuario_id == usuario_id).first()
+    empresa = datos_empresa(config)
+    with _lock:
+        _cache[usuario_id] = empresa
+    return empresa
+
+
+def invalidar_empresa(*usuario_ids: int):
+    with _lock:
+        for usuario_id in usuario_ids:
+            _cache.pop(usuario_id, None)
+
+
+@event.listens_for(ConfiguracionEmpresa, "after_insert")
+@event.listens_for(ConfiguracionEmpresa, "after_update")
+@event.listens_for(ConfiguracionEmpresa, "after_delete")
+def _invalidar_al_cambiar(mapper, connection, config):
+    invalidar_empresa(config.usuario_id)
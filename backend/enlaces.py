@@ -0,0 +1,79 @@
+# backend/enlaces.py
+# Enlaces de descarga de los PDFs en la nube, cacheados por registro.
+#
+# Resolver una URL cuesta una llamada a Supabase (firmada) o al menos construirla
+# (pública). Se guardan en un TLRUCache hasta ENLACES_MARGEN_S antes de que caduquen,
+# así que abrir el listado de facturas repetidas veces no vuelve a la API, y las
+# que faltan se firman todas en UNA llamada (create_signed_urls).
+#
+# ENLACES_FIRMADOS=1 para buckets privados; por defecto el bucket es público.
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from cachetools import TLRUCache
+
+from almacenamiento import obtener_almacen, ruta_en_nube
+
+ENLACES_FIRMADOS = os.getenv("ENLACES_FIRMADOS", "0") == "1"
+ENLACES_CADUCIDAD_S = int(os.getenv("ENLACES_CADUCIDAD_S", "3600"))
+ENLACES_MARGEN_S = int(os.getenv("ENLACES_MARGEN_S", "60")) # no servimos enlaces a punto de caducar
+ENLACES_CACHE_MAX = int(os.getenv("ENLACES_CACHE_MAX", "10000"))
+
+
+@dataclass(frozen=True)
+class Enlace:
+    url: str
+    caduca: datetime     # para el cliente (UTC)
+    caduca_mono: float   # para la caché (reloj monotónico)
+
+
+def _vigencia(clave, enlace: Enlace, ahora: float) -> float:
+    return enlace.caduca_mono - ENLACES_MARGEN_S
+
+
+_cache = TLRUCache(maxsize=ENLACES_CACHE_MAX, ttu=_vigencia)
+_lock = threading.Lock()
+
+
+def _resolver(rutas: List[str]) -> Dict[str, Enlace]:
+    almacen = obtener_almacen()
+    caduca = datetime.utcnow() + timedelta(seconds=ENLACES_CADUCIDAD_S)
+    caduca_mono = time.monotonic() + ENLACES_CADUCIDAD_S
+    if ENLACES_FIRMADOS:
+        urls = almacen.urls_firmadas(rutas, ENLACES_CADUCIDAD_S)
+    else:
+        urls = {ruta: almacen.url_publica(ruta) for ruta in rutas}
+    return {ruta: Enlace(url, caduca, caduca_mono) for ruta, url in urls.items()}
+
+
+def enlaces_nube(registros: list) -> Dict[int, Enlace]:
+    """
+    Enlace vigente para cada registro (solo los ya subidos a la nube). Devuelve
+    {registro_id: Enlace}; un registro falta si la nube no pudo firmarlo.
+    """
+    rutas = {ruta_en_nube(r): r.id for r in registros}
+    resultado, faltan = {}, []
+    with _lock:
+        for ruta, registro_id in rutas.items():
+            enlace = _cache.get(ruta)
+            if enlace is None:
+                faltan.append(ruta)
+            else:
+                resultado[registro_id] = enlace
+    if faltan:
+        nuevos = _resolver(faltan)  # fuera del lock: es una llamada de red
+        with _lock:
+            for ruta, enlace in nuevos.items():
+                _cache[ruta] = enlace
+        for ruta, enlace in nuevos.items():
+            resultado[rutas[ruta]] = enlace
+    return resultado
+
+
+def enlace_nube(registro):
+    return enlaces_nube([registro]).get(registro.id)
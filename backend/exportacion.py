@@ -0,0 +1,187 @@
+# backend/exportacion.py
+# Exportación masiva de los registros de facturación de un usuario (CSV, JSONL, Parquet).
+#
+#  - Solo los registros del usuario (usuario_id) en [desde, hasta), en orden de fecha
+#    y id (índice usuario_fecha). Las columnas son las de EXPORTACION_COLUMNAS, sin
+#    usuario_id.
+#  - Las filas se leen por lotes de EXPORTACION_LOTE con yield_per (cursor de servidor
+#    en PostgreSQL) y cada lote se escribe y se suelta antes de pedir el siguiente: la
+#    memoria no depende de cuántos años se exporten.
+#  - Parquet escribe un row group por lote con pyarrow (el motor de Parquet de pandas,
+#    en requirements.txt); en una instalación sin pyarrow ese formato no está disponible
+#    (501 en la API).
+#  - Cada exportación deja un único evento en la bitácora (EXPORTACION), no uno por
+#    registro como /api/download-json.
+#
+# Uso: python exportacion.py EMAIL [--desde 2026-01-01] [--hasta 2026-04-01]
+#          [--formato csv|jsonl|parquet] [-o archivo]   (sin -o, a la salida estándar)
+
+import argparse
+import csv
+import importlib.util
+import io
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from models import SessionLocal, RegistroFactura, Usuario
+from bitacora import registrar_evento
+from totales import desglose_de_json
+
+EXPORTACION_LOTE = int(os.getenv("EXPORTACION_LOTE", "2000")) # filas por viaje a la BD y por row group
+
+EXPORTACION_COLUMNAS = (
+    "id", "numero_factura", "fecha_subida", "cliente", "total", "desglose_iva", "tipo", "estado",
+    "motivo_anulacion", "hash_anterior", "hash_actual", "nombre_archivo",
+)
+
+# formato -> (media type, extensión)
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parquet_disponible() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _lotes(db: Session, usuario_id: int, desde: Optional[datetime], hasta: Optional[datetime]):
+    R = RegistroFactura
+    consulta = select(*[getattr(R, c) for c in EXPORTACION_COLUMNAS]).where(R.usuario_id == usuario_id)
+    if desde:
+        consulta = consulta.where(R.fecha_subida >= desde)
+    if hasta:
+        consulta = consulta.where(R.fecha_subida < hasta)
+    consulta = consulta.order_by(R.fecha_subida, R.id).execution_options(yield_per=EXPORTACION_LOTE)
+    yield from db.execute(consulta).partitions()
+
+
+def _csv(lotes) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(EXPORTACION_COLUMNAS)
+    for lote in lotes:
+        escritor.writerows(lote)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")  # solo la cabecera: exportación vacía
+
+
+def _jsonl(lotes) -> Iterator[bytes]:
+    for lote in lotes:
+        lineas = []
+        for fila in lote:
+            registro = dict(fila._mapping)
+            registro["fecha_subida"] = registro["fecha_subida"].isoformat() if registro["fecha_subida"] else None
+            registro["desglose_iva"] = desglose_de_json(registro["desglose_iva"])
+            lineas.append(json.dumps(registro, ensure_ascii=False))
+        yield ("\n".join(lineas) + "\n").encode("utf-8")
+
+
+class _Tubo:
+    """Destino de escritura para pyarrow que entrega lo escrito por trozos."""
+
+    closed = False
+
+    def __init__(self):
+        self.trozos = []
+        self.posicion = 0
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self.trozos.append(datos)
+        self.posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self.posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self) -> bytes:
+        datos, self.trozos = b"".join(self.trozos), []
+        return datos
+
+
+def _parquet(lotes) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([
+        ("id", pa.int64()), ("numero_factura", pa.string()), ("fecha_subida", pa.timestamp("us")),
+        ("cliente", pa.string()), ("total", pa.float64()), ("desglose_iva", pa.string()), ("tipo", pa.string()),
+        ("estado", pa.string()), ("motivo_anulacion", pa.string()), ("hash_anterior", pa.string()),
+        ("hash_actual", pa.string()), ("nombre_archivo", pa.string()),
+    ])
+    tubo = _Tubo()
+    with pq.ParquetWriter(tubo, esquema) as escritor:
+        for lote in lotes:
+            columnas = list(zip(*lote))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas, esquema)], schema=esquema,
+            ))
+            yield tubo.vaciar()
+    yield tubo.vaciar()  # pie del archivo (metadatos de los row groups)
+
+
+_ESCRITORES = {"csv": _csv, "jsonl": _jsonl, "parquet": _parquet}
+
+
+def registrar_exportacion(db: Session, usuario_id: int, formato: str, desde: Optional[datetime], hasta: Optional[datetime]):
+    rango = f"{desde.date() if desde else 'inicio'} - {hasta.date() if hasta else 'hoy'}"
+    registrar_evento(db, "EXPORTACION", f"Exportación {formato.upper()} de registros ({rango})", "INFO", usuario_id)
+
+
+def exportar(usuario_id: int, formato: str, desde: Optional[datetime] = None, hasta: Optional[datetime] = None) -> Iterator[bytes]:
+    """Genera el archivo por trozos con su propia sesión (la de la petición ya se habrá cerrado)."""
+    db = SessionLocal()
+    try:
+        yield from _ESCRITORES[formato](_lotes(db, usuario_id, desde, hasta))
+    finally:
+        db.close()
+
+
+def nombre_archivo(formato: str, desde: Optional[datetime], hasta: Optional[datetime]) -> str:
+    return f"registros_{desde.date() if desde else 'inicio'}_{hasta.date() if hasta else 'hoy'}.{FORMATOS[formato][1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta los registros de facturación de un usuario")
+    parser.add_argument("email", help="Usuario cuyos registros se exportan")
+    parser.add_argument("--desde", type=datetime.fromisoformat, help="Fecha inicial, incluida (ISO 8601)")
+    parser.add_argument("--hasta", type=datetime.fromisoformat, help="Fecha final, excluida (ISO 8601)")
+    parser.add_argument("--formato", choices=FORMATOS, default="csv")
+    parser.add_argument("-o", "--salida", help="Archivo de salida (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    if args.formato == "parquet" and not parquet_disponible():
+        raise SystemExit("El formato parquet necesita pyarrow (pip install pyarrow)")
+    db = SessionLocal()
+    try:
+        usuario_id = db.query(Usuario.id).filter(Usuario.email == args.email).scalar()
+        if usuario_id is None:
+            raise SystemExit(f"No existe el usuario {args.email}")
+        registrar_exportacion(db, usuario_id, args.formato, args.desde, args.hasta)
+    finally:
+        db.close()
+
+    destino = open(args.salida, "wb") if args.salida else sys.stdout.buffer
+    try:
+        for trozo in exportar(usuario_id, args.formato, args.desde, args.hasta):
+            destino.write(trozo)
+    finally:
+        if args.salida:
+            destino.close()
@@ -0,0 +1,171 @@
+# backend/filtro_hashes.py
+# Filtro de Bloom en memoria con los hash_actual de RegistroFactura.
+#
+# /api/verificar-hash es público y cada escaneo de QR lo llama. Con el filtro, un hash
+# que no existe (o no tiene formato de SHA-256) se rechaza sin tocar la base de datos;
+# los que pasan el filtro van a una búsqueda puntual por el índice único.
+#
+# El filtro se carga en el calentamiento del arranque (hasta entonces todo va a la
+# consulta por índice) y se actualiza tras cada commit que inserta registros
+# (eventos de sesión). Los registros que añaden OTROS workers se recogen consultando
+# "id > último id visto" cuando el filtro da negativo, como mucho una vez por
+# FILTRO_REFRESCO_S. Los ids que faltan por debajo del máximo (transacciones aún sin
+# confirmar, o anuladas) se vuelven a consultar durante FILTRO_HUECOS_S para no
+# perderlos. Un falso positivo solo cuesta la consulta por índice.
+
+import math
+import os
+import re
+import threading
+import time
+
+import mmh3
+import numpy as np
+from sqlalchemy import event, or_
+
+from models import SessionLocal, RegistroFactura
+
+FILTRO_CAPACIDAD = int(os.getenv("FILTRO_CAPACIDAD", "1000000"))
+FILTRO_TASA_FP = float(os.getenv("FILTRO_TASA_FP", "0.001"))
+FILTRO_REFRESCO_S = float(os.getenv("FILTRO_REFRESCO_S", "1"))
+FILTRO_HUECOS_S = float(os.getenv("FILTRO_HUECOS_S", "60"))
+
+FORMATO_HASH = re.compile(r"^[0-9a-f]{64}$")
+
+
+class FiltroBloom:
+    """Bloom con doble hashing sobre mmh3.hash64 (h1 + i*h2 mod m)."""
+
+    def __init__(self, capacidad: int, tasa_fp: float):
+        self.capacidad = capacidad
+        self.m = max(64, int(-capacidad * math.log(tasa_fp) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacidad * math.log(2)))
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+        self.n = 0
+        self._lock = threading.Lock()
+
+    def _posiciones(self, valor: str) -> list:
+        h1, h2 = mmh3.hash64(valor.encode(), signed=False)
+        a, b = h1 % self.m, h2 % self.m
+        return [(a + i * b) % self.m for i in range(self.k)]
+
+    def __contains__(self, valor: str) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._posiciones(valor))
+
+    def anadir(self, valores: list):
+        if not valores:
+            return
+        # Vectorizado: con la carga inicial son millones de posiciones
+        h = np.array([mmh3.hash64(v.encode(), signed=False) for v in valores], dtype=np.uint64)
+        a, b = h[:, 0] % self.m, h[:, 1] % self.m
+        pos = (a[:, None] + np.arange(self.k, dtype=np.uint64)[None, :] * b[:, None]) % self.m
+        pos = pos.ravel()
+        with self._lock:
+            np.bitwise_or.at(self.bits, pos >> 3, (1 << (pos & 7)).astype(np.uint8))
+            self.n += len(valores)
+
+
+class IndiceHashes:
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self.filtro = None
+        self.ultimo_id = 0
+        self.huecos = {}  # id -> momento en que se vio que faltaba
+        self._ultimo_refresco = 0.0
+        self._lock = threading.Lock()
+
+    def cargar(self):
+        """(Re)construye el filtro con todos los hashes de la base de datos."""
+        db = self.session_factory()
+        try:
+            total = db.query(RegistroFactura.id).count()
+            filtro = FiltroBloom(max(FILTRO_CAPACIDAD, 2 * total), FILTRO_TASA_FP)
+            ultimo_id, lote = 0, []
+            consulta = db.query(RegistroFactura.id, RegistroFactura.hash_actual).order_by(RegistroFactura.id)
+            for registro_id, hash_actual in consulta.yield_per(10000):
+                if hash_actual:
+                    lote.append(hash_actual)
+                ultimo_id = registro_id
+                if len(lote) >= 10000:
+                    filtro.anadir(lote)
+                    lote = []
+            filtro.anadir(lote)
+        finally:
+            db.close()
+        with self._lock:
+            self.filtro, self.ultimo_id, self.huecos = filtro, ultimo_id, {}
+            self._ultimo_refresco = time.monotonic()
+        print(f"Filtro de hashes cargado: {filtro.n} registros ({filtro.m // 8 // 1024} KiB)")
+
+    def anadir(self, hashes: list):
+        # No mueve ultimo_id: los ids de otros workers por debajo aún pueden confirmarse
+        filtro = self.filtro
+        if filtro is None:
+            return  # se incluirán al cargar
+        if filtro.n + len(hashes) > filtro.capacidad:
+            self.cargar()  # lleno: la tasa de falsos positivos se dispararía
+            return
+        filtro.anadir(hashes)
+
+    def _refrescar(self):
+        # Recoge lo insertado por otros workers desde la última vez (por clave primaria)
+        with self._lock:
+            ahora = time.monotonic()
+            if ahora - self._ultimo_refresco < FILTRO_REFRESCO_S:
+                return
+            self._ultimo_refresco = ahora
+            desde, huecos = self.ultimo_id, dict(self.huecos)
+        db = self.session_factory()
+        try:
+            condicion = RegistroFactura.id > desde
+            if huecos:
+                condicion = or_(condicion, RegistroFactura.id.in_(list(huecos)))
+            filas = db.query(RegistroFactura.id, RegistroFactura.hash_actual).filter(condicion).all()
+        finally:
+            db.close()
+        vistos = {i for i, _ in filas}
+        maximo = max([desde, *vistos])
+        huecos.update((i, ahora) for i in range(desde + 1, maximo) if i not in vistos)
+        with self._lock:
+            self.ultimo_id = maximo
+            self.huecos = {i: t for i, t in huecos.items() if i not in vistos and ahora - t < FILTRO_HUECOS_S}
+        if filas:
+            self.anadir([h for _, h in filas if h])
+
+    def puede_existir(self, hash_string: str) -> bool:
+        """False si el hash seguro que no está registrado (sin consultar la BD, salvo refresco)."""
+        if not FORMATO_HASH.match(hash_string):
+            return False
+        if self.filtro is None:
+            return True  # aún cargando (arranque.py): decide la consulta por índice
+        if hash_string in self.filtro:
+            return True
+        self._refrescar()
+        return hash_string in self.filtro
+
+
+indice_hashes = IndiceHashes()
+
+
+# --- Actualización tras cada commit (solo registros que llegan a confirmarse) ---
+
+@event.listens_for(SessionLocal, "after_flush")
+def _recoger_hashes(session, contexto):
+    # Se copian ahora: tras el commit los objetos pueden estar expirados
+    nuevos = [o.hash_actual for o in session.new if isinstance(o, RegistroFactura) and o.hash_actual]
+    if nuevos:
+        session.info.setdefault("hashes_nuevos", []).extend(nuevos)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publicar_hashes(session):
+    nuevos = session.info.pop("hashes_nuevos", None)
+    if nuevos:
+        indice_hashes.anadir(nuevos)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _descartar_hashes(session):
+    session.info.pop("hashes_nuevos", None)
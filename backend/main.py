@@ -4,32 +4,45 @@
 import hashlib
 import os
 import io
-import jwt 
 import json
+import tempfile
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Optional
 
 # Librerías de Terceros
-import qrcode
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form
-from fastapi.responses import FileResponse, Response, RedirectResponse # <--- AÑADIDO RedirectResponse
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, status, Form, BackgroundTasks, Request
+from fastapi.responses import FileResponse, Response, RedirectResponse, JSONResponse, StreamingResponse # <--- AÑADIDO RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from pypdf import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+from sqlalchemy.orm import Session, selectinload
 from pydantic import BaseModel
-from passlib.context import CryptContext 
-from reportlab.lib.units import mm             
-from reportlab.graphics.barcode import qr     
-from reportlab.graphics import renderPDF    
-from reportlab.graphics.shapes import Drawing 
-from supabase import create_client, Client 
 
 # Importaciones Locales
-from models import SessionLocal, RegistroFactura, ConfiguracionEmpresa, Usuario, EventoBitacora, Cliente, Producto, Suscripcion
+from models import SessionLocal, RegistroFactura, ConfiguracionEmpresa, Usuario, EventoBitacora, Cliente, Producto, Suscripcion, SubidaPendiente
+from cadena import anexar, calcular_hash, cadena_facturas, ConflictoCadena
+from bitacora import registrar_evento, registrar_evento_diferido, escritor as escritor_bitacora
+from schemas import (
+    LineaFactura, DatosFactura, LoteFacturas, DatosEmpresa, UserCreate, Token,
+    SolicitudAnulacion, ClienteCreate, ProductoCreate, SolicitudEnlaces,
+    RegistroSalida, EventoSalida, ClienteSalida, ProductoSalida,
+)
+import ejecutores
+from almacenamiento import ruta_en_nube
+from enlaces import enlace_nube, enlaces_nube
+import verificador
+import merkle
+import migraciones
+from arranque import arranque, importar
+import autenticacion
+from autenticacion import UsuarioActual, usuario_en_cache, cargar_usuario, verificar_password, hashear_password, limitador_login, limitador_registro
+from paginacion import listar, CABECERA_CURSOR
+from subidas import gestor_subidas, esta_en_nube
+from uso import LimitePlanExcedido, plan_y_limite, consumir_emisiones, registrar_uso, uso_del_mes, MOTIVO_ESTAMPADO_FALLIDO
+from empresas import obtener_empresa, invalidar_empresa
+from totales import calcular_totales, desglose_de_json
+import exportacion
+from metricas import MiddlewareMetricas, ETAPAS, PDF_BYTES, SELLADO_RESPALDO, exponer as exponer_metricas
 
 # --- 2. CONFIGURACIÓN DE SEGURIDAD ---
 SECRET_KEY = "clave_super_secreta_cambiar_en_produccion"
@@ -37,20 +50,15 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300 
 BASE_URL = os.getenv("BASE_URL", "http://127.0.0.1:8000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:8080")
+PDF_MAX_MB = int(os.getenv("PDF_MAX_MB", "50")) # Tamaño máximo de una factura de terceros
+METRICAS_TOKEN = os.getenv("METRICAS_TOKEN") # Si se define, /metrics exige "Authorization: Bearer <token>"
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
 # --- CONFIGURACIÓN SUPABASE ---
-# Asegúrate de que estas variables están en tu .env y en Render
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-# Inicializamos el cliente. Si fallan las variables, esto daría error al arrancar.
-try:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-except Exception as e:
-    print(f"Advertencia: Supabase no configurado correctamente: {e}")
-    supabase = None
+# Asegúrate de que SUPABASE_URL y SUPABASE_KEY están en tu .env y en Render.
+# El cliente vive en almacenamiento.py y las subidas las hace el outbox de subidas.py
 
 # --- 3. CONFIGURACIÓN DE LA APP ---
 app = FastAPI(title="INALTERA API", version="2.3.0") # Versión subida a 2.3.0
@@ -61,7 +69,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CABECERA_CURSOR],
 )
+app.add_middleware(MiddlewareMetricas)
+
+@app.exception_handler(ConflictoCadena)
+async def conflicto_cadena_handler(request, exc: ConflictoCadena):
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": "La cadena de registros está ocupada, inténtelo de nuevo"},
+    )
+
+@app.exception_handler(LimitePlanExcedido)
+async def limite_plan_handler(request, exc: LimitePlanExcedido):
+    return JSONResponse(
+        status_code=status.HTTP_402_PAYMENT_REQUIRED,
+        content={"detail": str(exc), "plan": exc.plan, "limite": exc.limite},
+    )
 
 def get_db():
     db = SessionLocal()
@@ -71,93 +95,49 @@ def get_db():
         db.close()
 
 # --- 4. MODELOS DE DATOS ---
-class LineaFactura(BaseModel):
-    producto: str
-    cantidad: int
-    precio_unitario: float
-    iva: int
-
-class DatosFactura(BaseModel):
-    cliente_nombre: str
-    cliente_nif: str
-    items: List[LineaFactura]
-    notas: str = ""
-
-class DatosEmpresa(BaseModel):
-    razon_social: str
-    nif: str
-    direccion: str
-    web: str
-
-class UserCreate(BaseModel):
-    email: str
-    password: str
-
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class SolicitudAnulacion(BaseModel):
-    motivo: str
-
-# --- NUEVOS SCHEMAS (CLIENTES Y PRODUCTOS) ---
-class ClienteCreate(BaseModel):
-    nombre: str
-    nif: str
-    direccion: str = ""
-    email: str = ""
-
-class ProductoCreate(BaseModel):
-    nombre: str
-    precio: float
-    iva_por_defecto: int = 21
-    descripcion: str = ""
+# (Definidos en schemas.py para poder enviarlos a los procesos de renderizado)
 
 # --- 5. FUNCIONES AUXILIARES ---
 
-def calcular_hash(contenido_archivo: bytes, hash_anterior: str) -> str:
-    bloque_a_hashear = contenido_archivo + hash_anterior.encode('utf-8')
-    return hashlib.sha256(bloque_a_hashear).hexdigest()
-
-# === NUEVA FUNCIÓN: REGISTRAR EVENTO EN BITÁCORA ===
-def registrar_evento(db: Session, categoria: str, descripcion: str, nivel: str = "INFO", usuario_id: int = None):
-    """
-    Crea un registro inalterable en la cadena de eventos (Bitácora).
-    """
-    # 1. Obtener último hash de bitácora (ChainLogs)
-    ultimo_evento = db.query(EventoBitacora).order_by(EventoBitacora.id.desc()).first()
-    prev_hash = ultimo_evento.hash_actual if ultimo_evento else "0" * 64
-    
-    # 2. Crear contenido para hashear (Timestamp + Datos)
-    timestamp = datetime.utcnow().isoformat()
-    contenido = f"{timestamp}{categoria}{descripcion}{usuario_id}".encode('utf-8')
-    nuevo_hash = calcular_hash(contenido, prev_hash)
-    
-    # 3. Guardar evento
-    evento = EventoBitacora(
-        categoria=categoria,
-        descripcion=descripcion,
-        nivel=nivel,
-        hash_anterior=prev_hash,
-        hash_actual=nuevo_hash,
-        usuario_id=usuario_id
-    )
-    db.add(evento)
-    db.commit()
-
 # === EVENTO DE ARRANQUE DEL SISTEMA ===
+# Solo se espera a las migraciones: el worker responde en cuanto el esquema está al
+# día y lo demás se calienta en segundo plano (arranque.py, estado en /api/salud).
+def _cargar_filtro_hashes():
+    from filtro_hashes import indice_hashes
+    indice_hashes.cargar()
+
 @app.on_event("startup")
 async def startup_event():
-    # Registramos que el sistema se ha encendido (Req. Veri*factu)
-    db = SessionLocal()
-    try:
-        registrar_evento(db, "SISTEMA", "Sistema Inaltera iniciado correctamente (v2.3)", "INFO")
-    except Exception as e:
-        print(f"Error al iniciar bitácora: {e}")
-    finally:
-        db.close()
+    # Esquema al día antes de tocar la base de datos (migraciones.py)
+    await ejecutores.en_hilo(arranque.medir, "migraciones", migraciones.migrar)
+    arranque.calentar([
+        # Registramos que el sistema se ha encendido (Req. Veri*factu)
+        ("bitacora", lambda: registrar_evento_diferido("SISTEMA", "Sistema Inaltera iniciado correctamente (v2.3)", "INFO")),
+        # Subidas a la nube pendientes (de este u otro worker, o de antes de un reinicio)
+        ("subidas", gestor_subidas.iniciar),
+        # Filtro de hashes para /api/verificar-hash (hasta entonces decide el índice)
+        ("filtro_hashes", _cargar_filtro_hashes),
+        ("jwt", importar("jwt")),
+        ("bcrypt", autenticacion.calentar),
+        ("pdf_factura", importar("pdf_factura")),
+        # Sellado periódico de bloques Merkle
+        ("merkle", merkle.sellador.iniciar),
+        # Procesos de renderizado con pdf_factura ya importado
+        ("procesos_pdf", lambda: ejecutores.calentar_procesos("pdf_factura")),
+    ])
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Que el calentamiento no arranque nada después de parar
+    arranque.esperar(timeout=10)
+    # En modo agrupado, vaciamos la cola de la bitácora antes de salir
+    escritor_bitacora.detener()
+    gestor_subidas.detener()
+    merkle.sellador.detener()
+    ejecutores.cerrar()
 
 def crear_token_acceso(data: dict):
+    import jwt  # PyJWT se importa en el primer uso (arranque.py)
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
@@ -165,7 +145,9 @@ def crear_token_acceso(data: dict):
     return encoded_jwt
 
 # --- EL PORTERO (Valida el token y devuelve el usuario) ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Sin sesión de BD: con la caché caliente (autenticacion.py) no se consulta nada
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> UsuarioActual:
+    import jwt
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="No se pudo validar las credenciales",
@@ -179,130 +161,118 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except jwt.PyJWTError:
         raise credentials_exception
         
-    user = db.query(Usuario).filter(Usuario.email == email).first()
+    user = usuario_en_cache(email)
+    if user is None:
+        user = await ejecutores.en_hilo(cargar_usuario, email)
     if user is None:
         raise credentials_exception
     return user
 
+def get_admin_user(current_user: UsuarioActual = Depends(get_current_user)):
+    # Administradores: los emails de ADMIN_EMAILS
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Solo para administradores")
+    return current_user
+
 # --- LÓGICA DE NEGOCIO (PDF, QR, HASH) ---
+# generar_pdf_fisico y estampar_qr viven en pdf_factura.py (importado en el primer uso)
+# y los totales en totales.py (el PDF los calcula con el mismo motor)
+
+def guardar_pdf_sellado(registro: RegistroFactura, pdf_sellado: bytes):
+    # A) Guardado Local (copia durable para los reintentos y fallback de descarga)
+    Path("uploads").mkdir(exist_ok=True)
+    nombre_fisico = ruta_en_nube(registro)
+    ruta_local = Path("uploads") / nombre_fisico
+    
+    with ETAPAS.medir("escritura_local"), open(ruta_local, "wb") as f:
+        f.write(pdf_sellado)
 
-def estampar_qr(pdf_bytes: bytes, texto_qr: str) -> bytes:
+    # B) Subida a la Nube en segundo plano, directamente desde el buffer en memoria
+    #    (con la copia local ya escrita la fila del outbox pasa a "pendiente")
+    gestor_subidas.encolar(registro.subida.id, nombre_fisico, ruta_local, pdf_sellado)
+
+def anular_registro_fallido(db: Session, usuario_id: int, registro_id: int, motivo: str):
     """
-    Versión avanzada (Vectorial + Link):
+    Anula, con su eslabón de anulación, un registro ya encadenado cuyo PDF no se pudo
+    procesar. La cadena es de solo anexado: borrar la fila dejaría la cabeza (y el
+    hash_anterior del siguiente registro) apuntando a un eslabón que no existe.
     """
-    packet = io.BytesIO()
-    c = canvas.Canvas(packet, pagesize=letter)
+    def construir(prev_hash):
+        original = db.query(RegistroFactura).filter(RegistroFactura.id == registro_id).populate_existing().first()
+        # El registro deja de contar en el uso del mes (y esta anulación no cuenta)
+        registrar_uso(db, usuario_id, original.tipo, -1)
+        nuevo_hash = calcular_hash(f"ANULACION_{original.numero_factura}_{motivo}".encode('utf-8'), prev_hash)
+        registro_anulacion = RegistroFactura(
+            nombre_archivo=f"ANULACION_{original.numero_factura}",
+            numero_factura=original.numero_factura,
+            cliente=original.cliente,
+            total=-original.total,
+            tipo="Anulacion",
+            estado="Evento de Anulación",
+            motivo_anulacion=motivo,
+            hash_anterior=prev_hash,
+            hash_actual=nuevo_hash,
+            datos_qr="Registro de Anulación - Sin QR físico",
+            usuario_id=usuario_id
+        )
+        original.estado = "Anulada"
+        original.subida = None  # no hay archivo que subir (delete-orphan)
+        return nuevo_hash, [registro_anulacion]
 
-    # --- CONFIGURACIÓN DE POSICIÓN ---
-    qr_size = 25 * mm
-    x_pos = 170 * mm  
-    y_pos = 250 * mm  
-    
-    # 1. Generar el Gráfico del QR Vectorial
-    qr_code = qr.QrCodeWidget(texto_qr)
-    qr_code.barWidth = qr_size
-    qr_code.barHeight = qr_size
-    qr_code.qrVersion = 1
-
-    d = Drawing(qr_size, qr_size)
-    d.add(qr_code)
-
-    # 2. Dibujar el QR
-    renderPDF.draw(d, c, x_pos, y_pos)
-
-    # 3. HIPERVÍNCULO
-    rectangulo_click = (x_pos, y_pos, x_pos + qr_size, y_pos + qr_size)
-    c.linkURL(texto_qr, rect=rectangulo_click)
-
-    # 4. Texto
-    c.setFont("Helvetica", 6)
-    c.drawString(x_pos, y_pos - 3*mm, "Verificar doc:")
-    c.setFont("Helvetica-Oblique", 6)
-    c.setFillColorRGB(0, 0, 1)
-    c.drawString(x_pos, y_pos - 6*mm, "verificar en blockchain")
-    
-    c.save()
-
-    # 5. Fusionar
-    packet.seek(0)
-    new_pdf = PdfReader(packet)
-    existing_pdf = PdfReader(io.BytesIO(pdf_bytes))
-    output = PdfWriter()
-
-    for i in range(len(existing_pdf.pages)):
-        page = existing_pdf.pages[i]
-        if i == 0: page.merge_page(new_pdf.pages[0])
-        output.add_page(page)
-
-    salida = io.BytesIO()
-    output.write(salida)
-    return salida.getvalue()
-
-def generar_pdf_fisico(datos: DatosFactura, config_empresa: ConfiguracionEmpresa) -> bytes:
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-
-    # Usamos datos de la empresa o defaults
-    razon_social = config_empresa.razon_social if config_empresa else "EMPRESA SIN CONFIGURAR"
-    direccion = config_empresa.direccion if config_empresa else "Dirección no disponible"
-    nif = config_empresa.nif if config_empresa else ""
-    web = config_empresa.web if config_empresa else ""
-
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(50, height - 50, razon_social) 
-    c.setFont("Helvetica", 10)
-    c.drawString(50, height - 70, direccion)   
-    c.drawString(50, height - 85, f"NIF: {nif}") 
-    c.drawString(50, height - 100, web)        
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(350, height - 50, "FACTURA A:")
-    c.setFont("Helvetica", 10)
-    
-    cli_nombre = datos.cliente_nombre or "Cliente Genérico"
-    cli_nif = datos.cliente_nif or ""
-    c.drawString(350, height - 70, cli_nombre)
-    c.drawString(350, height - 85, f"NIF: {cli_nif}")
-    c.drawString(350, height - 110, f"Fecha: {datetime.now().strftime('%d/%m/%Y')}")
-
-    y = height - 160
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(50, y, "Descripción")
-    c.drawString(300, y, "Cant.")
-    c.drawString(350, y, "Precio")
-    c.drawString(480, y, "Total")
-    c.line(50, y - 5, 550, y - 5)
-    
-    y -= 25
-    c.setFont("Helvetica", 10)
-    total = 0
-    for item in datos.items:
-        subtotal = item.cantidad * item.precio_unitario * (1 + item.iva/100)
-        total += subtotal
-        c.drawString(50, y, (item.producto or "Item")[:40]) 
-        c.drawString(300, y, str(item.cantidad))
-        c.drawString(350, y, f"{item.precio_unitario:.2f}")
-        c.drawString(480, y, f"{subtotal:.2f}")
-        y -= 20
-
-    c.line(350, y - 10, 550, y - 10)
-    c.setFont("Helvetica-Bold", 14)
-    c.drawString(350, y-30, "TOTAL:")
-    c.drawString(480, y-30, f"{total:.2f}€")
-    c.save()
-    buffer.seek(0)
-    return buffer.getvalue()
+    anexar(db, cadena_facturas(usuario_id), construir)
+
+def volcar_a_disco(origen, limite_bytes: int):
+    """
+    Copia un upload a un temporal en disco por trozos, calculando su SHA-256 a la vez
+    y cortando en cuanto supera el límite. Devuelve (ruta, huella, tamaño).
+    """
+    Path("uploads/tmp").mkdir(parents=True, exist_ok=True)
+    huella = hashlib.sha256()
+    tamano = 0
+    destino = tempfile.NamedTemporaryFile(dir="uploads/tmp", suffix=".pdf", delete=False)
+    try:
+        with destino:
+            while True:
+                trozo = origen.read(1 << 20)
+                if not trozo:
+                    break
+                tamano += len(trozo)
+                if tamano > limite_bytes:
+                    raise HTTPException(status_code=413, detail=f"El PDF supera el máximo de {PDF_MAX_MB} MB")
+                huella.update(trozo)
+                destino.write(trozo)
+    except Exception:
+        os.unlink(destino.name)
+        raise
+    return Path(destino.name), huella.hexdigest(), tamano
 
 # --- 6. ENDPOINTS ---
 
+@app.get("/api/salud")
+async def salud():
+    # Health check de la plataforma: no toca la base de datos ni espera al calentamiento
+    return {"estado": "ok", "version": app.version, **arranque.estado()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas(request: Request):
+    # Formato de texto de Prometheus; valores de este worker (metricas.py)
+    if METRICAS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICAS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de métricas no válido")
+    return Response(exponer_metricas(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/api/register")
-def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
+def registrar_usuario(user: UserCreate, request: Request, db: Session = Depends(get_db)):
+    # Cada alta cuenta como intento para su IP (bcrypt es caro y no debe poder forzarse),
+    # en su propio limitador: no son fallos de login
+    ip = request.client.host if request.client else "desconocida"
+    limitador_registro.comprobar(ip)
+    limitador_registro.fallo(ip)
+
     db_user = db.query(Usuario).filter(Usuario.email == user.email).first()
     if db_user:
         return {"error": "El correo ya está registrado"}
     
-    hashed_pwd = pwd_context.hash(user.password)
+    hashed_pwd = hashear_password(user.password)
     nuevo_usuario = Usuario(email=user.email, hashed_password=hashed_pwd)
     
     try:
@@ -318,26 +288,41 @@ def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
         return {"error": "Error interno al guardar usuario"}
 
 @app.post("/api/login", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(Usuario).filter(Usuario.email == form_data.username).first()
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+async def login_for_access_token(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    # Demasiados fallos de esta IP o para esta cuenta: 429 sin llegar a bcrypt
+    ip = request.client.host if request.client else "desconocida"
+    email = form_data.username
+    limitador_login.comprobar(ip, email)
+
+    user = await ejecutores.en_hilo(lambda: db.query(Usuario).filter(Usuario.email == email).first())
+    # bcrypt en su pool acotado (también si el usuario no existe, para no delatarlo por el tiempo)
+    correcta, nuevo_hash = await verificar_password(form_data.password, user.hashed_password if user else None)
+    if not correcta:
         # Podríamos loguear intentos fallidos, pero cuidado con saturar la DB
+        limitador_login.fallo(ip, email)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales incorrectas",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    limitador_login.exito(email)
+    usuario_id = user.id
+
+    # Coste de bcrypt cambiado (BCRYPT_ROUNDS): rehacemos el hash ahora que tenemos la contraseña
+    if nuevo_hash:
+        user.hashed_password = nuevo_hash
+        await ejecutores.en_hilo(db.commit)
     
     # LOG
-    registrar_evento(db, "LOGIN", "Inicio de sesión exitoso", "INFO", user.id)
+    await ejecutores.en_hilo(registrar_evento, db, "LOGIN", "Inicio de sesión exitoso", "INFO", usuario_id)
     
-    access_token = crear_token_acceso(data={"sub": user.email})
+    access_token = crear_token_acceso(data={"sub": email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # --- 7. ENDPOINTS DE EMPRESA (Protegidos por Usuario) ---
 
 @app.get("/api/empresa")
-def obtener_config(db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def obtener_config(db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
     config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.usuario_id == current_user.id).first()
     if not config:
         config = ConfiguracionEmpresa(usuario_id=current_user.id)
@@ -346,7 +331,7 @@ def obtener_config(db: Session = Depends(get_db), current_user: Usuario = Depend
     return config
 
 @app.post("/api/empresa")
-def guardar_config(datos: DatosEmpresa, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def guardar_config(datos: DatosEmpresa, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
     config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.usuario_id == current_user.id).first()
     if not config:
         config = ConfiguracionEmpresa(usuario_id=current_user.id)
@@ -357,6 +342,7 @@ def guardar_config(datos: DatosEmpresa, db: Session = Depends(get_db), current_u
     config.direccion = datos.direccion
     config.web = datos.web
     db.commit()
+    invalidar_empresa(current_user.id)  # la plantilla del PDF cambia sola (va por contenido)
     
     # LOG
     registrar_evento(db, "CONFIG", "Datos de empresa actualizados", "INFO", current_user.id)
@@ -366,82 +352,146 @@ def guardar_config(datos: DatosEmpresa, db: Session = Depends(get_db), current_u
 # --- 8. ENDPOINTS DE FACTURACIÓN (Protegidos y Multi-usuario) ---
 
 @app.post("/api/emitir")
-async def emitir_factura(datos: DatosFactura, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    # 1. Configuración Empresa
-    config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.usuario_id == current_user.id).first()
-
-    # 2. CALCULAR TOTALES
-    total_factura = 0
-    for item in datos.items:
-        base = item.cantidad * item.precio_unitario
-        total_linea = base * (1 + item.iva / 100)
-        total_factura += total_linea
-
-    # 3. Generar PDF
-    pdf_bytes = generar_pdf_fisico(datos, config)
+async def emitir_factura(datos: DatosFactura, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
+    # Todo lo bloqueante va a los ejecutores: la sesión y el disco/Supabase al pool de
+    # hilos y el PDF al de procesos, para no parar el event loop de este worker.
+    from pdf_factura import generar_pdf_fisico, sellar_factura, sellado_de_respaldo  # reportlab/pypdf en el primer uso
+
+    # 1. Configuración Empresa (de la caché de empresas.py)
+    empresa = await ejecutores.en_hilo(obtener_empresa, db, current_user.id)
+
+    # 2. CALCULAR TOTALES (redondeo por línea y por tipo de IVA, en Decimal)
+    totales = calcular_totales(datos.items)
+    total_factura = float(totales.total)
+
+    # 3. Generar PDF (versión pre-sello, la que cubre el hash)
+    fecha_emision = datetime.now().strftime('%d/%m/%Y')
+    with ETAPAS.medir("generar_pdf"):
+        pdf_bytes = await ejecutores.en_proceso(generar_pdf_fisico, datos, empresa, fecha_emision)
+    PDF_BYTES.observar(len(pdf_bytes), "generado")
     
-    # 4. Criptografía (Blockchain Facturas)
-    ultimo_registro = db.query(RegistroFactura).order_by(RegistroFactura.id.desc()).first()
-    prev_hash = ultimo_registro.hash_actual if ultimo_registro else "0" * 64
-    nuevo_hash = calcular_hash(pdf_bytes, prev_hash)
-    
-    # Usamos la variable FRONTEND_URL que configuramos antes
-    texto_qr = f"{FRONTEND_URL}/verificar?h={nuevo_hash}"
-
-    # 5. GUARDAR EN DB
+    # 4. Criptografía (Blockchain Facturas del usuario) + 5. GUARDAR EN DB
     num_factura = f"F-{datetime.now().strftime('%Y%m%d-%H%M')}"
-    
-    nuevo_registro = RegistroFactura(
-        nombre_archivo=f"{num_factura}.pdf",
-        numero_factura=num_factura,
-        cliente=datos.cliente_nombre,
-        total=total_factura,
-        hash_anterior=prev_hash,
-        hash_actual=nuevo_hash,
-        datos_qr=texto_qr,
-        usuario_id=current_user.id
-    )
-    db.add(nuevo_registro)
-    db.commit()
-    db.refresh(nuevo_registro)
+    plan, limite = await ejecutores.en_hilo(plan_y_limite, db, current_user.id)
+
+    def construir(prev_hash):
+        # Límite del plan: comprobación e incremento atómicos en la misma transacción
+        consumir_emisiones(db, current_user.id, 1, plan, limite)
+        with ETAPAS.medir("calcular_hash"):
+            nuevo_hash = calcular_hash(pdf_bytes, prev_hash)
+        registro = RegistroFactura(
+            nombre_archivo=f"{num_factura}.pdf",
+            numero_factura=num_factura,
+            cliente=datos.cliente_nombre,
+            total=total_factura,
+            desglose_iva=totales.desglose_json(),
+            hash_anterior=prev_hash,
+            hash_actual=nuevo_hash,
+            # Usamos la variable FRONTEND_URL que configuramos antes
+            datos_qr=f"{FRONTEND_URL}/verificar?h={nuevo_hash}",
+            usuario_id=current_user.id,
+            subida=SubidaPendiente()  # outbox: se confirma junto con el registro ("preparando")
+        )
+        return nuevo_hash, [registro]
+
+    db.expire_on_commit = False  # así no se recarga el registro tras el commit
+    with ETAPAS.medir("anexar"):
+        nuevo_registro, = await ejecutores.en_hilo(anexar, db, cadena_facturas(current_user.id), construir)
+    nuevo_hash = nuevo_registro.hash_actual
+    texto_qr = nuevo_registro.datos_qr
     
     # LOG (Blockchain Eventos)
-    registrar_evento(db, "FACTURACION", f"Factura emitida: {num_factura} ({total_factura:.2f}€)", "INFO", current_user.id)
+    await ejecutores.en_hilo(registrar_evento, db, "FACTURACION", f"Factura emitida: {num_factura} ({total_factura:.2f}€)", "INFO", current_user.id)
 
     # 6. GESTIÓN DEL ARCHIVO FÍSICO
-    pdf_sellado = estampar_qr(pdf_bytes, texto_qr)
-    # Usamos el ID + Nombre para evitar duplicados y facilitar la búsqueda en Supabase
-    nombre_fisico = f"{nuevo_registro.id}_{nuevo_registro.nombre_archivo}"
-    
-    # A) Guardado Local Temporal (necesario para enviar a Supabase y fallback)
-    Path("uploads").mkdir(exist_ok=True)
-    ruta_local = Path("uploads") / nombre_fisico
-    
-    with open(ruta_local, "wb") as f:
-        f.write(pdf_sellado)
-
-    # B) Subida a la Nube (NUEVO: SUPABASE)
-    if supabase:
-        try:
-            with open(ruta_local, "rb") as f:
-                supabase.storage.from_("facturas").upload(
-                    path=nombre_fisico, 
-                    file=f,
-                    file_options={"content-type": "application/pdf", "upsert": "true"}
-                )
-            print(f"✅ Factura subida a Supabase: {nombre_fisico}")
-            # Opcional: Borrar local para ahorrar espacio en Render
-            # if os.path.exists(ruta_local): os.remove(ruta_local)
-        except Exception as e:
-            print(f"❌ Error subiendo a Supabase: {e}")
+    # El sello se añade a los bytes pre-sello ya dibujados (sin volver a maquetar la factura)
+    with ETAPAS.medir("sellar_pdf"):
+        pdf_sellado = await ejecutores.en_proceso(sellar_factura, datos, empresa, fecha_emision, texto_qr, pdf_bytes)
+    PDF_BYTES.observar(len(pdf_sellado), "sellado")
+    if sellado_de_respaldo(pdf_bytes, pdf_sellado):
+        SELLADO_RESPALDO.inc("propia")
+    await ejecutores.en_hilo(guardar_pdf_sellado, nuevo_registro, pdf_sellado)
 
     # Retorno
     return {
         "status": "Exito",
-        "mensaje": "Factura generada y guardada en la nube",
+        "mensaje": "Factura generada; la copia en la nube se sube en segundo plano",
         "datos_trazabilidad": {"id": nuevo_registro.id, "hash": nuevo_hash}
     }
 
+# --- EMISIÓN EN LOTE (cierres de mes) ---
+@app.post("/api/emitir-lote")
+async def emitir_lote(lote: LoteFacturas, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
+    from pdf_factura import generar_pdf_fisico, sellar_factura, sellado_de_respaldo
+    facturas = lote.facturas
+
+    # 1. Configuración Empresa (un schema, para poder enviarla a otros procesos)
+    empresa = await ejecutores.en_hilo(obtener_empresa, db, current_user.id)
+
+    # 2. Generar los PDFs en paralelo (el orden de salida es el de la petición)
+    fecha_emision = datetime.now().strftime('%d/%m/%Y')
+    with ETAPAS.medir("generar_pdf_lote"):
+        pdfs = await ejecutores.mapear_en_procesos(generar_pdf_fisico, facturas, [empresa] * len(facturas), [fecha_emision] * len(facturas))
+    for pdf in pdfs:
+        PDF_BYTES.observar(len(pdf), "generado")
+
+    # 3. Encadenar todo el lote en orden y confirmarlo en UNA transacción
+    prefijo = f"F-{datetime.now().strftime('%Y%m%d-%H%M')}"
+    totales = [calcular_totales(datos.items) for datos in facturas]
+    plan, limite = await ejecutores.en_hilo(plan_y_limite, db, current_user.id)
+
+    def construir(prev_hash):
+        # El lote cabe entero en el plan o no se emite ninguna
+        consumir_emisiones(db, current_user.id, len(facturas), plan, limite)
+        registros = []
+        for i, (datos, pdf_bytes, totales_factura) in enumerate(zip(facturas, pdfs, totales)):
+            nuevo_hash = calcular_hash(pdf_bytes, prev_hash)
+            num_factura = f"{prefijo}-{i + 1:04d}"
+            registros.append(RegistroFactura(
+                nombre_archivo=f"{num_factura}.pdf",
+                numero_factura=num_factura,
+                cliente=datos.cliente_nombre,
+                total=float(totales_factura.total),
+                desglose_iva=totales_factura.desglose_json(),
+                hash_anterior=prev_hash,
+                hash_actual=nuevo_hash,
+                datos_qr=f"{FRONTEND_URL}/verificar?h={nuevo_hash}",
+                usuario_id=current_user.id,
+                subida=SubidaPendiente()
+            ))
+            prev_hash = nuevo_hash
+        return prev_hash, registros
+
+    db.expire_on_commit = False  # así no se recarga cada registro tras el commit
+    with ETAPAS.medir("anexar_lote"):
+        registros = await ejecutores.en_hilo(anexar, db, cadena_facturas(current_user.id), construir)
+    resultados = [
+        {"indice": i, "id": r.id, "numero_factura": r.numero_factura, "hash": r.hash_actual}
+        for i, r in enumerate(registros)
+    ]
+
+    # LOG (un único evento para todo el lote)
+    await ejecutores.en_hilo(registrar_evento, db, "FACTURACION", f"Lote de {len(registros)} facturas emitido ({sum(t.total for t in totales):.2f}€)", "INFO", current_user.id)
+
+    # 4. Estampar los QR en paralelo y guardar los archivos
+    n = len(registros)
+    with ETAPAS.medir("sellar_pdf_lote"):
+        sellados = await ejecutores.mapear_en_procesos(
+            sellar_factura, facturas, [empresa] * n, [fecha_emision] * n, [r.datos_qr for r in registros],
+            pdfs,
+        )
+    for pdf, sellado in zip(pdfs, sellados):
+        PDF_BYTES.observar(len(sellado), "sellado")
+        if sellado_de_respaldo(pdf, sellado):
+            SELLADO_RESPALDO.inc("propia")
+    await ejecutores.mapear_en_hilos(guardar_pdf_sellado, registros, sellados)
+
+    return {
+        "status": "Exito",
+        "mensaje": f"{len(resultados)} facturas generadas; la copia en la nube se sube en segundo plano",
+        "resultados": resultados
+    }
+
 # --- ENDPOINT RF2: SUBIR Y LEGALIZAR FACTURA DE TERCEROS (MODIFICADO SUPABASE) ---
 @app.post("/api/subir-factura")
 def subir_factura_terceros(
@@ -451,105 +501,167 @@ def subir_factura_terceros(
     total: float = Form(...),
     fecha: str = Form(...),
     db: Session = Depends(get_db),
-    u: Usuario = Depends(get_current_user)
+    u: UsuarioActual = Depends(get_current_user)
 ):
-    # 1. Obtener NIF
-    config = db.query(ConfiguracionEmpresa).filter(ConfiguracionEmpresa.usuario_id == u.id).first()
-    nif_emisor = config.nif if config else "NIF_NO_CONFIGURADO"
+    from pdf_factura import validar_pdf, estampar_qr_archivo
 
-    # 2. Leer PDF
-    pdf_content = file.file.read()
+    # 1. Obtener NIF
+    empresa = obtener_empresa(db, u.id)
+    nif_emisor = empresa.nif if empresa else "NIF_NO_CONFIGURADO"
+
+    # 2. Leer PDF: a disco por trozos (nunca entero en memoria) y validarlo antes de
+    #    tocar la cadena, para no encadenar registros de archivos corruptos
+    ruta_temporal, huella_documento, tamano = volcar_a_disco(file.file, PDF_MAX_MB * 1024 * 1024)
+    PDF_BYTES.observar(tamano, "externo")
+    with ETAPAS.medir("validar_pdf"):
+        valido = validar_pdf(ruta_temporal)
+    if not valido:
+        os.unlink(ruta_temporal)
+        raise HTTPException(status_code=400, detail="El archivo no es un PDF válido")
     
-    # 3. Hash Anterior
-    ultimo_registro = db.query(RegistroFactura).order_by(RegistroFactura.id.desc()).first()
-    prev_hash = ultimo_registro.hash_actual if ultimo_registro else "0"*64
-
-    # 4. Hash Actual
-    datos_para_hash = f"{nif_emisor}{numero}{fecha}{total}{prev_hash}"
-    nuevo_hash = hashlib.sha256(datos_para_hash.encode()).hexdigest()
-
-    # 5. Texto QR
-    texto_qr = f"{FRONTEND_URL}/verificar?h={nuevo_hash}"
-
-    # 6. Parsear fecha
+    # 3. Parsear fecha
     try:
         fecha_obj = datetime.strptime(fecha, "%Y-%m-%d")
     except:
         fecha_obj = datetime.utcnow()
 
-    # 7. Definir nombre base (SIN ID todavía)
-    nombre_final = f"{numero}_{nuevo_hash[:8]}.pdf".replace("/", "-")
-
-    # 8. GUARDAR EN DB PRIMERO (Para conseguir el ID)
-    nuevo_registro = RegistroFactura(
-        nombre_archivo=nombre_final,
-        numero_factura=numero,
-        cliente=cliente,
-        total=total,
-        fecha_subida=fecha_obj,
-        hash_anterior=prev_hash,
-        hash_actual=nuevo_hash,
-        datos_qr=texto_qr,
-        usuario_id=u.id,
-        tipo="Externa"
-    )
-    
-    db.add(nuevo_registro)
-    db.commit()
+    # 4. Hash Anterior (cabeza de la cadena del usuario) + Hash Actual
+    def construir(prev_hash):
+        registrar_uso(db, u.id, "Externa")
+        datos_para_hash = f"{nif_emisor}{numero}{fecha}{total}{prev_hash}"
+        nuevo_hash = hashlib.sha256(datos_para_hash.encode()).hexdigest()
+
+        # 5. Definir nombre base (SIN ID todavía)
+        nombre_final = f"{numero}_{nuevo_hash[:8]}.pdf".replace("/", "-")
+
+        # 6. Texto QR
+        registro = RegistroFactura(
+            nombre_archivo=nombre_final,
+            numero_factura=numero,
+            cliente=cliente,
+            total=total,
+            fecha_subida=fecha_obj,
+            hash_anterior=prev_hash,
+            hash_actual=nuevo_hash,
+            datos_qr=f"{FRONTEND_URL}/verificar?h={nuevo_hash}",
+            usuario_id=u.id,
+            tipo="Externa",
+            subida=SubidaPendiente()
+        )
+        return nuevo_hash, [registro]
+
+    # 7. GUARDAR EN DB PRIMERO (Para conseguir el ID)
+    try:
+        with ETAPAS.medir("anexar"):
+            nuevo_registro, = anexar(db, cadena_facturas(u.id), construir)
+    except Exception:
+        os.unlink(ruta_temporal)
+        raise
     db.refresh(nuevo_registro) # ¡Aquí obtenemos el ID!
+    nombre_final = nuevo_registro.nombre_archivo
+    texto_qr = nuevo_registro.datos_qr
 
-    # 9. ESTAMPAR Y GUARDAR (Local + Supabase)
+    # 8. ESTAMPAR Y GUARDAR (Local + Supabase)
     try:
-        pdf_sellado = estampar_qr(pdf_content, texto_qr)
-        
         # Nombre único con ID
         nombre_fisico = f"{nuevo_registro.id}_{nombre_final}"
         path_final = Path("uploads") / nombre_fisico
         
         Path("uploads").mkdir(exist_ok=True)
         
-        # A) Guardar Local
-        with open(path_final, "wb") as f:
-            f.write(pdf_sellado)
+        # A) Estampar de disco a disco (actualización incremental: solo la página 0 en memoria)
+        with ETAPAS.medir("estampar_qr"):
+            if not ejecutores.en_proceso_sync(estampar_qr_archivo, str(ruta_temporal), str(path_final), texto_qr):
+                SELLADO_RESPALDO.inc("terceros")
             
-        # B) Subir a Supabase
-        if supabase:
-            try:
-                with open(path_final, "rb") as f:
-                    supabase.storage.from_("facturas").upload(
-                        path=nombre_fisico,
-                        file=f,
-                        file_options={"content-type": "application/pdf", "upsert": "true"}
-                    )
-                print(f"✅ Factura Externa subida a Supabase: {nombre_fisico}")
-                # Opcional: Borrar local
-                # if os.path.exists(path_final): os.remove(path_final)
-            except Exception as ex_supa:
-                print(f"❌ Error subiendo a Supabase (Externa): {ex_supa}")
+        # B) Subir a Supabase (en segundo plano, leyendo el archivo estampado)
+        gestor_subidas.encolar(nuevo_registro.subida.id, nombre_fisico, path_final)
             
     except Exception as e:
         print(f"Error procesando PDF: {e}")
-        # Si falla el proceso crítico, borramos el registro
-        db.delete(nuevo_registro)
-        db.commit()
+        # Si falla el proceso crítico, el registro se anula (nunca se borra de la cadena)
+        path_final.unlink(missing_ok=True)
+        anular_registro_fallido(db, u.id, nuevo_registro.id, MOTIVO_ESTAMPADO_FALLIDO)
+        registrar_evento(db, "FACTURACION", f"Factura externa {numero} anulada: error al estampar el QR", "WARNING", u.id)
         raise HTTPException(status_code=500, detail="Error al estampar el QR en el PDF")
+    finally:
+        os.unlink(ruta_temporal)
     
     # Log
-    registrar_evento(db, "FACTURACION", f"Factura externa legalizada: {numero}", "INFO", u.id)
+    registrar_evento(db, "FACTURACION", f"Factura externa legalizada: {numero} (SHA-256 {huella_documento[:16]}…)", "INFO", u.id)
     
     return {
         "status": "Exito", 
-        "mensaje": "Factura legalizada correctamente y subida a la nube", 
-        "id": nuevo_registro.id
+        "mensaje": "Factura legalizada correctamente; la copia en la nube se sube en segundo plano", 
+        "id": nuevo_registro.id,
+        "huella_documento": huella_documento
     }
 
-@app.get("/api/registros")
-def leer_registros(db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
-    return db.query(RegistroFactura).filter(RegistroFactura.usuario_id == current_user.id).all()
+ORDENES_REGISTROS = {
+    "id": [(RegistroFactura.id, False)],
+    "-id": [(RegistroFactura.id, True)],
+    "fecha": [(RegistroFactura.fecha_subida, False), (RegistroFactura.id, False)],
+    "-fecha": [(RegistroFactura.fecha_subida, True), (RegistroFactura.id, True)],
+}
+
+@app.get("/api/registros", response_model=List[RegistroSalida])
+def leer_registros(
+    cursor: Optional[str] = None,
+    limite: Optional[int] = None,
+    orden: str = "id",
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    tipo: Optional[str] = None,
+    estado: Optional[str] = None,
+    formato: str = "json",
+    db: Session = Depends(get_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    # Sin parámetros: el array completo de siempre (en streaming). Ver paginacion.py
+    if orden not in ORDENES_REGISTROS:
+        raise HTTPException(status_code=400, detail="Orden no soportado (id, -id, fecha, -fecha)")
+    usuario_id = current_user.id
+
+    def construir(sesion: Session):
+        consulta = sesion.query(RegistroFactura).filter(RegistroFactura.usuario_id == usuario_id)
+        if desde:
+            consulta = consulta.filter(RegistroFactura.fecha_subida >= desde)
+        if hasta:
+            consulta = consulta.filter(RegistroFactura.fecha_subida < hasta)
+        if tipo:
+            consulta = consulta.filter(RegistroFactura.tipo == tipo)
+        if estado:
+            consulta = consulta.filter(RegistroFactura.estado == estado)
+        return consulta
+
+    return listar(db, construir, RegistroSalida, ORDENES_REGISTROS[orden], cursor, limite, formato)
+
+@app.get("/api/exportar")
+def exportar_registros(
+    formato: str = "csv",
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
+    # Todos los registros del usuario en [desde, hasta) en un solo archivo y en streaming
+    # (exportacion.py). Un único evento de auditoría por exportación.
+    if formato not in exportacion.FORMATOS:
+        raise HTTPException(status_code=400, detail="Formato no soportado (csv, jsonl o parquet)")
+    if formato == "parquet" and not exportacion.parquet_disponible():
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Exportación a Parquet no disponible en este servidor")
+
+    exportacion.registrar_exportacion(db, current_user.id, formato, desde, hasta)
+    nombre = exportacion.nombre_archivo(formato, desde, hasta)
+    return StreamingResponse(
+        exportacion.exportar(current_user.id, formato, desde, hasta),
+        media_type=exportacion.FORMATOS[formato][0],
+        headers={"Content-Disposition": f"attachment; filename={nombre}"},
+    )
 
 # --- ENDPOINT DE ANULACIÓN (Protegido) ---
 @app.post("/api/anular/{registro_id}")
-def anular_factura(registro_id: int, solicitud: SolicitudAnulacion, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def anular_factura(registro_id: int, solicitud: SolicitudAnulacion, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
     # 1. Buscar factura y VERIFICAR PROPIEDAD
     factura_original = db.query(RegistroFactura).filter(
         RegistroFactura.id == registro_id,
@@ -562,58 +674,60 @@ def anular_factura(registro_id: int, solicitud: SolicitudAnulacion, db: Session
     if factura_original.estado == "Anulada":
         raise HTTPException(status_code=400, detail="Esta factura ya está anulada")
 
-    # 2. Blockchain Global
-    ultimo_registro = db.query(RegistroFactura).order_by(RegistroFactura.id.desc()).first()
-    prev_hash = ultimo_registro.hash_actual if ultimo_registro else "0" * 64
-    
-    contenido_anulacion = f"ANULACION_{factura_original.numero_factura}_{solicitud.motivo}".encode('utf-8')
-    nuevo_hash = calcular_hash(contenido_anulacion, prev_hash)
-    
-    # 3. Registro Anulación
-    registro_anulacion = RegistroFactura(
-        nombre_archivo=f"ANULACION_{factura_original.numero_factura}",
-        numero_factura=factura_original.numero_factura,
-        cliente=factura_original.cliente,
-        total= -factura_original.total,
-        tipo="Anulacion",
-        estado="Evento de Anulación",
-        motivo_anulacion=solicitud.motivo,
-        hash_anterior=prev_hash,
-        hash_actual=nuevo_hash,
-        datos_qr="Registro de Anulación - Sin QR físico",
-        usuario_id=current_user.id 
-    )
-    
-    factura_original.estado = "Anulada"
-    db.add(registro_anulacion)
-    db.commit()
+    # 2. Blockchain del usuario
+    numero_factura = factura_original.numero_factura
+    contenido_anulacion = f"ANULACION_{numero_factura}_{solicitud.motivo}".encode('utf-8')
+
+    def construir(prev_hash):
+        registrar_uso(db, current_user.id, "Anulacion")
+        nuevo_hash = calcular_hash(contenido_anulacion, prev_hash)
+
+        # 3. Registro Anulación (si se reintenta, el rollback deshace el cambio de estado)
+        original = db.query(RegistroFactura).filter(RegistroFactura.id == registro_id).populate_existing().first()
+        if original.estado == "Anulada":
+            raise HTTPException(status_code=400, detail="Esta factura ya está anulada")
+        registro_anulacion = RegistroFactura(
+            nombre_archivo=f"ANULACION_{numero_factura}",
+            numero_factura=numero_factura,
+            cliente=original.cliente,
+            total= -original.total,
+            tipo="Anulacion",
+            estado="Evento de Anulación",
+            motivo_anulacion=solicitud.motivo,
+            hash_anterior=prev_hash,
+            hash_actual=nuevo_hash,
+            datos_qr="Registro de Anulación - Sin QR físico",
+            usuario_id=current_user.id 
+        )
+        original.estado = "Anulada"
+        return nuevo_hash, [registro_anulacion]
+
+    anexar(db, cadena_facturas(current_user.id), construir)
     
     # LOG
-    registrar_evento(db, "ANULACION", f"Factura {factura_original.numero_factura} anulada. Motivo: {solicitud.motivo}", "WARNING", current_user.id)
+    registrar_evento(db, "ANULACION", f"Factura {numero_factura} anulada. Motivo: {solicitud.motivo}", "WARNING", current_user.id)
     
     return {"status": "Anulada", "mensaje": "Factura anulada y evento registrado en la cadena."}
 
 @app.get("/api/download/{registro_id}")
-def descargar(registro_id: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def descargar(registro_id: int, tareas: BackgroundTasks, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
     reg = db.query(RegistroFactura).filter(RegistroFactura.id == registro_id).first()
     
     if not reg or reg.usuario_id != current_user.id:
         return {"error": "No encontrada o acceso denegado"}
         
     # --- CAMBIO: DESCARGA DESDE SUPABASE ---
-    if supabase:
+    # Solo si la subida ya terminó; mientras tanto se sirve la copia local
+    if esta_en_nube(reg):
         try:
-            # Reconstruimos el nombre exacto en la nube (ID_NombreArchivo)
-            nombre_nube = f"{reg.id}_{reg.nombre_archivo}"
-            
-            # Obtenemos la URL pública firmada o directa
-            url_publica = supabase.storage.from_("facturas").get_public_url(nombre_nube)
-            
-            # LOG DE AUDITORÍA
-            registrar_evento(db, "DESCARGA", f"Descarga PDF nube {reg.numero_factura}", "INFO", current_user.id)
-            
-            # Redirigimos al usuario a Supabase
-            return RedirectResponse(url=url_publica)
+            # URL pública o firmada, cacheada hasta poco antes de caducar
+            enlace = enlace_nube(reg)
+            if enlace:
+                # LOG DE AUDITORÍA (tras enviar la respuesta, sin bloquear la redirección)
+                tareas.add_task(registrar_evento_diferido, "DESCARGA", f"Descarga PDF nube {reg.numero_factura}", "INFO", current_user.id)
+                
+                # Redirigimos al usuario a Supabase
+                return RedirectResponse(url=enlace.url)
         except Exception as e:
             print(f"Error obteniendo URL Supabase: {e}")
             # Si falla, intentamos fallback local (por si acaso existe)
@@ -625,8 +739,41 @@ def descargar(registro_id: int, db: Session = Depends(get_db), current_user: Usu
     
     return FileResponse(ruta, filename=reg.nombre_archivo)
 
+@app.post("/api/enlaces-descarga")
+def enlaces_descarga(solicitud: SolicitudEnlaces, tareas: BackgroundTasks, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
+    # Enlaces para toda una página del listado en una sola petición
+    registros = db.query(RegistroFactura).options(selectinload(RegistroFactura.subida)).filter(
+        RegistroFactura.id.in_(set(solicitud.ids)),
+        RegistroFactura.usuario_id == current_user.id
+    ).all()
+
+    en_nube = [r for r in registros if esta_en_nube(r)]
+    try:
+        firmados = enlaces_nube(en_nube) if en_nube else {}
+    except Exception as e:
+        print(f"Error obteniendo URLs Supabase: {e}")
+        firmados = {}
+
+    enlaces = []
+    for r in registros:
+        enlace = firmados.get(r.id)
+        if enlace:
+            enlaces.append({"id": r.id, "url": enlace.url, "origen": "nube", "caduca": enlace.caduca.isoformat() + "Z"})
+        else:
+            # Aún no subida (o la nube falla): se descarga por la API con el token
+            enlaces.append({"id": r.id, "url": f"{BASE_URL}/api/download/{r.id}", "origen": "local", "caduca": None})
+
+    encontrados = {r.id for r in registros}
+    if enlaces:
+        tareas.add_task(registrar_evento_diferido, "DESCARGA", f"Enlaces de descarga generados para {len(enlaces)} facturas", "INFO", current_user.id)
+
+    return {
+        "enlaces": enlaces,
+        "no_encontrados": [i for i in solicitud.ids if i not in encontrados]
+    }
+
 @app.get("/api/download-json/{registro_id}")
-def descargar_json(registro_id: int, db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+def descargar_json(registro_id: int, db: Session = Depends(get_db), current_user: UsuarioActual = Depends(get_current_user)):
     registro = db.query(RegistroFactura).filter(
         RegistroFactura.id == registro_id,
         RegistroFactura.usuario_id == current_user.id
@@ -648,6 +795,10 @@ def descargar_json(registro_id: int, db: Session = Depends(get_db), current_user
             "hash_actual": registro.hash_actual,
             "algoritmo": "SHA-256"
         },
+        "importes": {
+            "total": registro.total,
+            "desglose_iva": desglose_de_json(registro.desglose_iva)
+        },
         "documento": {
             "nombre_archivo": registro.nombre_archivo,
             "url_qr": registro.datos_qr,
@@ -665,68 +816,94 @@ def descargar_json(registro_id: int, db: Session = Depends(get_db), current_user
         headers={"Content-Disposition": f"attachment; filename={nombre_fichero}"}
     )
 
-@app.get("/api/bitacora")
-def leer_bitacora(db: Session = Depends(get_db), current_user: Usuario = Depends(get_current_user)):
+@app.get("/api/bitacora", response_model=List[EventoSalida])
+def leer_bitacora(
+    cursor: Optional[str] = None,
+    limite: Optional[int] = None,
+    categoria: Optional[str] = None,
+    desde: Optional[datetime] = None,
+    hasta: Optional[datetime] = None,
+    formato: str = "json",
+    db: Session = Depends(get_db),
+    current_user: UsuarioActual = Depends(get_current_user)
+):
     # Devolvemos los eventos del usuario actual, ordenados del más reciente al más antiguo
-    return db.query(EventoBitacora).filter(EventoBitacora.usuario_id == current_user.id).order_by(EventoBitacora.id.desc()).all()
+    usuario_id = current_user.id
+
+    def construir(sesion: Session):
+        consulta = sesion.query(EventoBitacora).filter(EventoBitacora.usuario_id == usuario_id)
+        if categoria:
+            consulta = consulta.filter(EventoBitacora.categoria == categoria)
+        if desde:
+            consulta = consulta.filter(EventoBitacora.fecha >= desde)
+        if hasta:
+            consulta = consulta.filter(EventoBitacora.fecha < hasta)
+        return consulta
+
+    return listar(db, construir, EventoSalida, [(EventoBitacora.id, True)], cursor, limite, formato)
+
+# --- AUDITORÍA: VERIFICACIÓN DE LAS CADENAS (solo administradores) ---
+@app.post("/api/admin/verificar-cadenas", status_code=status.HTTP_202_ACCEPTED)
+def verificar_cadenas(completo: bool = False, admin: UsuarioActual = Depends(get_admin_user)):
+    # Incremental desde el último punto de control firmado, salvo ?completo=true. Se
+    # ejecuta en segundo plano; el resultado, en GET (de este worker) y en la bitácora.
+    def al_terminar(informes):
+        errores = sum(i["n_errores"] for i in informes.values())
+        registrar_evento_diferido("AUDITORIA", f"Verificación de cadenas ({'completa' if completo else 'incremental'}): {errores} errores", "INFO" if errores == 0 else "CRITICAL", admin.id)
+
+    lanzada = verificador.en_fondo.lanzar(completo, al_terminar)
+    return {"lanzada": lanzada, **verificador.en_fondo.estado}
+
+@app.get("/api/admin/verificar-cadenas")
+def estado_verificacion_cadenas(admin: UsuarioActual = Depends(get_admin_user)):
+    return verificador.en_fondo.estado
 
 from datetime import datetime, timedelta # Asegúrate de importar esto arriba
 
 # --- GESTIÓN DE PLANES Y CONSUMO ---
 
 @app.get("/api/uso-plan")
-def obtener_uso_plan(db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
-    # 1. Obtener el plan del usuario (si no tiene, creamos uno ficticio Free)
-    suscripcion = db.query(Suscripcion).filter(Suscripcion.usuario_id == u.id).first()
-    nombre_plan = suscripcion.plan if suscripcion else "Free"
-    
-    # 2. Definir límites (Esto vendría de una tabla de configuración en el futuro)
-    limites = {
-        "Free": 5,
-        "Basic": 20,
-        "Pro": 1000
-    }
-    limite_actual = limites.get(nombre_plan, 5)
+def obtener_uso_plan(db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
+    # 1. Plan del usuario y su límite (tabla planes_limite; sin suscripción, Free)
+    nombre_plan, limite_actual = plan_y_limite(db, u.id)
+
+    # 2. Contadores del mes (una sola fila de uso_mensual, ver uso.py)
+    uso = uso_del_mes(db, u.id)
+    consumo = uso.emitidas
 
-    # 3. Calcular fechas del mes actual (Desde el día 1 hasta hoy)
     hoy = datetime.utcnow()
     inicio_mes = datetime(hoy.year, hoy.month, 1)
-
-    # 4. Contar facturas emitidas este mes
-    # Filtramos por usuario y fecha >= inicio de mes
-    consumo = db.query(RegistroFactura).filter(
-        RegistroFactura.usuario_id == u.id,
-        RegistroFactura.fecha_subida >= inicio_mes,
-        RegistroFactura.tipo == "Alta"  
-    ).count()
-
     return {
         "plan": nombre_plan,
         "consumo": consumo,
+        "anuladas": uso.anuladas,
+        "externas": uso.externas,
         "limite": limite_actual,
-        "porcentaje": min(int((consumo / limite_actual) * 100), 100),
-        "reset_date": (inicio_mes + timedelta(days=32)).replace(day=1).strftime("%d/%m/%Y") # Primer día del mes siguiente aprox
+        "porcentaje": min(int((consumo / limite_actual) * 100), 100) if limite_actual else 100,
+        "reset_date": (inicio_mes + timedelta(days=32)).replace(day=1).strftime("%d/%m/%Y") # Primer día del mes siguiente
     }
 
 # --- NUEVOS ENDPOINTS: GESTIÓN DE CLIENTES ---
-@app.get("/api/clientes")
-def leer_clientes(db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
-    return db.query(Cliente).filter(Cliente.usuario_id == u.id).all()
+@app.get("/api/clientes", response_model=List[ClienteSalida])
+def leer_clientes(cursor: Optional[str] = None, limite: Optional[int] = None, formato: str = "json", db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
+    usuario_id = u.id
+    return listar(db, lambda sesion: sesion.query(Cliente).filter(Cliente.usuario_id == usuario_id), ClienteSalida, [(Cliente.id, False)], cursor, limite, formato)
 
 @app.post("/api/clientes")
-def crear_cliente(dato: ClienteCreate, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def crear_cliente(dato: ClienteCreate, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     nuevo = Cliente(**dato.dict(), usuario_id=u.id)
     db.add(nuevo); db.commit(); db.refresh(nuevo)
     registrar_evento(db, "CONFIG", f"Cliente creado: {nuevo.nombre}", "INFO", u.id)
     return nuevo
 
 # --- NUEVOS ENDPOINTS: GESTIÓN DE PRODUCTOS ---
-@app.get("/api/productos")
-def leer_productos(db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
-    return db.query(Producto).filter(Producto.usuario_id == u.id).all()
+@app.get("/api/productos", response_model=List[ProductoSalida])
+def leer_productos(cursor: Optional[str] = None, limite: Optional[int] = None, formato: str = "json", db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
+    usuario_id = u.id
+    return listar(db, lambda sesion: sesion.query(Producto).filter(Producto.usuario_id == usuario_id), ProductoSalida, [(Producto.id, False)], cursor, limite, formato)
 
 @app.post("/api/productos")
-def crear_producto(dato: ProductoCreate, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def crear_producto(dato: ProductoCreate, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     nuevo = Producto(**dato.dict(), usuario_id=u.id)
     db.add(nuevo); db.commit(); db.refresh(nuevo)
     registrar_evento(db, "CONFIG", f"Producto creado: {nuevo.nombre}", "INFO", u.id)
@@ -737,11 +914,16 @@ class ResultadoVerificacion(BaseModel):
     valido: bool
     mensaje: str
     datos: Optional[dict] = None
+    prueba: Optional[dict] = None
 
 @app.get("/api/verificar-hash/{hash_string}", response_model=ResultadoVerificacion)
-def verificar_hash_publico(hash_string: str, db: Session = Depends(get_db)):
-    # Esto sigue siendo PÚBLICO
-    registro = db.query(RegistroFactura).filter(RegistroFactura.hash_actual == hash_string).first()
+def verificar_hash_publico(hash_string: str, prueba: bool = False, db: Session = Depends(get_db)):
+    # Esto sigue siendo PÚBLICO: lo que no pasa el filtro se rechaza sin consultar la BD
+    from filtro_hashes import indice_hashes
+    hash_string = hash_string.lower()
+    registro = None
+    if indice_hashes.puede_existir(hash_string):
+        registro = db.query(RegistroFactura).filter(RegistroFactura.hash_actual == hash_string).first()
     
     if not registro:
         return {
@@ -758,13 +940,41 @@ def verificar_hash_publico(hash_string: str, db: Session = Depends(get_db)):
             "numero_factura": registro.numero_factura,
             "cliente": registro.cliente,
             "total": registro.total
-        }
+        },
+        # ?prueba=true: prueba de inclusión Merkle (None si el bloque aún no está sellado)
+        "prueba": obtener_prueba(db, hash_string) if prueba else None
     }
 
+def obtener_prueba(db: Session, hash_string: str) -> Optional[dict]:
+    try:
+        return merkle.prueba_inclusion(db, hash_string)
+    except merkle.BloqueAlterado as e:
+        # Endpoint público: una alerta por bloque (y proceso), no una por cada consulta
+        if merkle.primera_alerta(e.bloque_id):
+            registrar_evento(db, "SEGURIDAD", str(e), "CRITICAL")
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="El bloque Merkle de este registro no coincide con su raíz sellada")
+
+# --- ANCLAJE MERKLE (PÚBLICO) ---
+@app.get("/api/merkle/prueba/{hash_string}")
+def prueba_merkle(hash_string: str, db: Session = Depends(get_db)):
+    from filtro_hashes import indice_hashes
+    hash_string = hash_string.lower()
+    if not indice_hashes.puede_existir(hash_string):
+        raise HTTPException(status_code=404, detail="El hash proporcionado NO consta en el registro de INALTERA.")
+    resultado = obtener_prueba(db, hash_string)
+    if resultado is None:
+        raise HTTPException(status_code=404, detail="El registro aún no está sellado en un bloque Merkle")
+    return resultado
+
+@app.get("/api/merkle/anclas")
+def anclas_merkle(desde: int = 0, limite: int = 1000, db: Session = Depends(get_db)):
+    # Raíces encadenadas de los bloques sellados, para publicarlas fuera (anclaje)
+    return merkle.anclas(db, desde, min(limite, 1000))
+
     # --- EDICIÓN Y BORRADO DE CLIENTES ---
 
 @app.put("/api/clientes/{cliente_id}")
-def actualizar_cliente(cliente_id: int, dato: ClienteCreate, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def actualizar_cliente(cliente_id: int, dato: ClienteCreate, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     cliente = db.query(Cliente).filter(Cliente.id == cliente_id, Cliente.usuario_id == u.id).first()
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
@@ -778,7 +988,7 @@ def actualizar_cliente(cliente_id: int, dato: ClienteCreate, db: Session = Depen
     return cliente
 
 @app.delete("/api/clientes/{cliente_id}")
-def borrar_cliente(cliente_id: int, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def borrar_cliente(cliente_id: int, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     cliente = db.query(Cliente).filter(Cliente.id == cliente_id, Cliente.usuario_id == u.id).first()
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente no encontrado")
@@ -791,7 +1001,7 @@ def borrar_cliente(cliente_id: int, db: Session = Depends(get_db), u: Usuario =
 # --- EDICIÓN Y BORRADO DE PRODUCTOS ---
 
 @app.put("/api/productos/{producto_id}")
-def actualizar_producto(producto_id: int, dato: ProductoCreate, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def actualizar_producto(producto_id: int, dato: ProductoCreate, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     prod = db.query(Producto).filter(Producto.id == producto_id, Producto.usuario_id == u.id).first()
     if not prod:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
@@ -805,7 +1015,7 @@ def actualizar_producto(producto_id: int, dato: ProductoCreate, db: Session = De
     return prod
 
 @app.delete("/api/productos/{producto_id}")
-def borrar_producto(producto_id: int, db: Session = Depends(get_db), u: Usuario = Depends(get_current_user)):
+def borrar_producto(producto_id: int, db: Session = Depends(get_db), u: UsuarioActual = Depends(get_current_user)):
     prod = db.query(Producto).filter(Producto.id == producto_id, Producto.usuario_id == u.id).first()
     if not prod:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
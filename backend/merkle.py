@@ -0,0 +1,314 @@
+# backend/merkle.py
+# Sellado periódico de los registros en árboles de Merkle y pruebas de inclusión.
+#
+# Los registros (de todos los usuarios, en orden de id) se agrupan en bloques de
+# MERKLE_BLOQUE. Cada bloque completo se sella con la raíz de su árbol, calculada
+# como en RFC 6962 (hoja = SHA-256(0x00 || hash), nodo = SHA-256(0x01 || izq || der)),
+# y con un "ancla" que encadena las raíces: ancla_k = SHA-256(ancla_{k-1} || raiz_k).
+#
+# Para demostrar que un hash_actual está registrado basta su ruta de auditoría
+# (log2(MERKLE_BLOQUE) hashes) y la raíz del bloque: el tercero no necesita recorrer
+# la cadena hash_anterior. Las anclas se exportan para publicarlas fuera.
+#
+# Cada bloque se comprueba entero contra su raíz la primera vez que se pide una prueba
+# en este proceso; su árbol queda en una LRU (MERKLE_CACHE_BLOQUES) y las siguientes
+# pruebas solo comprueban la hoja pedida y su ruta, O(log n) y sin releer el bloque.
+#
+# Uso: python merkle.py   (sella los bloques completos y muestra la última ancla)
+
+import bisect
+import hashlib
+import os
+import threading
+from typing import List, Optional
+
+from cachetools import LRUCache
+from sqlalchemy.exc import IntegrityError
+
+from models import SessionLocal, RegistroFactura, BloqueMerkle
+
+MERKLE_BLOQUE = int(os.getenv("MERKLE_BLOQUE", "1024"))
+MERKLE_INTERVALO_S = float(os.getenv("MERKLE_INTERVALO_S", "60"))
+MERKLE_CACHE_BLOQUES = int(os.getenv("MERKLE_CACHE_BLOQUES", "64")) # árboles verificados en memoria
+
+ANCLA_GENESIS = "0" * 64
+
+
+# --- Árbol (RFC 6962, sección 2.1) ---
+
+def hash_hoja(hash_actual: str) -> bytes:
+    return hashlib.sha256(b"\x00" + bytes.fromhex(hash_actual)).digest()
+
+
+def hash_nodo(izquierda: bytes, derecha: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + izquierda + derecha).digest()
+
+
+def _corte(n: int) -> int:
+    # Mayor potencia de 2 estrictamente menor que n
+    return 1 << ((n - 1).bit_length() - 1)
+
+
+def raiz(hojas: List[bytes]) -> bytes:
+    if not hojas:
+        return hashlib.sha256(b"").digest()
+    nivel = list(hojas)
+    if len(nivel) & (len(nivel) - 1) == 0:
+        # Potencia de 2 (el caso normal): por niveles, sin recursión
+        while len(nivel) > 1:
+            nivel = [hash_nodo(nivel[i], nivel[i + 1]) for i in range(0, len(nivel), 2)]
+        return nivel[0]
+    k = _corte(len(hojas))
+    return hash_nodo(raiz(hojas[:k]), raiz(hojas[k:]))
+
+
+def ruta_auditoria(indice: int, hojas: List[bytes]) -> List[bytes]:
+    """Hashes hermanos desde la hoja hasta la raíz (PATH(m, D[n]) de RFC 6962)."""
+    n = len(hojas)
+    if n <= 1:
+        return []
+    k = _corte(n)
+    if indice < k:
+        return ruta_auditoria(indice, hojas[:k]) + [raiz(hojas[k:])]
+    return ruta_auditoria(indice - k, hojas[k:]) + [raiz(hojas[:k])]
+
+
+class Arbol:
+    """Nodos de un árbol ya calculado: la ruta de cualquier hoja sin recalcular subárboles."""
+
+    def __init__(self, hojas: List[bytes]):
+        self.n_hojas = len(hojas)
+        self._nodos = {}  # (inicio, tamaño) -> hash del subárbol (RFC 6962: corte en potencia de 2)
+        self.raiz = self._nodo(hojas, 0, len(hojas)) if hojas else raiz([])
+
+    def _nodo(self, hojas: List[bytes], inicio: int, n: int) -> bytes:
+        if n == 1:
+            h = hojas[inicio]
+        else:
+            k = _corte(n)
+            h = hash_nodo(self._nodo(hojas, inicio, k), self._nodo(hojas, inicio + k, n - k))
+        self._nodos[(inicio, n)] = h
+        return h
+
+    def hoja(self, indice: int) -> bytes:
+        return self._nodos[(indice, 1)]
+
+    def ruta(self, indice: int) -> List[bytes]:
+        """Igual que ruta_auditoria(indice, hojas), con los nodos ya guardados."""
+        ruta, inicio, n = [], 0, self.n_hojas
+        while n > 1:
+            k = _corte(n)
+            if indice - inicio < k:
+                ruta.append(self._nodos[(inicio + k, n - k)])
+                n = k
+            else:
+                ruta.append(self._nodos[(inicio, k)])
+                inicio, n = inicio + k, n - k
+        return ruta[::-1]
+
+
+def verificar_prueba(hash_actual: str, indice: int, n_hojas: int, ruta: List[str], raiz_esperada: str) -> bool:
+    """Comprobación que puede hacer un tercero (RFC 9162, 2.1.3.2)."""
+    if indice >= n_hojas:
+        return False
+    fn, sn = indice, n_hojas - 1
+    r = hash_hoja(hash_actual)
+    for p in ruta:
+        p = bytes.fromhex(p)
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = hash_nodo(p, r)
+            if not fn & 1:
+                while fn and not fn & 1:
+                    fn >>= 1
+                    sn >>= 1
+        else:
+            r = hash_nodo(r, p)
+        fn >>= 1
+        sn >>= 1
+    return sn == 0 and r.hex() == raiz_esperada
+
+
+def encadenar_ancla(ancla_anterior: str, raiz_bloque: str) -> str:
+    return hashlib.sha256(bytes.fromhex(ancla_anterior) + bytes.fromhex(raiz_bloque)).hexdigest()
+
+
+# --- Sellado de bloques ---
+
+class BloqueAlterado(ValueError):
+    """Las hojas actuales de un bloque sellado no dan su raíz."""
+
+    def __init__(self, bloque_id: int):
+        super().__init__(f"El bloque {bloque_id} no coincide con su raíz sellada")
+        self.bloque_id = bloque_id
+
+
+_alertados = set()
+_lock_alertas = threading.Lock()
+
+
+def primera_alerta(bloque_id: int) -> bool:
+    """True la primera vez (en este proceso) que se detecta alterado un bloque."""
+    with _lock_alertas:
+        if bloque_id in _alertados:
+            return False
+        _alertados.add(bloque_id)
+        return True
+
+
+def sellar_bloques(db, hasta_id: Optional[int] = None) -> int:
+    """
+    Sella todos los bloques completos con registros de id <= hasta_id (por defecto,
+    todos). Devuelve cuántos se sellaron. Si otro worker sella el mismo bloque a la
+    vez, el suyo vale (el número de bloque es la clave primaria).
+    """
+    sellados = 0
+    while True:
+        ultimo = db.query(BloqueMerkle).order_by(BloqueMerkle.id.desc()).first()
+        desde = ultimo.hasta_id if ultimo else 0
+        consulta = db.query(RegistroFactura.id, RegistroFactura.hash_actual).filter(RegistroFactura.id > desde)
+        if hasta_id is not None:
+            consulta = consulta.filter(RegistroFactura.id <= hasta_id)
+        filas = consulta.order_by(RegistroFactura.id).limit(MERKLE_BLOQUE).all()
+        if len(filas) < MERKLE_BLOQUE:
+            return sellados
+
+        raiz_bloque = raiz([hash_hoja(h) for _, h in filas]).hex()
+        bloque = BloqueMerkle(
+            id=(ultimo.id if ultimo else 0) + 1,
+            desde_id=filas[0][0],
+            hasta_id=filas[-1][0],
+            n_hojas=len(filas),
+            raiz=raiz_bloque,
+            ancla=encadenar_ancla(ultimo.ancla if ultimo else ANCLA_GENESIS, raiz_bloque),
+        )
+        db.add(bloque)
+        try:
+            db.commit()
+            sellados += 1
+        except IntegrityError:
+            db.rollback()
+
+
+_arboles = LRUCache(maxsize=MERKLE_CACHE_BLOQUES)  # bloque -> (ids de sus hojas, Arbol)
+_lock_arboles = threading.Lock()
+
+
+def _arbol_verificado(db, bloque: BloqueMerkle):
+    """(ids, árbol) del bloque, comprobado entero contra su raíz sellada la primera vez."""
+    with _lock_arboles:
+        en_cache = _arboles.get(bloque.id)
+    if en_cache is not None and en_cache[1].raiz.hex() == bloque.raiz and en_cache[1].n_hojas == bloque.n_hojas:
+        return en_cache
+
+    filas = db.query(RegistroFactura.id, RegistroFactura.hash_actual).filter(
+        RegistroFactura.id >= bloque.desde_id, RegistroFactura.id <= bloque.hasta_id
+    ).order_by(RegistroFactura.id).all()
+    arbol = Arbol([hash_hoja(h) for _, h in filas])
+    if arbol.n_hojas != bloque.n_hojas or arbol.raiz.hex() != bloque.raiz:
+        with _lock_arboles:
+            _arboles.pop(bloque.id, None)
+        raise BloqueAlterado(bloque.id)
+    verificado = ([registro_id for registro_id, _ in filas], arbol)
+    with _lock_arboles:
+        _arboles[bloque.id] = verificado
+    return verificado
+
+
+def prueba_inclusion(db, hash_actual: str) -> Optional[dict]:
+    """
+    Prueba de inclusión de un hash_actual en su bloque, o None si aún no está sellado.
+    El bloque se comprueba entero contra su raíz la primera vez (_arbol_verificado);
+    después, la hoja y su ruta. Si no coinciden, el bloque se alteró.
+    """
+    registro = db.query(RegistroFactura.id).filter(RegistroFactura.hash_actual == hash_actual).first()
+    if registro is None:
+        return None
+    bloque = db.query(BloqueMerkle).filter(BloqueMerkle.hasta_id >= registro.id).order_by(BloqueMerkle.hasta_id).first()
+    if bloque is None or bloque.desde_id > registro.id:
+        return None
+
+    ids, arbol = _arbol_verificado(db, bloque)
+    indice = bisect.bisect_left(ids, registro.id)
+    if indice == len(ids) or ids[indice] != registro.id:
+        raise BloqueAlterado(bloque.id)
+    ruta = [h.hex() for h in arbol.ruta(indice)]
+    if not verificar_prueba(hash_actual, indice, arbol.n_hojas, ruta, bloque.raiz):
+        raise BloqueAlterado(bloque.id)
+    return {
+        "algoritmo": "RFC6962-SHA256",
+        "bloque": bloque.id,
+        "indice": indice,
+        "n_hojas": bloque.n_hojas,
+        "ruta": ruta,
+        "raiz": bloque.raiz,
+        "ancla": bloque.ancla,
+        "fecha_sellado": bloque.fecha,
+    }
+
+
+def anclas(db, desde_bloque: int = 0, limite: int = 1000) -> list:
+    filas = db.query(BloqueMerkle).filter(BloqueMerkle.id > desde_bloque).order_by(BloqueMerkle.id).limit(limite).all()
+    return [
+        {"bloque": b.id, "desde_id": b.desde_id, "hasta_id": b.hasta_id, "n_hojas": b.n_hojas,
+         "raiz": b.raiz, "ancla": b.ancla, "fecha": b.fecha}
+        for b in filas
+    ]
+
+
+class SelladorMerkle:
+    """Hilo que sella los bloques completos cada MERKLE_INTERVALO_S."""
+
+    def __init__(self, session_factory=SessionLocal, intervalo: float = MERKLE_INTERVALO_S):
+        self.session_factory = session_factory
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None:
+                self._parar.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="sellador-merkle", daemon=True)
+                self._hilo.start()
+
+    def detener(self):
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        if hilo is not None:
+            self._parar.set()
+            hilo.join()
+
+    def _bucle(self):
+        # Solo se sellan ids vistos en la vuelta anterior: una transacción que tenía
+        # reservado un id menor ya ha confirmado (o se ha deshecho) para entonces.
+        tope = None
+        while not self._parar.wait(self.intervalo if tope is not None else 0):
+            db = self.session_factory()
+            try:
+                if tope is not None:
+                    n = sellar_bloques(db, tope)
+                    if n:
+                        print(f"Merkle: {n} bloques sellados")
+                tope = db.query(RegistroFactura.id).order_by(RegistroFactura.id.desc()).limit(1).scalar() or 0
+            except Exception as e:
+                print(f"❌ Error sellando bloques Merkle: {e}")
+            finally:
+                db.close()
+
+
+sellador = SelladorMerkle()
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        n = sellar_bloques(db)
+        ultimo = db.query(BloqueMerkle).order_by(BloqueMerkle.id.desc()).first()
+        print(f"{n} bloques sellados")
+        if ultimo:
+            print(f"Última ancla: bloque {ultimo.id} (registros {ultimo.desde_id}-{ultimo.hasta_id}) {ultimo.ancla}")
+    finally:
+        db.close()
@@ -0,0 +1,185 @@
+# backend/metricas.py
+# Métricas en memoria con exposición en formato de texto de Prometheus (/metrics).
+#
+# Histogramas y contadores mínimos, sin dependencias: cada observación es un
+# perf_counter, un bisect sobre los límites y unas sumas bajo un lock por métrica.
+# Las etiquetas se pasan por posición y deben ser de cardinalidad baja (etapa, ruta
+# plantilla, tipo de cadena), nunca ids de usuario ni hashes.
+#
+# Los valores son por proceso: con varios workers, Prometheus debe rascar cada uno
+# (o agregarse por instancia). Los procesos de renderizado no registran nada: las
+# etapas de PDF se miden desde quien las lanza (incluyen la espera en el pool).
+
+import bisect
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Segundos: de 0,5 ms a 30 s
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes: de 4 KiB a 64 MiB
+BUCKETS_BYTES = tuple(4096 * 4 ** i for i in range(8))
+
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence, extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class Contador:
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRO.append(self)
+
+    def inc(self, *valores, n: float = 1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + n
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            valores = sorted(self._valores.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        lineas += [f"{self.nombre}{_etiquetas(self.etiquetas, k)} {_numero(v)}" for k, v in valores]
+        return lineas
+
+
+class Histograma:
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Tuple[str, ...] = (), buckets: Sequence[float] = BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(buckets)
+        # etiquetas -> [cuentas por bucket (no acumuladas) + la de +Inf, suma]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRO.append(self)
+
+    def observar(self, valor: float, *valores):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valor
+
+    def medir(self, *valores) -> "Cronometro":
+        """`with histograma.medir("etapa"):` observa la duración del bloque en segundos."""
+        return Cronometro(self, valores)
+
+    def exponer(self) -> List[str]:
+        with self._lock:
+            series = sorted((k, (list(c), s)) for k, (c, s) in self._series.items())
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, (cuentas, suma) in series:
+            acumulado = 0
+            for limite, cuenta in zip(self.buckets + (float("inf"),), cuentas):
+                acumulado += cuenta
+                le = "+Inf" if limite == float("inf") else _numero(limite)
+                etiquetas = _etiquetas(self.etiquetas, valores, 'le="' + le + '"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {acumulado}")
+        return lineas
+
+
+class Cronometro:
+    __slots__ = ("histograma", "valores", "inicio")
+
+    def __init__(self, histograma: Histograma, valores: tuple):
+        self.histograma = histograma
+        self.valores = valores
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, *self.valores)
+        return False
+
+
+REGISTRO: List[object] = []
+
+
+def exponer() -> str:
+    """Todas las métricas en formato de texto de Prometheus (0.0.4)."""
+    lineas = []
+    for metrica in REGISTRO:
+        lineas += metrica.exponer()
+    return "\n".join(lineas) + "\n"
+
+
+# --- MÉTRICAS DE LA APLICACIÓN ---
+
+PETICIONES = Histograma(
+    "inaltera_http_peticion_segundos", "Duración de las peticiones HTTP por ruta", ("metodo", "ruta", "estado"),
+)
+ETAPAS = Histograma(
+    "inaltera_etapa_segundos", "Duración de cada etapa del pipeline de facturación", ("etapa",),
+)
+CADENA_ESPERA = Histograma(
+    "inaltera_cadena_espera_segundos", "Espera para leer y bloquear la cabeza de una cadena", ("cadena",),
+)
+CADENA_COMMIT = Histograma(
+    "inaltera_cadena_commit_segundos", "Duración del commit al anexar a una cadena", ("cadena",),
+)
+CADENA_CONFLICTOS = Contador(
+    "inaltera_cadena_conflictos_total", "Reintentos de anexado por cabeza movida o base bloqueada", ("cadena",),
+)
+PDF_BYTES = Histograma(
+    "inaltera_pdf_bytes", "Tamaño de los PDFs generados, sellados y de terceros", ("tipo",), BUCKETS_BYTES,
+)
+SUBIDAS = Contador(
+    "inaltera_subidas_total", "Intentos de subida a la nube por resultado", ("resultado",),
+)
+SELLADO_RESPALDO = Contador(
+    "inaltera_sellado_respaldo_total", "Estampados sin actualización incremental rehechos en memoria", ("tipo",),
+)
+
+
+def tipo_cadena(cadena: str) -> str:
+    # "facturas:<usuario_id>" -> "facturas" (sin el id: cardinalidad acotada)
+    return cadena.split(":", 1)[0]
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI (sin BaseHTTPMiddleware) que mide cada petición HTTP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        estado = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+
+        inicio = time.perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = scope.get("route")
+            # Rutas sin coincidencia (404) agrupadas: la URL la elige el cliente
+            plantilla = getattr(ruta, "path", None) or "sin_ruta"
+            PETICIONES.observar(time.perf_counter() - inicio, scope["method"], plantilla, estado[0])
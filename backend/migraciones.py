@@ -0,0 +1,215 @@
+# backend/migraciones.py
+# Migraciones versionadas del esquema (sustituyen al create_all al importar models).
+#
+# Cada migración tiene un número; las aplicadas se apuntan en version_esquema. Una
+# base de datos nueva se crea entera con create_all y se marca con la última versión;
+# una existente aplica en orden las que le falten. Cada migración corre en su propia
+# transacción y empieza insertando su fila de versión: si dos workers arrancan a la
+# vez, el segundo choca con la clave primaria y la da por aplicada. Los pasos son
+# idempotentes (checkfirst) por si una base se creó a medias con versiones antiguas.
+#
+# --comprobar-planes pide el plan de las consultas más frecuentes (EXPLAIN) y avisa de
+# las que recorren una tabla entera en vez de usar un índice.
+#
+# Uso: python migraciones.py [--estado] [--comprobar-planes]
+
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from uso import sembrar_planes
+from models import (
+    Base, engine, VersionEsquema, RegistroFactura, EventoBitacora, Cliente, Producto,
+    Suscripcion, SubidaPendiente, UsoMensual, ConfiguracionEmpresa,
+)
+
+
+# --- MIGRACIONES ---
+
+def _tablas_que_falten(conexion):
+    Base.metadata.create_all(bind=conexion)
+
+
+def _indices(conexion):
+    # Índices compuestos de las consultas por usuario y de las claves foráneas.
+    # create_all no los añade a tablas que ya existían.
+    for tabla in Base.metadata.sorted_tables:
+        for indice in tabla.indexes:
+            indice.create(bind=conexion, checkfirst=True)
+
+
+def _limites_planes(conexion):
+    with Session(bind=conexion) as db:
+        sembrar_planes(db)
+
+
+def _columna_desglose_iva(conexion):
+    # Las bases creadas con create_all después de este cambio ya la tienen
+    tabla = RegistroFactura.__tablename__
+    if "desglose_iva" not in {c["name"] for c in inspect(conexion).get_columns(tabla)}:
+        conexion.exec_driver_sql(f"ALTER TABLE {tabla} ADD COLUMN desglose_iva TEXT")
+
+
+def _columna_fecha_creacion(conexion):
+    # Los registros anteriores no la tienen: se toma fecha_subida (en las externas es la
+    # fecha que indicó el usuario, lo más aproximado que hay)
+    tabla = RegistroFactura.__tablename__
+    if "fecha_creacion" not in {c["name"] for c in inspect(conexion).get_columns(tabla)}:
+        conexion.exec_driver_sql(f"ALTER TABLE {tabla} ADD COLUMN fecha_creacion TIMESTAMP")
+    conexion.exec_driver_sql(f"UPDATE {tabla} SET fecha_creacion = fecha_subida WHERE fecha_creacion IS NULL")
+
+
+def _hash_actual_unico(conexion):
+    # Un hash_actual identifica un único registro (cada cadena tiene su génesis). Las
+    # bases con el índice sin UNIQUE lo recrean; si ya hay hashes repetidos se para
+    # aquí con un error claro en vez de fallar al crear el índice.
+    tabla = RegistroFactura.__table__
+    indice = next(i for i in tabla.indexes if i.name == "ix_registros_facturacion_hash_actual")
+    repetidos = conexion.execute(
+        select(func.count()).select_from(
+            select(RegistroFactura.hash_actual).group_by(RegistroFactura.hash_actual).having(func.count() > 1).subquery()
+        )
+    ).scalar()
+    if repetidos:
+        raise RuntimeError(f"{repetidos} valores de hash_actual repetidos en {tabla.name}: no se puede crear el índice único")
+    for existente in inspect(conexion).get_indexes(tabla.name):
+        if existente["name"] == indice.name and not existente["unique"]:
+            indice.drop(bind=conexion)
+    indice.create(bind=conexion, checkfirst=True)
+
+
+MIGRACIONES = [
+    (1, "Tablas que falten", _tablas_que_falten),
+    (2, "Índices compuestos por usuario y de claves foráneas", _indices),
+    (3, "Límites de los planes en planes_limite", _limites_planes),
+    (4, "Desglose de IVA en registros_facturacion", _columna_desglose_iva),
+    (5, "Índice único de registros_facturacion.hash_actual", _hash_actual_unico),
+    (6, "Fecha de creación en registros_facturacion", _columna_fecha_creacion),
+]
+
+
+def version_actual(conexion) -> int:
+    return conexion.execute(select(func.max(VersionEsquema.version))).scalar() or 0
+
+
+def _apuntar(conexion, version: int, descripcion: str):
+    conexion.execute(insert(VersionEsquema).values(version=version, descripcion=descripcion, fecha=datetime.utcnow()))
+
+
+def migrar(motor=engine) -> int:
+    """Deja el esquema en la última versión. Devuelve cuántas migraciones aplicó."""
+    nueva = not inspect(motor).has_table(RegistroFactura.__tablename__)
+    VersionEsquema.__table__.create(bind=motor, checkfirst=True)
+
+    if nueva:
+        try:
+            with motor.begin() as conexion:
+                _apuntar(conexion, MIGRACIONES[-1][0], "Esquema creado desde cero")
+                Base.metadata.create_all(bind=conexion)
+                _limites_planes(conexion)
+            print(f"Esquema creado (versión {MIGRACIONES[-1][0]})")
+            return len(MIGRACIONES)
+        except IntegrityError:
+            pass  # otro worker lo creó a la vez
+
+    aplicadas = 0
+    for version, descripcion, paso in MIGRACIONES:
+        with motor.connect() as conexion:
+            if version_actual(conexion) >= version:
+                continue
+        try:
+            with motor.begin() as conexion:
+                _apuntar(conexion, version, descripcion)
+                paso(conexion)
+        except IntegrityError:
+            continue  # la aplicó otro worker
+        aplicadas += 1
+        print(f"Migración {version} aplicada: {descripcion}")
+    return aplicadas
+
+
+# --- COMPROBACIÓN DE PLANES ---
+
+def consultas_frecuentes() -> dict:
+    """Las consultas de los caminos calientes, con valores de ejemplo."""
+    R, E = RegistroFactura, EventoBitacora
+    inicio = datetime(2026, 1, 1)
+    fin = inicio + timedelta(days=31)
+    return {
+        "registros del usuario (por id)": select(R.id, R.hash_actual).where(R.usuario_id == 1).order_by(R.id.desc()).limit(50),
+        "registros del usuario (por fecha)": select(R.id).where(R.usuario_id == 1, R.fecha_subida >= inicio)
+            .order_by(R.fecha_subida.desc(), R.id.desc()).limit(50),
+        "registros del usuario (por tipo)": select(R.id).where(R.usuario_id == 1, R.tipo == "Alta").order_by(R.id).limit(50),
+        "recuento del mes por tipo": select(R.tipo, func.count(R.id)).where(
+            R.usuario_id == 1, R.fecha_subida >= inicio, R.fecha_subida < fin).group_by(R.tipo),
+        "cabeza de la cadena de facturas": select(R.hash_actual).where(R.usuario_id == 1).order_by(R.id.desc()).limit(1),
+        "verificar hash": select(R.id).where(R.hash_actual == "0" * 64),
+        "bitácora del usuario": select(E.id).where(E.usuario_id == 1).order_by(E.id.desc()).limit(50),
+        "clientes del usuario": select(Cliente.id).where(Cliente.usuario_id == 1).order_by(Cliente.id).limit(50),
+        "productos del usuario": select(Producto.id).where(Producto.usuario_id == 1).order_by(Producto.id).limit(50),
+        "configuración de empresa": select(ConfiguracionEmpresa.id).where(ConfiguracionEmpresa.usuario_id == 1),
+        "suscripción del usuario": select(Suscripcion.plan).where(Suscripcion.usuario_id == 1),
+        "uso del mes": select(UsoMensual.emitidas).where(UsoMensual.usuario_id == 1, UsoMensual.mes == "2026-01"),
+        "subidas pendientes": select(SubidaPendiente.id).where(
+            SubidaPendiente.estado.in_(("pendiente", "en_curso")), SubidaPendiente.proximo_intento <= inicio
+        ).order_by(SubidaPendiente.proximo_intento).limit(100),
+    }
+
+
+def _plan(conexion, consulta) -> list:
+    sql = str(consulta.compile(dialect=conexion.dialect, compile_kwargs={"literal_binds": True}))
+    if conexion.dialect.name == "sqlite":
+        return [fila[-1] for fila in conexion.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+    plan = conexion.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+    nodos, pendientes = [], [plan[0]["Plan"] if isinstance(plan, list) else json.loads(plan)[0]["Plan"]]
+    while pendientes:
+        nodo = pendientes.pop()
+        nodos.append(f"{nodo['Node Type']} {nodo.get('Relation Name', '')} {nodo.get('Index Name', '')}".strip())
+        pendientes.extend(nodo.get("Plans", []))
+    return nodos
+
+
+def _recorre_tabla(paso: str) -> bool:
+    # SQLite: "SCAN tabla" sin índice. PostgreSQL: un nodo Seq Scan.
+    return (paso.startswith("SCAN ") and " USING " not in paso) or paso.startswith("Seq Scan")
+
+
+def comprobar_planes(motor=engine) -> list:
+    """[{consulta, plan, recorre_tabla}] para cada consulta frecuente."""
+    informe = []
+    with motor.connect() as conexion:
+        if conexion.dialect.name == "postgresql":
+            # Con pocas filas PostgreSQL prefiere el Seq Scan aunque haya índice:
+            # así solo sale cuando no hay índice utilizable.
+            conexion.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        for nombre, consulta in consultas_frecuentes().items():
+            plan = _plan(conexion, consulta)
+            informe.append({"consulta": nombre, "plan": plan, "recorre_tabla": any(_recorre_tabla(p) for p in plan)})
+        conexion.rollback()
+    return informe
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de INALTERA")
+    parser.add_argument("--estado", action="store_true", help="Muestra la versión del esquema sin migrar")
+    parser.add_argument("--comprobar-planes", action="store_true", help="Avisa de las consultas frecuentes que recorren tablas enteras")
+    args = parser.parse_args()
+
+    if args.estado:
+        with engine.connect() as conexion:
+            actual = version_actual(conexion) if inspect(engine).has_table(VersionEsquema.__tablename__) else 0
+        print(f"Versión del esquema: {actual} (última: {MIGRACIONES[-1][0]})")
+        raise SystemExit(0)
+
+    migrar()
+    if args.comprobar_planes:
+        lentas = 0
+        for fila in comprobar_planes():
+            marca = "❌" if fila["recorre_tabla"] else "✅"
+            lentas += fila["recorre_tabla"]
+            print(f"{marca} {fila['consulta']}: {' | '.join(fila['plan'])}")
+        raise SystemExit(1 if lentas else 0)
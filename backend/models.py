@@ -1,9 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import time
 from dotenv import load_dotenv
 
 # 1. Cargar variables de entorno
@@ -14,13 +15,75 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./inaltera.db")
 
 # 3. Configuración del Motor (Engine)
+# Perfiles con valores por defecto para el pool (PostgreSQL); cada valor se puede
+# sobrescribir con su variable de entorno. En SQLite se aplican PRAGMAs al abrir cada
+# conexión: WAL deja leer mientras otro escribe y busy_timeout espera al bloqueo en
+# vez de fallar al momento con "database is locked".
 Base = declarative_base()
 
+PERFILES_BD = {
+    "desarrollo": {"pool_size": 5, "max_overflow": 10, "pool_recycle": -1, "pool_pre_ping": False, "statement_timeout_ms": 0},
+    "produccion": {"pool_size": 10, "max_overflow": 20, "pool_recycle": 1800, "pool_pre_ping": True, "statement_timeout_ms": 30000},
+}
+DB_PERFIL = os.getenv("DB_PERFIL", "desarrollo")
+if DB_PERFIL not in PERFILES_BD:
+    raise ValueError(f"DB_PERFIL desconocido: {DB_PERFIL!r} (perfiles: {', '.join(PERFILES_BD)})")
+_perfil = PERFILES_BD[DB_PERFIL]
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", _perfil["pool_size"]))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", _perfil["max_overflow"]))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", _perfil["pool_recycle"]))
+DB_POOL_TIMEOUT_S = int(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", str(_perfil["pool_pre_ping"])).lower() in ("1", "true", "si")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", _perfil["statement_timeout_ms"])) # 0 = sin límite
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL") # con WAL, NORMAL no arriesga la integridad
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_MB = int(os.getenv("SQLITE_MMAP_MB", "256"))
+SQLITE_CACHE_MB = int(os.getenv("SQLITE_CACHE_MB", "64"))
+
+DB_CONSULTAS_LENTAS_MS = float(os.getenv("DB_CONSULTAS_LENTAS_MS", "0")) # 0 = no se registran
+
 if "sqlite" in DATABASE_URL:
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
+
+    @event.listens_for(engine, "connect")
+    def _pragmas_sqlite(conexion, _registro):
+        cursor = conexion.cursor()
+        try:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_MB * 1024 * 1024}")
+            cursor.execute(f"PRAGMA cache_size={-SQLITE_CACHE_MB * 1024}") # negativo = KiB
+        finally:
+            cursor.close()
 else:
     # Configuración para PostgreSQL
-    engine = create_engine(DATABASE_URL)
+    opciones = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        opciones["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    engine = create_engine(
+        DATABASE_URL,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE_S,
+        pool_timeout=DB_POOL_TIMEOUT_S,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args=opciones,
+    )
+
+if DB_CONSULTAS_LENTAS_MS > 0:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _inicio_consulta(conexion, cursor, sentencia, parametros, contexto, multiple):
+        contexto._inicio_consulta = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _fin_consulta(conexion, cursor, sentencia, parametros, contexto, multiple):
+        ms = (time.perf_counter() - contexto._inicio_consulta) * 1000
+        if ms >= DB_CONSULTAS_LENTAS_MS:
+            print(f"🐢 Consulta lenta ({ms:.0f} ms): {' '.join(sentencia.split())[:500]}")
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -42,18 +105,29 @@ class RegistroFactura(Base):
     __tablename__ = "registros_facturacion"
     id = Column(Integer, primary_key=True, index=True)
     nombre_archivo = Column(String)
-    fecha_subida = Column(DateTime, default=datetime.utcnow)
+    fecha_subida = Column(DateTime, default=datetime.utcnow) # en las externas, la fecha que indica el usuario
+    fecha_creacion = Column(DateTime, default=datetime.utcnow) # cuándo se registró (la del servidor)
     numero_factura = Column(String, default="S/N")
     cliente = Column(String, default="General")
     total = Column(Float, default=0.0)
+    desglose_iva = Column(Text, nullable=True) # JSON: [{iva, base, cuota}] de totales.py (solo facturas emitidas)
     tipo = Column(String, default="Alta")
     estado = Column(String, default="Válida")
     motivo_anulacion = Column(String, nullable=True)
     hash_anterior = Column(String)
-    hash_actual = Column(String)
+    hash_actual = Column(String, unique=True, index=True) # búsqueda puntual en /api/verificar-hash
     datos_qr = Column(String)
     usuario_id = Column(Integer, ForeignKey("usuarios.id"))
     propietario = relationship("Usuario", back_populates="facturas")
+    subida = relationship("SubidaPendiente", back_populates="registro", uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # Listados y cabeza de la cadena del usuario (por id), orden por fecha y
+        # recuentos del mes por tipo
+        Index("ix_registros_facturacion_usuario_id_id", "usuario_id", "id"),
+        Index("ix_registros_facturacion_usuario_fecha", "usuario_id", "fecha_subida", "id"),
+        Index("ix_registros_facturacion_usuario_tipo_fecha", "usuario_id", "tipo", "fecha_subida"),
+    )
 
 class ConfiguracionEmpresa(Base):
     __tablename__ = "configuracion_empresa"
@@ -62,7 +136,7 @@ class ConfiguracionEmpresa(Base):
     nif = Column(String, default="B-00000000")
     direccion = Column(String, default="C/ Mi Dirección, 1")
     web = Column(String, default="www.miempresa.com")
-    usuario_id = Column(Integer, ForeignKey("usuarios.id"))
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), index=True)
     propietario = relationship("Usuario", back_populates="configuracion")
 
 class EventoBitacora(Base):
@@ -77,6 +151,8 @@ class EventoBitacora(Base):
     usuario_id = Column(Integer, ForeignKey("usuarios.id"), nullable=True)
     usuario = relationship("Usuario", back_populates="eventos")
 
+    __table_args__ = (Index("ix_bitacora_eventos_usuario_id_id", "usuario_id", "id"),)
+
 class Cliente(Base):
     __tablename__ = "clientes"
     id = Column(Integer, primary_key=True, index=True)
@@ -87,6 +163,8 @@ class Cliente(Base):
     usuario_id = Column(Integer, ForeignKey("usuarios.id"))
     propietario = relationship("Usuario", back_populates="clientes")
 
+    __table_args__ = (Index("ix_clientes_usuario_id_id", "usuario_id", "id"),)
+
 class Producto(Base):
     __tablename__ = "productos"
     id = Column(Integer, primary_key=True, index=True)
@@ -97,6 +175,8 @@ class Producto(Base):
     usuario_id = Column(Integer, ForeignKey("usuarios.id"))
     propietario = relationship("Usuario", back_populates="productos")
 
+    __table_args__ = (Index("ix_productos_usuario_id_id", "usuario_id", "id"),)
+
 class Suscripcion(Base):
     __tablename__ = "suscripciones"
     id = Column(Integer, primary_key=True, index=True)
@@ -105,8 +185,79 @@ class Suscripcion(Base):
     fecha_renovacion = Column(DateTime, default=datetime.utcnow)
     stripe_id = Column(String, nullable=True) # Preparado para el futuro
     
-    usuario_id = Column(Integer, ForeignKey("usuarios.id"))
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), index=True)
     # Necesitamos añadir la relación inversa en la clase Usuario si queremos navegar
     # Pero para este paso básico no es estrictamente necesario tocar la clase Usuario hoy.
 
-Base.metadata.create_all(bind=engine)
\ No newline at end of file
+class CabezaCadena(Base):
+    # Último eslabón de cada cadena de hashes ("facturas:<usuario_id>" o "bitacora").
+    # Se bloquea y actualiza con compare-and-swap sobre "version" en cada anexado.
+    __tablename__ = "cabezas_cadena"
+    cadena = Column(String, primary_key=True)
+    ultimo_hash = Column(String)
+    version = Column(Integer, default=0, nullable=False)
+    fecha_actualizacion = Column(DateTime, default=datetime.utcnow)
+
+class SubidaPendiente(Base):
+    # Outbox de subidas al almacenamiento en la nube. Se inserta en la misma transacción
+    # que el RegistroFactura ("preparando": aún no hay copia local), pasa a "pendiente"
+    # cuando el PDF está escrito en uploads/ y la procesa el trabajador de subidas.py.
+    __tablename__ = "subidas_pendientes"
+    id = Column(Integer, primary_key=True, index=True)
+    registro_id = Column(Integer, ForeignKey("registros_facturacion.id"), unique=True)
+    estado = Column(String, default="preparando") # preparando, pendiente, en_curso, subida, error
+    intentos = Column(Integer, default=0)
+    proximo_intento = Column(DateTime, default=datetime.utcnow)
+    ultimo_error = Column(String, nullable=True)
+    fecha_creacion = Column(DateTime, default=datetime.utcnow)
+    fecha_subida = Column(DateTime, nullable=True)
+    registro = relationship("RegistroFactura", back_populates="subida")
+
+    # Sondeo del trabajador de subidas
+    __table_args__ = (Index("ix_subidas_pendientes_estado_proximo", "estado", "proximo_intento"),)
+
+class PuntoControl(Base):
+    # Estado firmado (HMAC) de una verificación completa de una cadena hasta "hasta_id".
+    # Las siguientes ejecuciones de verificador.py solo revisan las filas posteriores.
+    __tablename__ = "puntos_control"
+    id = Column(Integer, primary_key=True, index=True)
+    cadena = Column(String, index=True) # "facturas" o "bitacora"
+    hasta_id = Column(Integer)
+    estado = Column(Text) # JSON: último hash de cada cadena y de la fila hasta_id
+    fecha = Column(DateTime, default=datetime.utcnow)
+    firma = Column(String)
+
+class BloqueMerkle(Base):
+    # Árbol de Merkle (RFC 6962) sobre un bloque de MERKLE_BLOQUE registros consecutivos
+    # por id. "ancla" encadena las raíces: publicar la última compromete todas las anteriores.
+    __tablename__ = "bloques_merkle"
+    id = Column(Integer, primary_key=True) # número de bloque, empezando en 1
+    desde_id = Column(Integer)
+    hasta_id = Column(Integer, index=True)
+    n_hojas = Column(Integer)
+    raiz = Column(String)
+    ancla = Column(String)
+    fecha = Column(DateTime, default=datetime.utcnow)
+
+class PlanLimite(Base):
+    # Límites de cada plan de Suscripcion (facturas "Alta" al mes)
+    __tablename__ = "planes_limite"
+    plan = Column(String, primary_key=True) # Free, Basic, Pro
+    facturas_mes = Column(Integer, nullable=False)
+
+class UsoMensual(Base):
+    # Contadores del mes por usuario, actualizados en la misma transacción que cada
+    # emisión, anulación o subida (uso.py). /api/uso-plan solo lee esta fila.
+    __tablename__ = "uso_mensual"
+    usuario_id = Column(Integer, ForeignKey("usuarios.id"), primary_key=True)
+    mes = Column(String, primary_key=True) # "YYYY-MM" (UTC)
+    emitidas = Column(Integer, default=0, nullable=False)
+    anuladas = Column(Integer, default=0, nullable=False)
+    externas = Column(Integer, default=0, nullable=False)
+
+class VersionEsquema(Base):
+    # Migraciones aplicadas (migraciones.py). El esquema ya no se crea al importar.
+    __tablename__ = "version_esquema"
+    version = Column(Integer, primary_key=True)
+    descripcion = Column(String)
+    fecha = Column(DateTime, default=datetime.utcnow)
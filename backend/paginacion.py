@@ -0,0 +1,167 @@
+# backend/paginacion.py
+# Listados paginados por keyset y en streaming para los endpoints de la API.
+#
+# Tres formas de pedir un listado:
+#  - Sin "limite": el array completo de siempre, pero serializado en streaming (las
+#    filas se leen con yield_per y se escriben según llegan; la memoria no crece con
+#    el historial).
+#  - Con "limite": una página del array. Si hay más, la cabecera X-Siguiente-Cursor
+#    trae el cursor para pedir la siguiente (?cursor=...). El cursor guarda los valores
+#    de orden de la última fila: la siguiente página es un "WHERE (orden) > cursor"
+#    sobre el índice, sin OFFSET.
+#  - Con "formato=ndjson": una fila JSON por línea, también en streaming.
+#
+# Solo se consultan las columnas del schema de salida (Query.with_entities): las filas
+# llegan como tuplas, sin objetos ORM ni identity map, y pydantic-core las serializa
+# por lotes (TypeAdapter.dump_json). Los campos internos como usuario_id no salen.
+#
+# El streaming usa su propia sesión: la de la petición se cierra al devolver la respuesta.
+
+import base64
+import functools
+import json
+import os
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple, Type
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query, Session
+
+from models import SessionLocal
+
+PAGINA_MAX = int(os.getenv("PAGINA_MAX", "500"))
+STREAM_LOTE = int(os.getenv("STREAM_LOTE", "500")) # filas por viaje a la BD en streaming
+
+CABECERA_CURSOR = "X-Siguiente-Cursor"
+
+# (columna, descendente)
+Orden = List[Tuple[object, bool]]
+
+
+def codificar_cursor(valores: list) -> str:
+    crudo = json.dumps(jsonable_encoder(valores), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(crudo).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor: str, orden: Orden) -> list:
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(valores, list) or len(valores) != len(orden):
+            raise ValueError
+        # Las fechas viajan como ISO 8601
+        return [
+            datetime.fromisoformat(v) if v is not None and getattr(col.type, "python_type", None) is datetime else v
+            for v, (col, _) in zip(valores, orden)
+        ]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor no válido")
+
+
+def _despues_de(orden: Orden, valores: list):
+    # (a, b) > (x, y) desarrollado: a > x OR (a = x AND b > y), respetando la dirección
+    condiciones = []
+    for i, (col, desc) in enumerate(orden):
+        iguales = [c == v for (c, _), v in zip(orden[:i], valores[:i])]
+        condiciones.append(and_(*iguales, col < valores[i] if desc else col > valores[i]))
+    return or_(*condiciones)
+
+
+def ordenar(consulta: Query, orden: Orden, cursor: Optional[str]) -> Query:
+    if cursor:
+        consulta = consulta.filter(_despues_de(orden, decodificar_cursor(cursor, orden)))
+    return consulta.order_by(*[col.desc() if desc else col.asc() for col, desc in orden])
+
+
+@functools.lru_cache(maxsize=None)
+def _adaptador(esquema: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[esquema])
+
+
+def _proyectar(consulta: Query, esquema: Type[BaseModel]) -> Query:
+    # Solo las columnas del schema, en su orden
+    modelo = consulta.column_descriptions[0]["entity"]
+    return consulta.with_entities(*[getattr(modelo, campo) for campo in esquema.model_fields])
+
+
+def _modelos(filas, esquema: Type[BaseModel]) -> list:
+    # Los datos ya vienen tipados de la BD: se construye sin validar
+    return [esquema.model_construct(**fila._mapping) for fila in filas]
+
+
+def _valores_orden(fila, orden: Orden) -> list:
+    return [fila._mapping[col.key] for col, _ in orden]
+
+
+def _lotes(consulta: Query):
+    lote = []
+    for fila in consulta.yield_per(STREAM_LOTE):
+        lote.append(fila)
+        if len(lote) >= STREAM_LOTE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _stream(construir: Callable[[Session], Query], esquema: Type[BaseModel], ndjson: bool):
+    adaptador = _adaptador(esquema)
+    db = SessionLocal()
+    try:
+        if not ndjson:
+            yield b"["
+        primero = True
+        for lote in _lotes(construir(db)):
+            modelos = _modelos(lote, esquema)
+            if ndjson:
+                yield b"".join(m.__pydantic_serializer__.to_json(m) + b"\n" for m in modelos)
+            else:
+                # "[a,b,c]" del lote sin los corchetes, unido con el anterior por ","
+                cuerpo = adaptador.dump_json(modelos)[1:-1]
+                yield cuerpo if primero else b"," + cuerpo
+            primero = False
+        if not ndjson:
+            yield b"]"
+    finally:
+        db.close()
+
+
+def listar(
+    db: Session,
+    construir: Callable[[Session], Query],
+    esquema: Type[BaseModel],
+    orden: Orden,
+    cursor: Optional[str] = None,
+    limite: Optional[int] = None,
+    formato: str = "json",
+):
+    """
+    `construir(sesion)` devuelve la consulta de la entidad ya filtrada (usuario, filtros)
+    sin ordenar; aquí se proyecta a las columnas de `esquema` y se le aplican el orden,
+    el cursor y el límite según el modo pedido. Las columnas de `orden` deben estar en
+    el schema (el cursor se saca de la última fila).
+    """
+    if formato not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Formato no soportado (json o ndjson)")
+    if cursor is not None and limite is None and formato == "json":
+        limite = PAGINA_MAX
+
+    if limite is None or formato == "ndjson":
+        # Streaming con sesión propia (el cursor también vale para reanudar un NDJSON)
+        def construir_ordenada(sesion):
+            consulta = ordenar(_proyectar(construir(sesion), esquema), orden, cursor)
+            return consulta.limit(limite) if limite else consulta
+        media = "application/x-ndjson" if formato == "ndjson" else "application/json"
+        return StreamingResponse(_stream(construir_ordenada, esquema, formato == "ndjson"), media_type=media)
+
+    limite = max(1, min(limite, PAGINA_MAX))
+    filas = ordenar(_proyectar(construir(db), esquema), orden, cursor).limit(limite + 1).all()
+    cabeceras = {}
+    if len(filas) > limite:
+        filas = filas[:limite]
+        cabeceras[CABECERA_CURSOR] = codificar_cursor(_valores_orden(filas[-1], orden))
+    cuerpo = _adaptador(esquema).dump_json(_modelos(filas, esquema))
+    return Response(content=cuerpo, media_type="application/json", headers=cabeceras)
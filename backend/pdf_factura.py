@@ -0,0 +1,553 @@
+# backend/pdf_factura.py
+# Generación del PDF de factura y estampado del QR de verificación.
+# Solo depende de reportlab/pypdf y de los schemas, así se puede ejecutar en un
+# pool de procesos sin cargar la app ni la base de datos.
+
+import io
+import os
+import shutil
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import (
+    ArrayObject, DecodedStreamObject, DictionaryObject, IndirectObject, NameObject, NumberObject, StreamObject,
+)
+from reportlab import rl_config
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.units import mm
+from reportlab.graphics.barcode import qr
+from reportlab.graphics import renderPDF
+from reportlab.graphics.shapes import Drawing
+
+from schemas import DatosFactura
+from totales import calcular_totales
+
+# Sellado de nuestras facturas (el hash cubre la versión pre-sello, que se dibuja antes):
+#  - "canvas" (por defecto): se vuelve a dibujar la factura con el QR en el mismo canvas;
+#    el PDF final es un documento limpio de una sola revisión.
+#  - "incremental": se dibuja una sola vez; el sello se añade a esos mismos bytes como
+#    actualización incremental, sin volver a maquetar ni reescribir el PDF.
+#  - "fusion": comportamiento anterior (segundo canvas + PdfReader + merge_page).
+# Si la actualización incremental no es posible se estampa en memoria y se cuenta en
+# SELLADO_RESPALDO (desde el proceso principal: el estampado corre en procesos hijo).
+PDF_SELLADO = os.getenv("PDF_SELLADO", "canvas")
+# Plantillas de empresa cacheadas por proceso (una por combinación de datos de empresa)
+PDF_PLANTILLAS_MAX = int(os.getenv("PDF_PLANTILLAS_MAX", "256"))
+
+def _dibujar_sello(c: canvas.Canvas, texto_qr: str):
+    """
+    Versión avanzada (Vectorial + Link): QR, hipervínculo y texto sobre la página actual.
+    """
+    c.saveState()
+
+    # --- CONFIGURACIÓN DE POSICIÓN ---
+    qr_size = 25 * mm
+    x_pos = 170 * mm  
+    y_pos = 250 * mm  
+    
+    # 1. Generar el Gráfico del QR Vectorial
+    qr_code = qr.QrCodeWidget(texto_qr)
+    qr_code.barWidth = qr_size
+    qr_code.barHeight = qr_size
+    qr_code.qrVersion = 1
+
+    d = Drawing(qr_size, qr_size)
+    d.add(qr_code)
+
+    # 2. Dibujar el QR
+    renderPDF.draw(d, c, x_pos, y_pos)
+
+    # 3. HIPERVÍNCULO
+    rectangulo_click = (x_pos, y_pos, x_pos + qr_size, y_pos + qr_size)
+    c.linkURL(texto_qr, rect=rectangulo_click)
+
+    # 4. Texto
+    c.setFont("Helvetica", 6)
+    c.drawString(x_pos, y_pos - 3*mm, "Verificar doc:")
+    c.setFont("Helvetica-Oblique", 6)
+    c.setFillColorRGB(0, 0, 1)
+    c.drawString(x_pos, y_pos - 6*mm, "verificar en blockchain")
+
+    c.restoreState()
+
+def _pdf_sello(texto_qr: str) -> bytes:
+    packet = io.BytesIO()
+    c = canvas.Canvas(packet, pagesize=letter)
+    _dibujar_sello(c, texto_qr)
+    c.save()
+    return packet.getvalue()
+
+def estampar_qr(pdf_bytes: bytes, texto_qr: str) -> bytes:
+    """
+    Estampa el QR sobre un PDF ya existente (facturas de terceros), todo en memoria.
+    """
+    packet = io.BytesIO(_pdf_sello(texto_qr))
+
+    # Fusionar
+    new_pdf = PdfReader(packet)
+    existing_pdf = PdfReader(io.BytesIO(pdf_bytes))
+    output = PdfWriter()
+
+    for i in range(len(existing_pdf.pages)):
+        page = existing_pdf.pages[i]
+        if i == 0: page.merge_page(new_pdf.pages[0])
+        output.add_page(page)
+
+    salida = io.BytesIO()
+    output.write(salida)
+    return salida.getvalue()
+
+# --- PLANTILLA DE EMPRESA ---
+# La parte fija de la factura (cabecera de la empresa, encabezados de la tabla y su
+# línea) se dibuja una vez por empresa y se guarda ya comprimida: cada factura la
+# incluye como Form XObject sin volver a dibujarla ni a comprimirla, y solo dibuja lo
+# variable. La caché va por el contenido de los datos de empresa: si se guardan
+# otros, es otra entrada (no hay que invalidar nada en los procesos hijos).
+#
+# Reutilizar un stream entre documentos no tiene API pública en reportlab: se usan sus
+# internos (_doc, _preamble, _code), por eso reportlab está fijado en requirements y
+# tests/test_pdf.py compara la salida con la de beginForm/endForm. Si los internos no
+# son los esperados, la plantilla se dibuja con beginForm/endForm (una vez por documento).
+
+NOMBRE_PLANTILLA = "PlantillaEmpresa"
+# Fuentes registradas en este orden en todo canvas que use la plantilla, para que sus
+# nombres internos (/F1, /F2...) coincidan con los de la plantilla cacheada
+FUENTES = ("Helvetica", "Helvetica-Bold")
+_aviso_plantilla = False
+
+def _fuentes_internas(c: canvas.Canvas) -> tuple:
+    # Registra FUENTES en el documento (si no lo estaban) y devuelve sus nombres internos
+    return tuple(c._doc.getInternalFontName(fuente) for fuente in FUENTES)
+
+def _nuevo_canvas(buffer) -> canvas.Canvas:
+    c = canvas.Canvas(buffer, pagesize=letter)
+    try:
+        _fuentes_internas(c)
+    except AttributeError:
+        pass  # sin los internos esperados: _usar_plantilla usa la API pública
+    return c
+
+def _dibujar_plantilla(c: canvas.Canvas, razon_social: str, direccion: str, nif: str, web: str):
+    width, height = letter
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(50, height - 50, razon_social) 
+    c.setFont("Helvetica", 10)
+    c.drawString(50, height - 70, direccion)   
+    c.drawString(50, height - 85, f"NIF: {nif}") 
+    c.drawString(50, height - 100, web)        
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(350, height - 50, "FACTURA A:")
+
+    y = height - 160
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(50, y, "Descripción")
+    c.drawString(300, y, "Cant.")
+    c.drawString(350, y, "Precio")
+    c.drawString(480, y, "Importe")
+    c.line(50, y - 5, 550, y - 5)
+
+@lru_cache(maxsize=PDF_PLANTILLAS_MAX)
+def _plantilla(razon_social: str, direccion: str, nif: str, web: str) -> Tuple[bytes, tuple, tuple]:
+    """(contenido codificado, nombres de filtro, nombres internos de FUENTES) del stream de la plantilla."""
+    c = _nuevo_canvas(io.BytesIO())
+    fuentes = _fuentes_internas(c)
+    _dibujar_plantilla(c, razon_social, direccion, nif, web)
+    contenido = pdfdoc.pdfdocEnc("\n".join([c._preamble] + c._code))
+    filtros = [pdfdoc.PDFBase85Encode, pdfdoc.PDFZCompress] if rl_config.useA85 else [pdfdoc.PDFZCompress]
+    for filtro in reversed(filtros):
+        contenido = filtro.encode(contenido)
+    return contenido, tuple(f.pdfname for f in filtros), fuentes
+
+def _usar_plantilla(c: canvas.Canvas, config_empresa):
+    # Se define una vez por documento y cada página la referencia
+    if c.hasForm(NOMBRE_PLANTILLA):
+        c.doForm(NOMBRE_PLANTILLA)
+        return
+    # Usamos datos de la empresa o defaults
+    datos = (
+        config_empresa.razon_social if config_empresa else "EMPRESA SIN CONFIGURAR",
+        config_empresa.direccion if config_empresa else "Dirección no disponible",
+        config_empresa.nif if config_empresa else "",
+        config_empresa.web if config_empresa else "",
+    )
+    try:
+        contenido, filtros, fuentes = _plantilla(*datos)
+        if fuentes != _fuentes_internas(c):
+            raise ValueError(f"nombres de fuente {fuentes} distintos de los del documento")
+        # Con /Filter ya puesto reportlab no vuelve a codificar el stream
+        forma = pdfdoc.PDFFormXObject(0, 0, *letter)
+        forma.Contents = pdfdoc.PDFStream(
+            pdfdoc.PDFDictionary({"Filter": pdfdoc.PDFArray([pdfdoc.PDFName(f) for f in filtros])}), contenido,
+        )
+        c._doc.addForm(NOMBRE_PLANTILLA, forma)
+    except Exception as e:
+        global _aviso_plantilla
+        if not _aviso_plantilla:
+            _aviso_plantilla = True
+            print(f"⚠️ Plantilla cacheada no disponible ({e}), se dibuja en cada documento")
+        c.beginForm(NOMBRE_PLANTILLA)
+        _dibujar_plantilla(c, *datos)
+        c.endForm()
+    c.doForm(NOMBRE_PLANTILLA)
+
+# --- PAGINACIÓN ---
+# Filas de 20 pt desde debajo de los encabezados de la plantilla hasta el pie. Cada
+# página repite la plantilla (el mismo Form XObject para todo el documento) y los
+# datos del cliente, y arrastra la suma ("Suma y sigue" / "Suma anterior"). Cada fila
+# es una posición y un texto dentro de un único objeto de texto por página, así que el
+# tiempo y la memoria crecen linealmente con el número de líneas.
+
+ALTO_FILA = 20
+Y_PRIMERA_FILA = letter[1] - 185
+Y_MINIMA_FILA = 90  # por debajo va el pie: "Suma y sigue" y el número de página
+NOMBRE_NUM_PAGINAS = "NumPaginas"  # Form XObject con el total, se define al final
+
+class _Maquetador:
+    """Escribe las filas de una factura saltando de página cuando no caben."""
+
+    def __init__(self, c: canvas.Canvas, config_empresa, cliente: str, nif_cliente: str, fecha: str):
+        self.c = c
+        self.config_empresa = config_empresa
+        self.cabecera = ((350, letter[1] - 70, cliente), (350, letter[1] - 85, f"NIF: {nif_cliente}"), (350, letter[1] - 110, f"Fecha: {fecha}"))
+        self.pagina = 0
+        self.suma = 0
+        self._empezar_pagina()
+
+    def _empezar_pagina(self):
+        c = self.c
+        self.pagina += 1
+        _usar_plantilla(c, self.config_empresa)
+        c.setFont("Helvetica", 10)
+        for x, y, texto in self.cabecera:
+            c.drawString(x, y, texto)
+        self.texto = c.beginText()
+        self.texto.setFont("Helvetica", 10)
+        self.y = Y_PRIMERA_FILA
+        if self.pagina > 1:
+            self.texto.setFont("Helvetica-Oblique", 10)
+            self.fila((350, "Suma anterior:"), (480, f"{self.suma:.2f}"))
+            self.texto.setFont("Helvetica", 10)
+
+    def terminar_pagina(self, sigue: bool = False):
+        c = self.c
+        c.drawText(self.texto)
+        if sigue:
+            c.line(350, self.y + 10, 550, self.y + 10)
+            c.setFont("Helvetica-Oblique", 10)
+            c.drawString(350, self.y - 5, "Suma y sigue:")
+            c.drawString(480, self.y - 5, f"{self.suma:.2f}")
+        c.setFont("Helvetica", 8)
+        c.drawRightString(540, 40, f"Página {self.pagina} de")
+        c.saveState()
+        c.translate(543, 40)
+        c.doForm(NOMBRE_NUM_PAGINAS)
+        c.restoreState()
+
+    def reservar(self, alto: float):
+        # Lo que no se debe partir (el resumen final) pasa entero a la página siguiente
+        if self.y - alto < Y_MINIMA_FILA:
+            self.terminar_pagina(sigue=True)
+            self.c.showPage()
+            self._empezar_pagina()
+
+    def fila(self, *celdas):
+        self.reservar(0)
+        for x, texto in celdas:
+            self.texto.setTextOrigin(x, self.y)
+            self.texto.textOut(texto)
+        self.y -= ALTO_FILA
+
+    def numerar(self):
+        # El total de páginas solo se sabe al final: cada pie lo referencia como forma
+        c = self.c
+        c.beginForm(NOMBRE_NUM_PAGINAS)
+        c.setFont("Helvetica", 8)
+        c.drawString(0, 0, str(self.pagina))
+        c.endForm()
+
+def generar_pdf_fisico(datos: DatosFactura, config_empresa, fecha: Optional[str] = None, texto_qr: Optional[str] = None) -> bytes:
+    # config_empresa: ConfiguracionEmpresa (ORM) o DatosEmpresa (en procesos hijos)
+    # Sin texto_qr se obtiene el documento "pre-sello", que es lo que cubre el hash.
+    # Con texto_qr el sello se dibuja en el mismo canvas, sin reabrir el PDF.
+    # Emisión, lote y sellado usan esta misma función (misma maquetación).
+    fecha = fecha or datetime.now().strftime('%d/%m/%Y')
+    buffer = io.BytesIO()
+    c = _nuevo_canvas(buffer)
+
+    cli_nombre = datos.cliente_nombre or "Cliente Genérico"
+    cli_nif = datos.cliente_nif or ""
+    m = _Maquetador(c, config_empresa, cli_nombre, cli_nif, fecha)
+    if texto_qr:
+        _dibujar_sello(c, texto_qr)  # en la primera página
+
+    # Importes, desglose y total del motor de totales (los mismos que se guardan)
+    totales = calcular_totales(datos.items)
+    for item, importe in zip(datos.items, totales.importes):
+        m.fila(
+            (50, (item.producto or "Item")[:40]),
+            (300, str(item.cantidad)),
+            (350, f"{item.precio_unitario:.2f}"),
+            (480, f"{importe:.2f}"),
+        )
+        m.suma += importe  # después: si la fila salta de página, va en la siguiente
+
+    # Resumen por tipo de IVA y total, siempre juntos en la última página
+    m.reservar(75 + 15 * len(totales.desglose))
+    y = m.y
+    c.line(350, y + 10, 550, y + 10)
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(350, y - 5, "IVA")
+    c.drawString(400, y - 5, "Base")
+    c.drawString(480, y - 5, "Cuota")
+    c.setFont("Helvetica", 9)
+    for desglose in totales.desglose:
+        y -= 15
+        c.drawString(350, y - 5, f"{desglose.iva}%")
+        c.drawString(400, y - 5, f"{desglose.base:.2f}")
+        c.drawString(480, y - 5, f"{desglose.cuota:.2f}")
+
+    c.line(350, y - 15, 550, y - 15)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(350, y - 35, "TOTAL:")
+    c.drawString(480, y - 35, f"{totales.total:.2f}€")
+
+    m.terminar_pagina()
+    m.numerar()
+    c.save()
+    buffer.seek(0)
+    return buffer.getvalue()
+
+def sellar_factura(datos: DatosFactura, config_empresa, fecha: str, texto_qr: str, pdf_bytes: bytes = None) -> bytes:
+    """
+    Versión sellada de una factura propia. El hash ya se calculó sobre `pdf_bytes`
+    (la versión pre-sello, misma `fecha`); aquí solo se produce el documento final.
+    """
+    if pdf_bytes is not None and PDF_SELLADO == "incremental":
+        return estampar_qr_incremental(pdf_bytes, texto_qr)
+    if pdf_bytes is not None and PDF_SELLADO == "fusion":
+        return estampar_qr(pdf_bytes, texto_qr)
+    return generar_pdf_fisico(datos, config_empresa, fecha=fecha, texto_qr=texto_qr)
+
+def sellado_de_respaldo(pdf_bytes: bytes, pdf_sellado: bytes) -> bool:
+    """
+    True si `sellar_factura` en modo incremental tuvo que estampar en memoria: la
+    salida incremental siempre empieza por los bytes pre-sello tal cual.
+    """
+    return PDF_SELLADO == "incremental" and pdf_bytes is not None and not pdf_sellado.startswith(pdf_bytes)
+
+# --- ESTAMPADO INCREMENTAL (PDFs de terceros grandes) ---
+# En vez de reescribir el documento entero con PdfWriter (que copia todas las páginas
+# e imágenes en memoria), se copia el original tal cual y se le añade una
+# "actualización incremental" (PDF 7.5.6): la página 0 reescrita, el sello como Form
+# XObject y el enlace. Solo se cargan la página 0 y el sello, no el resto del archivo.
+
+NOMBRE_SELLO = NameObject("/SelloInaltera")
+
+class _Incremento:
+    """Objetos nuevos o reemplazados de la actualización, numerados tras los originales."""
+
+    def __init__(self, siguiente_id: int):
+        self.siguiente = siguiente_id
+        self.objetos = {}  # idnum -> (generación, objeto)
+        self._importados = {}
+
+    def nuevo(self, obj) -> IndirectObject:
+        ref = IndirectObject(self.siguiente, 0, None)
+        self.objetos[self.siguiente] = (0, obj)
+        self.siguiente += 1
+        return ref
+
+    def importar(self, obj):
+        # Copia un objeto del PDF del sello renumerando sus referencias indirectas
+        if isinstance(obj, IndirectObject):
+            clave = (obj.idnum, obj.generation)
+            if clave not in self._importados:
+                ref = IndirectObject(self.siguiente, 0, None)
+                self.siguiente += 1
+                self._importados[clave] = ref
+                self.objetos[ref.idnum] = (0, self.importar(obj.get_object()))
+            return self._importados[clave]
+        if isinstance(obj, StreamObject):
+            copia = DecodedStreamObject()
+            copia.set_data(obj.get_data())
+            for clave, valor in obj.items():
+                if clave not in ("/Length", "/Filter", "/DecodeParms"):
+                    copia[NameObject(clave)] = self.importar(valor)
+            return copia
+        if isinstance(obj, DictionaryObject):
+            # /P apuntaría a la página del PDF del sello
+            return DictionaryObject({NameObject(k): self.importar(v) for k, v in obj.items() if k != "/P"})
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.importar(v) for v in obj)
+        return obj
+
+def _posicion_startxref(f) -> int:
+    f.seek(0, os.SEEK_END)
+    tamano = f.tell()
+    f.seek(max(0, tamano - 2048))
+    cola = f.read()
+    i = cola.rfind(b"startxref")
+    if i < 0:
+        raise ValueError("PDF sin startxref")
+    return int(cola[i + len(b"startxref"):].split()[0])
+
+def _escribir_xref(destino, posiciones: dict, trailer: DictionaryObject, xref_en_stream: bool, id_xref: int):
+    pos = destino.tell()
+    ids = sorted(posiciones)
+    if not xref_en_stream:
+        destino.write(b"xref\n")
+        i = 0
+        while i < len(ids):
+            j = i
+            while j + 1 < len(ids) and ids[j + 1] == ids[j] + 1:
+                j += 1
+            destino.write(f"{ids[i]} {j - i + 1}\n".encode())
+            for idnum in ids[i:j + 1]:
+                offset, gen = posiciones[idnum]
+                destino.write(f"{offset:010d} {gen:05d} n\r\n".encode())
+            i = j + 1
+        destino.write(b"trailer\n")
+        trailer.write_to_stream(destino)
+    else:
+        # El original usa xref stream (PDF 1.5+): la actualización también
+        posiciones[id_xref] = (pos, 0)
+        ids = sorted(posiciones)
+        ancho = max(4, (pos.bit_length() + 7) // 8)
+        filas = b"".join(
+            b"\x01" + posiciones[i][0].to_bytes(ancho, "big") + posiciones[i][1].to_bytes(2, "big") for i in ids
+        )
+        indice = []
+        for idnum in ids:
+            if indice and indice[-2] + indice[-1] == idnum:
+                indice[-1] += 1
+            else:
+                indice += [idnum, 1]
+        xref = DecodedStreamObject()
+        xref.set_data(filas)
+        xref.update(trailer)
+        xref[NameObject("/Type")] = NameObject("/XRef")
+        xref[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(ancho), NumberObject(2)])
+        xref[NameObject("/Index")] = ArrayObject(NumberObject(n) for n in indice)
+        destino.write(f"{id_xref} 0 obj\n".encode())
+        xref.write_to_stream(destino)
+        destino.write(b"\nendobj\n")
+    destino.write(f"\nstartxref\n{pos}\n%%EOF\n".encode())
+
+def validar_pdf(ruta) -> bool:
+    # PdfReader solo lee el xref y el árbol de páginas, no el contenido
+    try:
+        with open(ruta, "rb") as f:
+            PdfReader(f).pages[0]
+        return True
+    except Exception:
+        return False
+
+def _estampar_incremental(origen, destino, texto_qr: str):
+    """Copia `origen` (binario, con seek) en `destino` y añade el sello como actualización incremental."""
+    reader = PdfReader(origen)
+    if reader.is_encrypted:
+        raise ValueError("PDF cifrado")
+    prev = _posicion_startxref(origen)
+    origen.seek(prev)
+    xref_en_stream = not origen.read(4).startswith(b"xref")
+
+    sello = PdfReader(io.BytesIO(_pdf_sello(texto_qr)))
+    pagina_sello = sello.pages[0]
+    pagina = reader.pages[0]
+    inc = _Incremento(int(reader.trailer["/Size"]))
+
+    # 1. Sello como Form XObject: trae sus propios recursos, sin choques de nombres
+    forma = DecodedStreamObject()
+    forma.set_data(pagina_sello.get_contents().get_data())
+    forma[NameObject("/Type")] = NameObject("/XObject")
+    forma[NameObject("/Subtype")] = NameObject("/Form")
+    forma[NameObject("/BBox")] = ArrayObject(NumberObject(int(v)) for v in pagina_sello.mediabox)
+    forma[NameObject("/Resources")] = inc.importar(pagina_sello.raw_get("/Resources"))
+    ref_forma = inc.nuevo(forma)
+
+    # 2. Página 0 reescrita con el mismo número de objeto (copia superficial:
+    #    contenidos, imágenes y fuentes siguen siendo los objetos originales)
+    nueva = DictionaryObject(pagina)
+    recursos = DictionaryObject(pagina["/Resources"]) if "/Resources" in pagina else DictionaryObject()
+    xobjetos = DictionaryObject(recursos["/XObject"]) if "/XObject" in recursos else DictionaryObject()
+    xobjetos[NOMBRE_SELLO] = ref_forma
+    recursos[NameObject("/XObject")] = xobjetos
+    nueva[NameObject("/Resources")] = recursos
+
+    abrir = DecodedStreamObject()
+    abrir.set_data(b"q\n")
+    cerrar = DecodedStreamObject()
+    cerrar.set_data(b"\nQ\nq " + NOMBRE_SELLO.encode() + b" Do Q\n")
+    contenidos = pagina.raw_get("/Contents") if "/Contents" in pagina else None
+    if contenidos is None:
+        originales = []
+    elif isinstance(contenidos.get_object(), ArrayObject):
+        originales = list(contenidos.get_object())
+    else:
+        originales = [contenidos]
+    nueva[NameObject("/Contents")] = ArrayObject([inc.nuevo(abrir)] + originales + [inc.nuevo(cerrar)])
+
+    anotaciones = list(pagina["/Annots"]) if "/Annots" in pagina else []
+    for anotacion in (pagina_sello.raw_get("/Annots").get_object() if "/Annots" in pagina_sello else []):
+        anotaciones.append(inc.importar(anotacion))
+    nueva[NameObject("/Annots")] = ArrayObject(anotaciones)
+
+    ref_pagina = pagina.indirect_reference
+    inc.objetos[ref_pagina.idnum] = (ref_pagina.generation, nueva)
+
+    trailer = DictionaryObject()
+    for clave in ("/Root", "/Info", "/ID"):
+        if clave in reader.trailer:
+            trailer[NameObject(clave)] = reader.trailer.raw_get(clave)
+    id_xref = inc.siguiente
+    trailer[NameObject("/Size")] = NumberObject(id_xref + 1 if xref_en_stream else id_xref)
+    trailer[NameObject("/Prev")] = NumberObject(prev)
+
+    # 3. Original byte a byte + actualización incremental
+    origen.seek(0)
+    shutil.copyfileobj(origen, destino, 1 << 20)
+    destino.write(b"\n")
+    posiciones = {}
+    for idnum, (gen, obj) in sorted(inc.objetos.items()):
+        posiciones[idnum] = (destino.tell(), gen)
+        destino.write(f"{idnum} {gen} obj\n".encode())
+        obj.write_to_stream(destino)
+        destino.write(b"\nendobj\n")
+    _escribir_xref(destino, posiciones, trailer, xref_en_stream, id_xref)
+
+def estampar_qr_incremental(pdf_bytes: bytes, texto_qr: str) -> bytes:
+    """
+    Igual que `estampar_qr_archivo` pero en memoria: los bytes de salida empiezan por
+    `pdf_bytes` tal cual (los que cubre el hash) seguidos del sello.
+    """
+    try:
+        salida = io.BytesIO()
+        _estampar_incremental(io.BytesIO(pdf_bytes), salida, texto_qr)
+        return salida.getvalue()
+    except Exception as e:
+        print(f"Estampado incremental no disponible ({e}), usando estampado en memoria")
+        return estampar_qr(pdf_bytes, texto_qr)
+
+def estampar_qr_archivo(ruta_origen: str, ruta_destino: str, texto_qr: str):
+    """
+    Estampa el QR en un PDF en disco escribiendo el resultado en otro archivo.
+    La memoria usada es la de la página 0 más el sello, no la del documento.
+    Si el PDF no admite actualización incremental (cifrado, xref dañado...) se usa
+    el estampado clásico en memoria y se devuelve False.
+    """
+    try:
+        with open(ruta_origen, "rb") as origen, open(ruta_destino, "wb") as destino:
+            _estampar_incremental(origen, destino, texto_qr)
+        return True
+    except Exception as e:
+        print(f"Estampado incremental no disponible ({e}), usando estampado en memoria")
+        with open(ruta_origen, "rb") as f:
+            pdf_sellado = estampar_qr(f.read(), texto_qr)
+        with open(ruta_destino, "wb") as f:
+            f.write(pdf_sellado)
+        return False
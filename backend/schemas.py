@@ -0,0 +1,103 @@
+# backend/schemas.py
+# Modelos de datos (Pydantic) de la API. Viven aparte de main.py para que los
+# procesos de renderizado puedan deserializarlos sin importar toda la app.
+
+import os
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+class LineaFactura(BaseModel):
+    producto: str
+    cantidad: int
+    precio_unitario: float
+    iva: int
+
+class DatosFactura(BaseModel):
+    cliente_nombre: str
+    cliente_nif: str
+    items: List[LineaFactura]
+    notas: str = ""
+
+# --- EMISIÓN EN LOTE ---
+LOTE_MAX_FACTURAS = int(os.getenv("LOTE_MAX_FACTURAS", "5000"))
+
+class LoteFacturas(BaseModel):
+    facturas: List[DatosFactura] = Field(..., min_length=1, max_length=LOTE_MAX_FACTURAS)
+
+class DatosEmpresa(BaseModel):
+    razon_social: str
+    nif: str
+    direccion: str
+    web: str
+
+class UserCreate(BaseModel):
+    email: str
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+
+class SolicitudAnulacion(BaseModel):
+    motivo: str
+
+# --- NUEVOS SCHEMAS (CLIENTES Y PRODUCTOS) ---
+class ClienteCreate(BaseModel):
+    nombre: str
+    nif: str
+    direccion: str = ""
+    email: str = ""
+
+class ProductoCreate(BaseModel):
+    nombre: str
+    precio: float
+    iva_por_defecto: int = 21
+    descripcion: str = ""
+
+# --- ENLACES DE DESCARGA (listado de facturas) ---
+ENLACES_MAX_IDS = int(os.getenv("ENLACES_MAX_IDS", "500"))
+
+class SolicitudEnlaces(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=ENLACES_MAX_IDS)
+
+# --- SALIDA DE LOS LISTADOS ---
+# Solo los campos públicos (sin usuario_id). paginacion.py consulta exactamente estas
+# columnas y serializa las filas con pydantic-core sin pasar por objetos ORM.
+class RegistroSalida(BaseModel):
+    id: int
+    nombre_archivo: Optional[str] = None
+    fecha_subida: Optional[datetime] = None
+    numero_factura: Optional[str] = None
+    cliente: Optional[str] = None
+    total: Optional[float] = None
+    tipo: Optional[str] = None
+    estado: Optional[str] = None
+    motivo_anulacion: Optional[str] = None
+    hash_anterior: Optional[str] = None
+    hash_actual: Optional[str] = None
+    datos_qr: Optional[str] = None
+
+class EventoSalida(BaseModel):
+    id: int
+    fecha: Optional[datetime] = None
+    categoria: Optional[str] = None
+    descripcion: Optional[str] = None
+    nivel: Optional[str] = None
+    hash_anterior: Optional[str] = None
+    hash_actual: Optional[str] = None
+
+class ClienteSalida(BaseModel):
+    id: int
+    nombre: Optional[str] = None
+    nif: Optional[str] = None
+    direccion: Optional[str] = None
+    email: Optional[str] = None
+
+class ProductoSalida(BaseModel):
+    id: int
+    nombre: Optional[str] = None
+    precio: Optional[float] = None
+    iva_por_defecto: Optional[int] = None
+    descripcion: Optional[str] = None
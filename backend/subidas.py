@@ -0,0 +1,206 @@
+# backend/subidas.py
+# Trabajador en segundo plano que vacía el outbox de subidas (tabla subidas_pendientes).
+#
+# La petición confirma el registro junto con su fila de outbox ("preparando"), guarda
+# el PDF en uploads/ y solo entonces la marca "pendiente" y encola el buffer en memoria:
+# la respuesta sale sin esperar a la nube, y el sondeo nunca recoge una fila cuya copia
+# local aún no existe (si el proceso cae antes, la fila se queda en "preparando").
+# Este trabajador sube el buffer con concurrencia acotada (SUBIDAS_CONCURRENCIA) y,
+# si falla, reintenta con espera exponencial leyendo la copia local. Un sondeo
+# periódico recoge lo que quedó pendiente (reintentos, reinicios, otros workers);
+# cada fila se reclama con compare-and-swap para no subirla dos veces.
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import update, or_, and_
+
+from models import SessionLocal, SubidaPendiente, RegistroFactura
+from almacenamiento import obtener_almacen
+from metricas import ETAPAS, SUBIDAS
+
+SUBIDAS_CONCURRENCIA = int(os.getenv("SUBIDAS_CONCURRENCIA", "4"))
+SUBIDAS_MAX_INTENTOS = int(os.getenv("SUBIDAS_MAX_INTENTOS", "8"))
+SUBIDAS_ESPERA_BASE_S = float(os.getenv("SUBIDAS_ESPERA_BASE_S", "2"))
+SUBIDAS_SONDEO_S = float(os.getenv("SUBIDAS_SONDEO_S", "10"))
+SUBIDAS_EN_MEMORIA = int(os.getenv("SUBIDAS_EN_MEMORIA", "200")) # buffers retenidos en la cola
+SUBIDAS_PLAZO_S = 300 # una subida "en_curso" más antigua se da por abandonada
+
+
+@dataclass
+class Trabajo:
+    subida_id: int
+    ruta_nube: str
+    ruta_local: Path
+    datos: Optional[bytes] = None
+
+
+class GestorSubidas:
+
+    def __init__(self, session_factory=SessionLocal, concurrencia: int = SUBIDAS_CONCURRENCIA):
+        self.session_factory = session_factory
+        self.concurrencia = concurrencia
+        self._cola = queue.Queue()
+        self._en_vuelo = set()
+        self._huecos = threading.BoundedSemaphore(concurrencia)
+        self._parar = threading.Event()
+        self._pool = None
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None and obtener_almacen() is not None:
+                self._parar.clear()
+                self._pool = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="subidas")
+                self._hilo = threading.Thread(target=self._bucle, name="gestor-subidas", daemon=True)
+                self._hilo.start()
+
+    def detener(self):
+        # Lo que no se haya subido sigue "pendiente" en la base de datos
+        with self._lock:
+            hilo, self._hilo = self._hilo, None
+        if hilo is None:
+            return
+        self._parar.set()
+        hilo.join()
+        self._pool.shutdown(wait=True)
+
+    def encolar(self, subida_id: int, ruta_nube: str, ruta_local: Path, datos: Optional[bytes] = None):
+        """Llamar con la copia local ya escrita: la fila pasa a "pendiente" y se sube."""
+        self._marcar_pendiente(subida_id)
+        if self._hilo is None:
+            self.iniciar()
+            if self._hilo is None:
+                return  # sin nube configurada: el PDF se queda en uploads/
+        if self._cola.qsize() >= SUBIDAS_EN_MEMORIA:
+            datos = None  # con mucha cola no retenemos buffers: se leerá de disco
+        self._cola.put(Trabajo(subida_id, ruta_nube, Path(ruta_local), datos))
+
+    def _marcar_pendiente(self, subida_id: int):
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(SubidaPendiente)
+                .where(SubidaPendiente.id == subida_id, SubidaPendiente.estado == "preparando")
+                .values(estado="pendiente", proximo_intento=datetime.utcnow())
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _bucle(self):
+        ultimo_sondeo = 0.0
+        while not self._parar.is_set():
+            try:
+                self._lanzar(self._cola.get(timeout=1))
+            except queue.Empty:
+                pass
+            if time.monotonic() - ultimo_sondeo >= SUBIDAS_SONDEO_S:
+                ultimo_sondeo = time.monotonic()
+                try:
+                    for trabajo in self._pendientes():
+                        self._lanzar(trabajo)
+                except Exception as e:
+                    print(f"❌ Error consultando subidas pendientes: {e}")
+
+    def _lanzar(self, trabajo: Trabajo):
+        if trabajo.subida_id in self._en_vuelo:
+            return
+        self._huecos.acquire()  # concurrencia acotada: espera a que termine una subida
+        self._en_vuelo.add(trabajo.subida_id)
+        self._pool.submit(self._procesar, trabajo)
+
+    def _pendientes(self, limite: int = 100) -> list:
+        ahora = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            filas = db.query(SubidaPendiente.id, RegistroFactura.id, RegistroFactura.nombre_archivo).join(
+                RegistroFactura, SubidaPendiente.registro_id == RegistroFactura.id
+            ).filter(
+                SubidaPendiente.estado.in_(("pendiente", "en_curso")),
+                SubidaPendiente.proximo_intento <= ahora,
+            ).order_by(SubidaPendiente.proximo_intento).limit(limite).all()
+        finally:
+            db.close()
+        trabajos = []
+        for subida_id, registro_id, nombre_archivo in filas:
+            ruta = f"{registro_id}_{nombre_archivo}"
+            trabajos.append(Trabajo(subida_id, ruta, Path("uploads") / ruta))
+        return trabajos
+
+    def _procesar(self, trabajo: Trabajo):
+        db = self.session_factory()
+        try:
+            # 1. Reclamar la fila: pendiente, o en curso pero abandonada por otro worker
+            ahora = datetime.utcnow()
+            reclamada = db.execute(
+                update(SubidaPendiente)
+                .where(
+                    SubidaPendiente.id == trabajo.subida_id,
+                    or_(
+                        SubidaPendiente.estado == "pendiente",
+                        and_(SubidaPendiente.estado == "en_curso", SubidaPendiente.proximo_intento <= ahora),
+                    ),
+                )
+                .values(estado="en_curso", proximo_intento=ahora + timedelta(seconds=SUBIDAS_PLAZO_S))
+            )
+            db.commit()
+            if reclamada.rowcount != 1:
+                return
+
+            # 2. Subir (del buffer si lo tenemos, si no de la copia local)
+            try:
+                contenido = trabajo.datos if trabajo.datos is not None else trabajo.ruta_local
+                with ETAPAS.medir("subida_nube"):
+                    obtener_almacen().subir(trabajo.ruta_nube, contenido)
+            except Exception as e:
+                intentos = db.query(SubidaPendiente.intentos).filter(SubidaPendiente.id == trabajo.subida_id).scalar() + 1
+                SUBIDAS.inc("error" if intentos >= SUBIDAS_MAX_INTENTOS else "reintento")
+                espera = SUBIDAS_ESPERA_BASE_S * 2 ** (intentos - 1)
+                db.execute(
+                    update(SubidaPendiente)
+                    .where(SubidaPendiente.id == trabajo.subida_id)
+                    .values(
+                        estado="error" if intentos >= SUBIDAS_MAX_INTENTOS else "pendiente",
+                        intentos=intentos,
+                        proximo_intento=datetime.utcnow() + timedelta(seconds=espera),
+                        ultimo_error=str(e)[:500],
+                    )
+                )
+                db.commit()
+                print(f"❌ Error subiendo a la nube {trabajo.ruta_nube} (intento {intentos}): {e}")
+                return
+
+            db.execute(
+                update(SubidaPendiente)
+                .where(SubidaPendiente.id == trabajo.subida_id)
+                .values(estado="subida", fecha_subida=datetime.utcnow(), ultimo_error=None)
+            )
+            db.commit()
+            SUBIDAS.inc("ok")
+            print(f"✅ Factura subida a la nube: {trabajo.ruta_nube}")
+        except Exception as e:
+            print(f"❌ Error en el gestor de subidas: {e}")
+        finally:
+            db.close()
+            self._en_vuelo.discard(trabajo.subida_id)
+            self._huecos.release()
+
+
+def esta_en_nube(registro: RegistroFactura) -> bool:
+    """Si el PDF ya está en el almacenamiento en la nube o solo en uploads/."""
+    if obtener_almacen() is None:
+        return False
+    # Registros anteriores al outbox: se subían dentro de la petición
+    return registro.subida is None or registro.subida.estado == "subida"
+
+
+gestor_subidas = GestorSubidas()
@@ -0,0 +1,93 @@
+# backend/tests/conftest.py
+# Entorno de las pruebas: SQLite y archivos en un directorio temporal, almacén local
+# en lugar de Supabase, bcrypt barato y los PDFs en el pool de hilos. Las variables se
+# fijan antes de importar la aplicación (cada módulo lee su configuración al importarse).
+#
+# Uso (desde backend/): python -m pytest -q
+
+import itertools
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+DIRECTORIO = Path(tempfile.mkdtemp(prefix="inaltera-tests-"))
+
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{DIRECTORIO / 'inaltera.db'}",
+    "ALMACEN": "local",
+    "ALMACEN_LOCAL_DIR": str(DIRECTORIO / "almacen_local"),
+    "BCRYPT_ROUNDS": "4",
+    "PDF_PROCESOS": "0",
+    "REGISTRO_MAX_IP": "1000",  # todas las pruebas registran desde la misma IP
+    "ADMIN_EMAILS": "admin@tests.inaltera",
+    # Los hilos de fondo no se adelantan a las pruebas que los ejercitan a mano
+    "MERKLE_INTERVALO_S": "3600",
+    "SUBIDAS_SONDEO_S": "3600",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+_emails = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    """La API arrancada (migraciones y calentamiento) con los planes sin límite práctico."""
+    os.chdir(DIRECTORIO)  # uploads/ es relativo al directorio de trabajo
+    from fastapi.testclient import TestClient
+    import main
+    from models import SessionLocal, PlanLimite
+
+    with TestClient(main.app) as c:
+        main.arranque.esperar(timeout=60)
+        db = SessionLocal()
+        db.query(PlanLimite).update({"facturas_mes": 10 ** 6})
+        db.commit()
+        db.close()
+        yield c
+
+
+@pytest.fixture
+def db(cliente):
+    from models import SessionLocal
+    sesion = SessionLocal()
+    yield sesion
+    sesion.close()
+
+
+def nuevo_usuario(cliente, email: str = None) -> dict:
+    """Registra un usuario (con su propia cadena) y devuelve la cabecera de su token."""
+    email = email or f"usuario{next(_emails)}@tests.inaltera"
+    cliente.post("/api/register", json={"email": email, "password": "secreta"})
+    token = cliente.post("/api/login", data={"username": email, "password": "secreta"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def cabeceras(cliente):
+    return nuevo_usuario(cliente)
+
+
+FACTURA = {
+    "cliente_nombre": "Cliente de prueba",
+    "cliente_nif": "12345678Z",
+    "items": [{"producto": "Servicio", "cantidad": 2, "precio_unitario": 1.5, "iva": 21}],
+}
+
+
+@pytest.fixture(scope="session")
+def pdf_externo():
+    """Un PDF válido para /api/subir-factura."""
+    from pdf_factura import generar_pdf_fisico
+    from schemas import DatosFactura
+    return generar_pdf_fisico(DatosFactura(**FACTURA), None)
+
+
+def subir_externa(cliente, cabeceras, pdf: bytes, numero: str = "EXT-1", total: str = "10"):
+    return cliente.post(
+        "/api/subir-factura", headers=cabeceras,
+        files={"file": ("factura.pdf", pdf, "application/pdf")},
+        data={"numero": numero, "cliente": "Proveedor", "total": total, "fecha": "2026-01-01"},
+    )
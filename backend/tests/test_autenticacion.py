@@ -0,0 +1,62 @@
+# backend/tests/test_autenticacion.py
+# Limitación de intentos (autenticacion.LimitadorIntentos) y su uso en login y altas.
+
+import pytest
+from cachetools import TTLCache
+from fastapi import HTTPException
+
+import autenticacion
+from autenticacion import LimitadorIntentos
+
+from conftest import nuevo_usuario
+
+
+def test_bloquea_la_cuenta_tras_sus_fallos():
+    limitador = LimitadorIntentos(ventana_s=60, max_ip=10, max_cuenta=3)
+    for _ in range(3):
+        limitador.comprobar("1.1.1.1", "a@b.c")
+        limitador.fallo("1.1.1.1", "a@b.c")
+    with pytest.raises(HTTPException) as error:
+        limitador.comprobar("2.2.2.2", "a@b.c")
+    assert error.value.status_code == 429
+    assert 1 <= int(error.value.headers["Retry-After"]) <= 60
+    limitador.comprobar("1.1.1.1", "otra@b.c")  # la IP aún no llega a su límite
+
+
+def test_bloquea_la_ip_y_el_exito_solo_limpia_la_cuenta():
+    limitador = LimitadorIntentos(ventana_s=60, max_ip=4, max_cuenta=3)
+    for _ in range(2):
+        limitador.fallo("1.1.1.1", "a@b.c")
+    limitador.exito("a@b.c")
+    limitador.comprobar("1.1.1.1", "a@b.c")
+    for i in range(2):
+        limitador.fallo("1.1.1.1", f"otra{i}@b.c")
+    with pytest.raises(HTTPException):
+        limitador.comprobar("1.1.1.1", "nueva@b.c")
+
+
+def test_la_ventana_caduca(monkeypatch):
+    reloj = [1000.0]
+    monkeypatch.setattr(autenticacion.time, "monotonic", lambda: reloj[0])
+    limitador = LimitadorIntentos(ventana_s=60, max_ip=1, max_cuenta=1)
+    limitador._contadores = TTLCache(maxsize=10, ttl=60, timer=lambda: reloj[0])
+    limitador.fallo("1.1.1.1")
+    with pytest.raises(HTTPException):
+        limitador.comprobar("1.1.1.1")
+    reloj[0] += 61
+    limitador.comprobar("1.1.1.1")
+
+
+def test_las_altas_no_cuentan_como_fallos_de_login(cliente):
+    for _ in range(autenticacion.LOGIN_MAX_FALLOS_IP + 1):
+        cabeceras = nuevo_usuario(cliente)
+    assert cliente.get("/api/uso-plan", headers=cabeceras).status_code == 200
+    # Y los fallos de login no consumen el cupo de altas
+    respuesta = cliente.post("/api/login", data={"username": "nadie@tests.inaltera", "password": "mal"})
+    assert respuesta.status_code == 401
+
+
+def test_limite_de_altas_por_ip(cliente, monkeypatch):
+    monkeypatch.setattr(autenticacion.limitador_registro, "max_ip", 0)
+    respuesta = cliente.post("/api/register", json={"email": "bloqueado@tests.inaltera", "password": "x"})
+    assert respuesta.status_code == 429
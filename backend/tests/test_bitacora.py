@@ -0,0 +1,70 @@
+# backend/tests/test_bitacora.py
+# Escritor agrupado de la bitácora: group commit y respaldo en disco de los lotes que
+# no se pudieron confirmar.
+
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import bitacora
+from bitacora import EscritorBitacora
+from models import SessionLocal, EventoBitacora
+import verificador
+
+
+def _sin_base_de_datos():
+    return Session(bind=create_engine("sqlite:////directorio/que/no/existe/inaltera.db"))
+
+
+def _eventos(descripcion: str, n: int) -> list:
+    return [(datetime.utcnow(), "PRUEBA", f"{descripcion} {i}", "INFO", None) for i in range(n)]
+
+
+def _escritos(db, descripcion: str) -> int:
+    return db.query(EventoBitacora).filter(EventoBitacora.descripcion.like(f"{descripcion} %")).count()
+
+
+def test_escritor_agrupado_confirma_al_detener(db, tmp_path):
+    escritor = EscritorBitacora(respaldo=tmp_path)
+    for evento in _eventos("agrupado", 25):
+        escritor.encolar(evento)
+    escritor.detener()
+    assert _escritos(db, "agrupado") == 25
+    assert not list(tmp_path.iterdir())
+
+
+def test_lote_fallido_va_al_respaldo_y_se_reintenta(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(bitacora, "BITACORA_REINTENTOS", 1)
+    escritor = EscritorBitacora(session_factory=_sin_base_de_datos, respaldo=tmp_path)
+    escritor._escribir(_eventos("respaldo", 3))
+    archivos = list(tmp_path.glob("*.jsonl"))
+    assert len(archivos) == 1 and len(archivos[0].read_text(encoding="utf-8").splitlines()) == 3
+    assert escritor.reintentar_respaldo() == 0  # sigue sin base de datos: el archivo se queda
+    assert list(tmp_path.glob("*.jsonl")) == archivos
+
+    escritor.session_factory = SessionLocal
+    assert escritor.reintentar_respaldo() == 3
+    assert _escritos(db, "respaldo") == 3
+    assert not list(tmp_path.iterdir())
+    # La fecha se recupera exacta del archivo: el hash se puede recalcular
+    informe = verificador.verificar("bitacora", completo=True, en_procesos=False, guardar=False)
+    assert informe["valida"] and informe["n_no_reproducibles"] == 0
+
+
+def test_archivo_reclamado_y_abandonado_se_recupera(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(bitacora, "BITACORA_REINTENTOS", 1)
+    escritor = EscritorBitacora(session_factory=_sin_base_de_datos, respaldo=tmp_path)
+    escritor._escribir(_eventos("abandonado", 2))
+    archivo, = tmp_path.glob("*.jsonl")
+    # Otro proceso lo reclamó y se cayó antes de terminar
+    reclamado = archivo.with_name(archivo.name + ".99999")
+    os.replace(archivo, reclamado)
+    antiguo = time.time() - bitacora.BITACORA_RESPALDO_PLAZO_S - 1
+    os.utime(reclamado, (antiguo, antiguo))
+
+    escritor.session_factory = SessionLocal
+    assert escritor.reintentar_respaldo() == 2
+    assert _escritos(db, "abandonado") == 2
@@ -0,0 +1,123 @@
+# backend/tests/test_cadena.py
+# Cabezas de cadena (cadena.py): anexado, compare-and-swap y anulación de registros
+# externos que no se pudieron estampar.
+
+import pytest
+from sqlalchemy import update
+
+from cadena import anexar, cadena_facturas, calcular_hash, genesis, ConflictoCadena
+from models import SessionLocal, CabezaCadena, RegistroFactura, Usuario
+import verificador
+
+from conftest import subir_externa
+
+
+def _usuario(db) -> int:
+    usuario = Usuario(email=f"cadena{db.query(Usuario).count()}@tests.inaltera", hashed_password="x")
+    db.add(usuario)
+    db.commit()
+    return usuario.id
+
+
+def _construir(db, usuario_id, contenido: bytes, llamadas: list):
+    def construir(prev_hash):
+        llamadas.append(prev_hash)
+        nuevo_hash = calcular_hash(contenido, prev_hash)
+        return nuevo_hash, [RegistroFactura(
+            numero_factura="T", hash_anterior=prev_hash, hash_actual=nuevo_hash, usuario_id=usuario_id,
+        )]
+    return construir
+
+
+def _mover_cabeza(cadena_id: str):
+    # Otro "worker" anexa entre la lectura de la cabeza y el compare-and-swap
+    with SessionLocal() as otra:
+        otra.execute(update(CabezaCadena).where(CabezaCadena.cadena == cadena_id).values(version=CabezaCadena.version + 1))
+        otra.commit()
+
+
+def test_anexar_enlaza_con_la_cabeza_de_cada_usuario(db):
+    a, b = _usuario(db), _usuario(db)
+    llamadas = []
+    r1, = anexar(db, cadena_facturas(a), _construir(db, a, b"uno", llamadas))
+    r2, = anexar(db, cadena_facturas(a), _construir(db, a, b"dos", llamadas))
+    r3, = anexar(db, cadena_facturas(b), _construir(db, b, b"tres", llamadas))
+
+    assert r1.hash_anterior == genesis(cadena_facturas(a))
+    assert r2.hash_anterior == r1.hash_actual
+    assert r3.hash_anterior == genesis(cadena_facturas(b))  # cadenas independientes por usuario
+    assert r3.hash_anterior != r1.hash_anterior
+    cabeza = db.get(CabezaCadena, cadena_facturas(a))
+    assert (cabeza.ultimo_hash, cabeza.version) == (r2.hash_actual, 2)
+
+
+def test_cas_fallido_reconstruye_con_la_cabeza_nueva(db):
+    usuario_id = _usuario(db)
+    anexar(db, cadena_facturas(usuario_id), _construir(db, usuario_id, b"previo", []))
+    llamadas = []
+    construir = _construir(db, usuario_id, b"nuevo", llamadas)
+
+    def con_carrera(prev_hash):
+        if not llamadas:
+            _mover_cabeza(cadena_facturas(usuario_id))
+        return construir(prev_hash)
+
+    registro, = anexar(db, cadena_facturas(usuario_id), con_carrera)
+    assert len(llamadas) == 2
+    assert db.query(RegistroFactura).filter(RegistroFactura.usuario_id == usuario_id).count() == 2
+    assert db.get(CabezaCadena, cadena_facturas(usuario_id)).ultimo_hash == registro.hash_actual
+
+
+def test_conflicto_si_la_cabeza_se_mueve_en_todos_los_reintentos(db):
+    usuario_id = _usuario(db)
+    construir = _construir(db, usuario_id, b"x", [])
+
+    def siempre_en_carrera(prev_hash):
+        _mover_cabeza(cadena_facturas(usuario_id))
+        return construir(prev_hash)
+
+    with pytest.raises(ConflictoCadena):
+        anexar(db, cadena_facturas(usuario_id), siempre_en_carrera)
+    assert db.query(RegistroFactura).filter(RegistroFactura.usuario_id == usuario_id).count() == 0
+
+
+def test_estampado_fallido_anula_sin_romper_la_cadena(cliente, cabeceras, pdf_externo, db, monkeypatch):
+    import pdf_factura
+
+    def falla(*args):
+        raise RuntimeError("PDF no estampable")
+
+    with monkeypatch.context() as m:
+        m.setattr(pdf_factura, "estampar_qr_archivo", falla)
+        assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-FALLA").status_code == 500
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-OK").status_code == 200
+
+    registros = cliente.get("/api/registros", headers=cabeceras).json()
+    assert [(r["numero_factura"], r["tipo"], r["estado"]) for r in registros] == [
+        ("EXT-FALLA", "Externa", "Anulada"),
+        ("EXT-FALLA", "Anulacion", "Evento de Anulación"),
+        ("EXT-OK", "Externa", "Válida"),
+    ]
+    for previo, siguiente in zip(registros, registros[1:]):
+        assert siguiente["hash_anterior"] == previo["hash_actual"]
+    assert verificador.verificar("facturas", completo=True, en_procesos=False, guardar=False)["valida"]
+
+
+def test_subida_externa_usa_los_datos_de_empresa_cacheados(cliente, cabeceras, pdf_externo, monkeypatch):
+    import hashlib
+    import main
+
+    empresa = {"razon_social": "Externa S.L.", "nif": "B12345678", "direccion": "C/ Una, 1", "web": "externa.test"}
+    assert cliente.post("/api/empresa", headers=cabeceras, json=empresa).status_code == 200
+    consultas, obtener_empresa = [], main.obtener_empresa
+
+    def espia(db, usuario_id):
+        consultas.append(usuario_id)
+        return obtener_empresa(db, usuario_id)
+    monkeypatch.setattr(main, "obtener_empresa", espia)
+
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-NIF").status_code == 200
+    registro = cliente.get("/api/registros", headers=cabeceras).json()[-1]
+    datos = f"B12345678EXT-NIF2026-01-0110.0{registro['hash_anterior']}"
+    assert registro["hash_actual"] == hashlib.sha256(datos.encode()).hexdigest()
+    assert len(consultas) == 1
@@ -0,0 +1,68 @@
+# backend/tests/test_exportacion.py
+# Exportación masiva (exportacion.py y /api/exportar): formatos, rango, alcance por
+# usuario y un único evento de auditoría por exportación.
+
+import csv
+import io
+import json
+
+import pyarrow.parquet as pq
+import pytest
+
+import exportacion
+from models import EventoBitacora
+
+from conftest import FACTURA, nuevo_usuario, subir_externa
+
+
+@pytest.fixture
+def con_registros(cliente, pdf_externo):
+    cabeceras = nuevo_usuario(cliente)
+    for _ in range(3):
+        assert cliente.post("/api/emitir", headers=cabeceras, json=FACTURA).status_code == 200
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXP-EXT").status_code == 200
+    return cabeceras
+
+
+def _exportar(cliente, cabeceras, formato, **parametros):
+    respuesta = cliente.get("/api/exportar", headers=cabeceras, params={"formato": formato, **parametros})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-type"].startswith(exportacion.FORMATOS[formato][0].split(";")[0])
+    return respuesta
+
+
+def _eventos_exportacion(db) -> int:
+    return db.query(EventoBitacora).filter(EventoBitacora.categoria == "EXPORTACION").count()
+
+
+def test_formatos_con_las_mismas_filas(cliente, con_registros, db, monkeypatch):
+    monkeypatch.setattr(exportacion, "EXPORTACION_LOTE", 2)  # varios lotes por exportación
+    eventos = _eventos_exportacion(db)
+
+    filas_csv = list(csv.DictReader(io.StringIO(_exportar(cliente, con_registros, "csv").text)))
+    lineas = [json.loads(l) for l in _exportar(cliente, con_registros, "jsonl").text.splitlines()]
+    parquet = pq.ParquetFile(io.BytesIO(_exportar(cliente, con_registros, "parquet").content))
+
+    assert [f["tipo"] for f in filas_csv] == ["Externa", "Alta", "Alta", "Alta"]  # por fecha
+    assert list(filas_csv[0]) == list(exportacion.EXPORTACION_COLUMNAS)
+    assert [l["hash_actual"] for l in lineas] == [f["hash_actual"] for f in filas_csv]
+    assert lineas[1]["desglose_iva"] == [{"iva": 21, "base": "3.00", "cuota": "0.63"}]
+    assert parquet.metadata.num_row_groups == 2
+    assert parquet.read().column("hash_actual").to_pylist() == [f["hash_actual"] for f in filas_csv]
+    assert _eventos_exportacion(db) == eventos + 3
+
+
+def test_rango_y_alcance_por_usuario(cliente, con_registros):
+    # La factura externa se fechó el 2026-01-01; las emitidas, hoy
+    assert len(_exportar(cliente, con_registros, "jsonl", hasta="2026-01-02").text.splitlines()) == 1
+    assert len(_exportar(cliente, con_registros, "jsonl", desde="2026-01-02").text.splitlines()) == 3
+    otro = nuevo_usuario(cliente)
+    assert _exportar(cliente, otro, "csv").text.splitlines() == [",".join(exportacion.EXPORTACION_COLUMNAS)]
+    assert _exportar(cliente, otro, "jsonl").text == ""
+    assert pq.read_table(io.BytesIO(_exportar(cliente, otro, "parquet").content)).num_rows == 0
+
+
+def test_formato_no_soportado_sin_evento(cliente, con_registros, db):
+    eventos = _eventos_exportacion(db)
+    assert cliente.get("/api/exportar", headers=con_registros, params={"formato": "xlsx"}).status_code == 400
+    assert _eventos_exportacion(db) == eventos
@@ -0,0 +1,74 @@
+# backend/tests/test_merkle.py
+# Árboles de Merkle (merkle.py): pruebas de inclusión RFC 6962 y bloques alterados.
+
+import hashlib
+
+import merkle
+from models import BloqueMerkle, EventoBitacora
+
+from conftest import nuevo_usuario, subir_externa
+
+
+def _hashes(n: int) -> list:
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(n)]
+
+
+def test_pruebas_de_inclusion_para_cualquier_tamano():
+    for n in range(1, 34):
+        hashes = _hashes(n)
+        hojas = [merkle.hash_hoja(h) for h in hashes]
+        raiz = merkle.raiz(hojas).hex()
+        for indice, h in enumerate(hashes):
+            ruta = [p.hex() for p in merkle.ruta_auditoria(indice, hojas)]
+            assert len(ruta) <= (n - 1).bit_length()
+            assert merkle.verificar_prueba(h, indice, n, ruta, raiz)
+            # Otra hoja u otra posición no verifican con la misma ruta
+            assert not merkle.verificar_prueba(hashlib.sha256(b"otro").hexdigest(), indice, n, ruta, raiz)
+            if n > 1:
+                assert not merkle.verificar_prueba(h, (indice + 1) % n, n, ruta, raiz)
+            assert not merkle.verificar_prueba(h, n, n, ruta, raiz)
+
+
+def test_arbol_guardado_da_las_mismas_rutas():
+    for n in range(1, 34):
+        hojas = [merkle.hash_hoja(h) for h in _hashes(n)]
+        arbol = merkle.Arbol(hojas)
+        assert arbol.raiz == merkle.raiz(hojas)
+        assert all(arbol.ruta(i) == merkle.ruta_auditoria(i, hojas) for i in range(n))
+
+
+def test_raiz_de_potencia_de_dos_igual_que_la_recursiva():
+    hojas = [merkle.hash_hoja(h) for h in _hashes(8)]
+    izquierda = merkle.hash_nodo(merkle.hash_nodo(hojas[0], hojas[1]), merkle.hash_nodo(hojas[2], hojas[3]))
+    derecha = merkle.hash_nodo(merkle.hash_nodo(hojas[4], hojas[5]), merkle.hash_nodo(hojas[6], hojas[7]))
+    assert merkle.raiz(hojas) == merkle.hash_nodo(izquierda, derecha)
+
+
+def test_bloque_alterado_una_sola_alerta(cliente, pdf_externo, db, monkeypatch):
+    cabeceras = nuevo_usuario(cliente)
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="MERKLE-1").status_code == 200
+    hash_actual = cliente.get("/api/registros", headers=cabeceras).json()[0]["hash_actual"]
+    monkeypatch.setattr(merkle, "MERKLE_BLOQUE", 1)
+    merkle.sellar_bloques(db)
+
+    arboles, Arbol = [], merkle.Arbol
+    monkeypatch.setattr(merkle, "Arbol", lambda hojas: arboles.append(hojas) or Arbol(hojas))
+    for _ in range(3):
+        prueba = cliente.get(f"/api/merkle/prueba/{hash_actual}").json()
+        assert merkle.verificar_prueba(hash_actual, prueba["indice"], prueba["n_hojas"], prueba["ruta"], prueba["raiz"])
+    assert len(arboles) == 1  # el bloque se lee y se comprueba entero una sola vez
+
+    bloque = db.get(BloqueMerkle, prueba["bloque"])
+    raiz = bloque.raiz
+    bloque.raiz = "0" * 64
+    db.commit()
+    try:
+        for _ in range(3):
+            assert cliente.get(f"/api/merkle/prueba/{hash_actual}").status_code == 409
+    finally:
+        bloque.raiz = raiz
+        db.commit()
+    alertas = db.query(EventoBitacora).filter(
+        EventoBitacora.categoria == "SEGURIDAD", EventoBitacora.descripcion == f"El bloque {bloque.id} no coincide con su raíz sellada"
+    ).count()
+    assert alertas == 1
@@ -0,0 +1,18 @@
+# backend/tests/test_modelos.py
+# Configuración del motor de base de datos (models.py).
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_perfil_de_base_de_datos_desconocido():
+    # models.py lee la configuración al importarse: se prueba en otro intérprete
+    entorno = {**os.environ, "DB_PERFIL": "produccion_eu"}
+    salida = subprocess.run(
+        [sys.executable, "-c", "import models"], cwd=Path(__file__).resolve().parents[1],
+        env=entorno, capture_output=True, text=True,
+    )
+    assert salida.returncode != 0
+    assert "DB_PERFIL desconocido: 'produccion_eu' (perfiles: desarrollo, produccion)" in salida.stderr
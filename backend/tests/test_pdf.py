@@ -0,0 +1,84 @@
+# backend/tests/test_pdf.py
+# Sellado de las facturas propias: por defecto se redibujan con el QR en el mismo canvas;
+# en modo incremental se dibujan una vez y el sello se añade a los bytes que cubre el hash.
+
+import io
+
+from pypdf import PdfReader
+
+import pdf_factura
+from schemas import DatosFactura
+
+from conftest import FACTURA
+
+TEXTO_QR = "https://inaltera.test/verificar?h=abc"
+
+
+def test_sellado_no_vuelve_a_dibujar_la_factura(monkeypatch):
+    monkeypatch.setattr(pdf_factura, "PDF_SELLADO", "incremental")
+    datos = DatosFactura(**FACTURA)
+    pre_sello = pdf_factura.generar_pdf_fisico(datos, None, "01/01/2026")
+
+    def sin_render(*args, **kwargs):
+        raise AssertionError("la factura se ha vuelto a dibujar")
+
+    monkeypatch.setattr(pdf_factura, "generar_pdf_fisico", sin_render)
+    sellado = pdf_factura.sellar_factura(datos, None, "01/01/2026", TEXTO_QR, pre_sello)
+
+    assert sellado.startswith(pre_sello)  # el documento que cubre el hash, intacto
+    pagina = PdfReader(io.BytesIO(sellado)).pages[0]
+    assert pdf_factura.NOMBRE_SELLO in pagina["/Resources"]["/XObject"]
+    assert [a.get_object()["/A"]["/URI"] for a in pagina["/Annots"]] == [TEXTO_QR]
+    assert not pdf_factura.sellado_de_respaldo(pre_sello, sellado)
+
+
+def test_sellado_en_canvas_por_defecto():
+    assert pdf_factura.PDF_SELLADO == "canvas"
+    datos = DatosFactura(**FACTURA)
+    pre_sello = pdf_factura.generar_pdf_fisico(datos, None, "01/01/2026")
+    sellado = pdf_factura.sellar_factura(datos, None, "01/01/2026", TEXTO_QR, pre_sello)
+    assert not sellado.startswith(pre_sello)
+    assert not pdf_factura.sellado_de_respaldo(pre_sello, sellado)
+    assert len(PdfReader(io.BytesIO(sellado)).pages[0]["/Annots"]) == 1
+
+
+def test_respaldo_del_estampado_incremental_se_detecta(monkeypatch, tmp_path):
+    monkeypatch.setattr(pdf_factura, "PDF_SELLADO", "incremental")
+
+    def sin_incremental(*args):
+        raise ValueError("xref dañado")
+    monkeypatch.setattr(pdf_factura, "_estampar_incremental", sin_incremental)
+    datos = DatosFactura(**FACTURA)
+    pre_sello = pdf_factura.generar_pdf_fisico(datos, None, "01/01/2026")
+
+    sellado = pdf_factura.sellar_factura(datos, None, "01/01/2026", TEXTO_QR, pre_sello)
+    assert pdf_factura.sellado_de_respaldo(pre_sello, sellado)
+    (tmp_path / "origen.pdf").write_bytes(pre_sello)
+    assert not pdf_factura.estampar_qr_archivo(str(tmp_path / "origen.pdf"), str(tmp_path / "destino.pdf"), TEXTO_QR)
+    assert len(PdfReader(str(tmp_path / "destino.pdf")).pages[0]["/Annots"]) == 1
+
+
+def _plantilla_y_texto(pdf: bytes) -> list:
+    paginas = []
+    for pagina in PdfReader(io.BytesIO(pdf)).pages:
+        recursos = pagina["/Resources"]
+        forma = recursos["/XObject"]["/FormXob." + pdf_factura.NOMBRE_PLANTILLA].get_object()
+        fuentes = {nombre: f.get_object()["/BaseFont"] for nombre, f in recursos["/Font"].items()}
+        paginas.append((forma.get_data(), fuentes, pagina.extract_text()))
+    return paginas
+
+
+def test_plantilla_cacheada_igual_que_con_la_api_publica(monkeypatch):
+    # La plantilla cacheada usa internos de reportlab: debe dar lo mismo que beginForm/endForm
+    datos = DatosFactura(**{**FACTURA, "items": FACTURA["items"] * 40})  # varias páginas
+    cacheada = _plantilla_y_texto(pdf_factura.generar_pdf_fisico(datos, None, "01/01/2026"))
+
+    def sin_cache(*args):
+        raise AttributeError("internos de reportlab distintos")
+
+    monkeypatch.setattr(pdf_factura, "_plantilla", sin_cache)
+    publica = _plantilla_y_texto(pdf_factura.generar_pdf_fisico(datos, None, "01/01/2026"))
+
+    assert len(cacheada) > 1
+    assert cacheada == publica
+    assert b"Descripci" in cacheada[0][0] and {"/F1", "/F2"} <= set(cacheada[0][1])
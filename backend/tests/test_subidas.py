@@ -0,0 +1,109 @@
+# backend/tests/test_subidas.py
+# Outbox de subidas (subidas.py) contra el almacén local que sustituye a Supabase:
+# encolado, reintentos con espera exponencial y estado final.
+
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from almacenamiento import AlmacenLocal, ALMACEN_LOCAL_DIR
+from cadena import anexar, cadena_facturas, calcular_hash
+from models import SessionLocal, RegistroFactura, SubidaPendiente, Usuario
+import subidas
+
+from conftest import FACTURA
+
+
+class AlmacenCaido:
+    def subir(self, ruta, contenido):
+        raise ConnectionError("almacén no disponible")
+
+
+def _registro(db) -> RegistroFactura:
+    usuario = Usuario(email=f"subidas{db.query(Usuario).count()}@tests.inaltera", hashed_password="x")
+    db.add(usuario)
+    db.commit()
+
+    def construir(prev_hash):
+        nuevo_hash = calcular_hash(b"subida", prev_hash)
+        return nuevo_hash, [RegistroFactura(
+            nombre_archivo="S.pdf", numero_factura="S", hash_anterior=prev_hash, hash_actual=nuevo_hash,
+            usuario_id=usuario.id, subida=SubidaPendiente(),
+        )]
+    registro, = anexar(db, cadena_facturas(usuario.id), construir)
+    return registro
+
+
+def _procesar(gestor, trabajo):
+    gestor._huecos.acquire()  # como _lanzar, sin pasar por el pool
+    gestor._procesar(trabajo)
+
+
+def _subida(db, subida_id) -> SubidaPendiente:
+    return db.query(SubidaPendiente).filter(SubidaPendiente.id == subida_id).populate_existing().one()
+
+
+def test_emitir_sube_la_copia_local_en_segundo_plano(cliente, cabeceras, db):
+    id_registro = cliente.post("/api/emitir", headers=cabeceras, json=FACTURA).json()["datos_trazabilidad"]["id"]
+    registro = db.get(RegistroFactura, id_registro)
+    limite = time.monotonic() + 30
+    while _subida(db, registro.subida.id).estado != "subida" and time.monotonic() < limite:
+        time.sleep(0.05)
+
+    assert registro.subida.estado == "subida"
+    nombre = f"{registro.id}_{registro.nombre_archivo}"
+    assert (Path(ALMACEN_LOCAL_DIR) / nombre).read_bytes() == (Path("uploads") / nombre).read_bytes()
+
+
+def test_sin_copia_local_la_fila_no_se_sondea(db, tmp_path):
+    gestor = subidas.GestorSubidas(SessionLocal)
+    registro = _registro(db)
+    assert registro.subida.estado == "preparando"
+    assert registro.subida.id not in [t.subida_id for t in gestor._pendientes()]
+
+    gestor._marcar_pendiente(registro.subida.id)  # lo hace encolar() con el PDF ya escrito
+    assert registro.subida.id in [t.subida_id for t in gestor._pendientes()]
+
+
+def test_reintentos_con_espera_y_error_al_agotarlos(db, tmp_path, monkeypatch):
+    gestor = subidas.GestorSubidas(SessionLocal)
+    registro = _registro(db)
+    gestor._marcar_pendiente(registro.subida.id)
+    trabajo = subidas.Trabajo(registro.subida.id, "reintentos.pdf", tmp_path / "reintentos.pdf", b"%PDF")
+
+    monkeypatch.setattr(subidas, "obtener_almacen", lambda: AlmacenCaido())
+    antes = datetime.utcnow()
+    _procesar(gestor, trabajo)
+    subida = _subida(db, registro.subida.id)
+    assert (subida.estado, subida.intentos) == ("pendiente", 1)
+    assert "no disponible" in subida.ultimo_error
+    assert subida.proximo_intento >= antes + timedelta(seconds=subidas.SUBIDAS_ESPERA_BASE_S)
+    assert subida.id not in [t.subida_id for t in gestor._pendientes()]  # esperando el siguiente intento
+
+    _procesar(gestor, trabajo)
+    subida = _subida(db, registro.subida.id)
+    assert subida.intentos == 2
+    assert subida.proximo_intento >= antes + timedelta(seconds=2 * subidas.SUBIDAS_ESPERA_BASE_S)
+
+    db.query(SubidaPendiente).filter(SubidaPendiente.id == subida.id).update({"intentos": subidas.SUBIDAS_MAX_INTENTOS - 1})
+    db.commit()
+    _procesar(gestor, trabajo)
+    assert _subida(db, registro.subida.id).estado == "error"
+
+
+def test_reintento_desde_la_copia_local(db, tmp_path, monkeypatch):
+    gestor = subidas.GestorSubidas(SessionLocal)
+    registro = _registro(db)
+    gestor._marcar_pendiente(registro.subida.id)
+    local = tmp_path / "local.pdf"
+    local.write_bytes(b"%PDF-local")
+    almacen = AlmacenLocal(str(tmp_path / "nube"))
+    monkeypatch.setattr(subidas, "obtener_almacen", lambda: almacen)
+
+    _procesar(gestor, subidas.Trabajo(registro.subida.id, "local.pdf", local))  # sin buffer
+    subida = _subida(db, registro.subida.id)
+    assert subida.estado == "subida" and subida.fecha_subida is not None and subida.ultimo_error is None
+    assert (tmp_path / "nube" / "local.pdf").read_bytes() == b"%PDF-local"
+
+    _procesar(gestor, subidas.Trabajo(registro.subida.id, "local.pdf", local))  # ya no se reclama
+    assert _subida(db, registro.subida.id).intentos == 0
@@ -0,0 +1,58 @@
+# backend/tests/test_totales.py
+# Motor de totales (totales.py): redondeo por línea y por tipo de IVA, y los dos
+# caminos de cálculo (Decimal y NumPy) con el mismo resultado.
+
+import json
+import random
+from decimal import Decimal
+from types import SimpleNamespace
+
+import totales
+from totales import calcular_totales
+
+
+def _items(*lineas):
+    return [SimpleNamespace(cantidad=c, precio_unitario=p, iva=i) for c, p, i in lineas]
+
+
+def test_redondeo_half_up_por_linea():
+    # 0.015 no es exacto en float (0.01499...), pero vale lo que se escribió: 0.02
+    resultado = calcular_totales(_items((1, 0.005, 21), (1, 0.015, 21), (3, 0.335, 21)))
+    assert resultado.importes == (Decimal("0.01"), Decimal("0.02"), Decimal("1.01"))
+
+
+def test_cuota_sobre_la_base_de_cada_tipo():
+    # Por línea serían 3 × 0.01 de cuota; sobre la base (0.15 al 10 %) es 0.015 -> 0.02
+    resultado = calcular_totales(_items((1, 0.05, 10), (1, 0.05, 10), (1, 0.05, 10), (2, 1.5, 21), (1, 4, 4)))
+    assert [(d.iva, str(d.base), str(d.cuota)) for d in resultado.desglose] == [
+        (4, "4.00", "0.16"), (10, "0.15", "0.02"), (21, "3.00", "0.63"),
+    ]
+    assert (resultado.base, resultado.cuota, resultado.total) == (Decimal("7.15"), Decimal("0.81"), Decimal("7.96"))
+    assert json.loads(resultado.desglose_json())[0] == {"iva": 4, "base": "4.00", "cuota": "0.16"}
+
+
+def test_sin_cero_negativo():
+    resultado = calcular_totales(_items((-1, 0.001, 21), (1, -0.004, 10)))
+    assert [str(i) for i in resultado.importes] == ["0.00", "0.00"]
+    assert str(resultado.total) == "0.00"
+    assert str(calcular_totales(_items((-1, 0.005, 21))).importes[0]) == "-0.01"  # mitad alejándose de cero
+
+
+def test_numpy_y_decimal_dan_lo_mismo():
+    aleatorio = random.Random(7)
+    lineas = [
+        (aleatorio.randint(-5, 50), round(aleatorio.uniform(-100, 1000), aleatorio.randint(0, 6)), aleatorio.choice((0, 4, 10, 21)))
+        for _ in range(3000)
+    ]
+    cantidades, precios, ivas = zip(*lineas)
+    por_numpy = totales._totales_numpy(cantidades, precios, ivas)
+    assert por_numpy is not None
+    assert por_numpy == totales._totales_decimal(cantidades, precios, ivas)
+    assert calcular_totales(_items(*lineas)) == por_numpy
+
+
+def test_numpy_no_se_usa_si_no_es_exacto():
+    # Más de 6 decimales: en millonésimas no sería exacto y se calcula en Decimal
+    assert totales._totales_numpy([1], [0.0000005], [21]) is None
+    lineas = [(1, 0.0000005, 21)] * totales.TOTALES_UMBRAL_NUMPY
+    assert calcular_totales(_items(*lineas)).total == Decimal("0.00")
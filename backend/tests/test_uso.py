@@ -0,0 +1,71 @@
+# backend/tests/test_uso.py
+# Contadores mensuales (uso.py): límite atómico de emisiones y uso de las externas.
+
+import pytest
+
+from models import Usuario
+from uso import LimitePlanExcedido, consumir_emisiones, registrar_uso, uso_del_mes
+
+from conftest import FACTURA, subir_externa
+
+
+def test_limite_del_plan_es_todo_o_nada(db):
+    usuario = Usuario(email="limite@tests.inaltera", hashed_password="x")
+    db.add(usuario)
+    db.commit()
+    consumir_emisiones(db, usuario.id, 3, "Free", 5)
+    db.commit()
+    with pytest.raises(LimitePlanExcedido):
+        consumir_emisiones(db, usuario.id, 3, "Free", 5)  # 3 + 3 > 5: no suma nada
+    db.rollback()
+    consumir_emisiones(db, usuario.id, 2, "Free", 5)
+    db.commit()
+    registrar_uso(db, usuario.id, "Anulacion")
+    db.commit()
+    uso = uso_del_mes(db, usuario.id)
+    assert (uso.emitidas, uso.anuladas, uso.externas) == (5, 1, 0)
+
+
+def test_emitir_cuenta_una_emision(cliente, cabeceras):
+    assert cliente.post("/api/emitir", headers=cabeceras, json=FACTURA).status_code == 200
+    assert cliente.get("/api/uso-plan", headers=cabeceras).json()["consumo"] == 1
+
+
+def test_externa_que_no_se_estampa_no_cuenta(cliente, cabeceras, pdf_externo, monkeypatch):
+    import pdf_factura
+
+    def falla(*args):
+        raise RuntimeError("PDF no estampable")
+
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-1").status_code == 200
+    with monkeypatch.context() as m:
+        m.setattr(pdf_factura, "estampar_qr_archivo", falla)
+        assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-2").status_code == 500
+    assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-3").status_code == 200
+
+    uso = cliente.get("/api/uso-plan", headers=cabeceras).json()
+    assert (uso["externas"], uso["anuladas"]) == (2, 0)
+
+
+def test_contador_resembrado_coincide_con_el_vivo(cliente, cabeceras, pdf_externo, db, monkeypatch):
+    # Externas con fecha de otro mes (la que indica el usuario) y una que no se estampa:
+    # recontar desde los registros da lo mismo que los incrementos en vivo
+    import pdf_factura
+    from models import RegistroFactura, UsoMensual
+
+    def falla(*args):
+        raise RuntimeError("PDF no estampable")
+
+    registro_id = subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-ANTIGUA").json()["id"]
+    with monkeypatch.context() as m:
+        m.setattr(pdf_factura, "estampar_qr_archivo", falla)
+        assert subir_externa(cliente, cabeceras, pdf_externo, numero="EXT-FALLA").status_code == 500
+    assert cliente.post("/api/emitir", headers=cabeceras, json=FACTURA).status_code == 200
+    vivo = cliente.get("/api/uso-plan", headers=cabeceras).json()
+
+    usuario_id = db.get(RegistroFactura, registro_id).usuario_id
+    db.query(UsoMensual).filter(UsoMensual.usuario_id == usuario_id).delete()
+    db.commit()
+    resembrado = cliente.get("/api/uso-plan", headers=cabeceras).json()
+    assert resembrado == vivo
+    assert (vivo["consumo"], vivo["externas"], vivo["anuladas"]) == (1, 1, 0)
@@ -0,0 +1,64 @@
+# backend/tests/test_verificacion.py
+# Verificación pública de hashes (/api/verificar-hash) con cadenas por usuario.
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+import merkle
+import migraciones
+from models import Base
+
+from conftest import nuevo_usuario, subir_externa
+
+
+def test_misma_factura_externa_en_dos_usuarios(cliente, pdf_externo, db, monkeypatch):
+    # Mismo NIF por defecto, número, fecha y total: cada cadena tiene su génesis, así
+    # que cada hash lleva a los datos de su propio usuario
+    a, b = nuevo_usuario(cliente), nuevo_usuario(cliente)
+    assert subir_externa(cliente, a, pdf_externo, numero="DUP-1", total="10").status_code == 200
+    assert subir_externa(cliente, b, pdf_externo, numero="DUP-1", total="20").status_code == 200
+    hash_a = cliente.get("/api/registros", headers=a).json()[0]["hash_actual"]
+    hash_b = cliente.get("/api/registros", headers=b).json()[0]["hash_actual"]
+    assert hash_a != hash_b
+
+    for hash_string, total in ((hash_a, 10), (hash_b, 20)):
+        resultado = cliente.get(f"/api/verificar-hash/{hash_string}").json()
+        assert resultado["valido"] and "coincidencias" not in resultado
+        assert (resultado["datos"]["numero_factura"], resultado["datos"]["total"]) == ("DUP-1", total)
+
+    monkeypatch.setattr(merkle, "MERKLE_BLOQUE", 1)
+    merkle.sellar_bloques(db)
+    prueba = cliente.get(f"/api/verificar-hash/{hash_b}?prueba=true").json()["prueba"]
+    assert merkle.verificar_prueba(hash_b, prueba["indice"], prueba["n_hojas"], prueba["ruta"], prueba["raiz"])
+
+
+def test_hash_desconocido_o_mal_formado(cliente):
+    for hash_string in ("f" * 64, "no-es-un-hash"):
+        assert not cliente.get(f"/api/verificar-hash/{hash_string}").json()["valido"]
+
+
+def _base_antigua(ruta, unico: bool):
+    motor = create_engine(f"sqlite:///{ruta}")
+    Base.metadata.create_all(bind=motor)
+    with motor.begin() as conexion:
+        conexion.exec_driver_sql("DROP INDEX ix_registros_facturacion_hash_actual")
+        conexion.exec_driver_sql(f"CREATE {'UNIQUE ' if unico else ''}INDEX ix_registros_facturacion_hash_actual ON registros_facturacion (hash_actual)")
+    return motor
+
+
+def test_migracion_deja_el_indice_unico(tmp_path):
+    motor = _base_antigua(tmp_path / "antigua.db", unico=False)
+    with motor.begin() as conexion:
+        migraciones._hash_actual_unico(conexion)
+    indices = {i["name"]: i for i in inspect(motor).get_indexes("registros_facturacion")}
+    assert indices["ix_registros_facturacion_hash_actual"]["unique"]
+
+
+def test_migracion_con_hashes_repetidos_avisa(tmp_path):
+    motor = _base_antigua(tmp_path / "repetidos.db", unico=False)
+    with motor.begin() as conexion:
+        for _ in range(2):
+            conexion.exec_driver_sql("INSERT INTO registros_facturacion (hash_actual) VALUES ('abc')")
+    with pytest.raises(RuntimeError, match="1 valores de hash_actual repetidos"):
+        with motor.begin() as conexion:
+            migraciones._hash_actual_unico(conexion)
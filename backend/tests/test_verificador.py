@@ -0,0 +1,99 @@
+# backend/tests/test_verificador.py
+# Verificador de las cadenas: puntos de control incrementales y la verificación en
+# segundo plano del endpoint de administración.
+
+from sqlalchemy import func
+
+from cadena import anexar, cadena_facturas, calcular_hash, genesis
+from models import RegistroFactura, EventoBitacora, Usuario
+import verificador
+
+from conftest import nuevo_usuario
+
+
+def _usuario(db) -> int:
+    usuario = Usuario(email=f"verificador{db.query(Usuario).count()}@tests.inaltera", hashed_password="x")
+    db.add(usuario)
+    db.commit()
+    return usuario.id
+
+
+def _anexar(db, usuario_id, contenido: bytes, id_=None):
+    def construir(prev_hash):
+        nuevo_hash = calcular_hash(contenido, prev_hash)
+        return nuevo_hash, [RegistroFactura(
+            id=id_, numero_factura="V", hash_anterior=prev_hash, hash_actual=nuevo_hash, usuario_id=usuario_id,
+        )]
+    return anexar(db, cadena_facturas(usuario_id), construir)
+
+
+def test_punto_de_control_no_salta_filas_confirmadas_tarde(db):
+    a, b = _usuario(db), _usuario(db)
+    _anexar(db, a, b"uno")
+    maximo = db.query(func.max(RegistroFactura.id)).scalar()
+
+    # La transacción de "a" tiene reservado maximo+1 pero "b" confirma antes maximo+2
+    _anexar(db, b, b"de b", id_=maximo + 2)
+    assert verificador.verificar("facturas", en_procesos=False)["valida"]
+    _anexar(db, a, b"tarde", id_=maximo + 1)
+    _anexar(db, a, b"siguiente")
+
+    segundo = verificador.verificar("facturas", en_procesos=False)
+    assert segundo["valida"], segundo["errores"]
+    tercero = verificador.verificar("facturas", en_procesos=False)
+    assert tercero["valida"], tercero["errores"]
+    assert tercero["desde_id"] == maximo + 2  # el punto se quedó en lo visto por la pasada anterior
+
+
+def test_verificacion_en_segundo_plano(cliente, db):
+    admin = nuevo_usuario(cliente, "admin@tests.inaltera")
+    assert cliente.post("/api/admin/verificar-cadenas", headers=nuevo_usuario(cliente)).status_code == 403
+
+    respuesta = cliente.post("/api/admin/verificar-cadenas?completo=true", headers=admin)
+    assert respuesta.status_code == 202
+    assert respuesta.json()["lanzada"]
+    verificador.en_fondo.esperar(timeout=60)
+
+    estado = cliente.get("/api/admin/verificar-cadenas", headers=admin).json()
+    assert estado["estado"] == "terminada"
+    assert set(estado["informes"]) == set(verificador.CADENAS)
+    assert all(informe["valida"] for informe in estado["informes"].values())
+    ultimo = db.query(EventoBitacora).order_by(EventoBitacora.id.desc()).first()
+    assert ultimo.categoria == "AUDITORIA" and ultimo.descripcion.endswith(": 0 errores")
+
+
+def _informe():
+    return {"cadena": "facturas", "filas": 0, "n_errores": 0, "errores": [], "enlaces_legado": 0,
+            "solo_enlace": 0, "n_no_reproducibles": 0, "no_reproducibles": []}
+
+
+def test_primer_eslabon_enlaza_con_el_genesis_de_su_cadena(db):
+    a, b = _usuario(db), _usuario(db)
+    propio, = _anexar(db, a, b"propio")
+    # Un primer eslabón que no parte de su génesis (ni del de legado) es un error
+    ajeno = RegistroFactura(numero_factura="V", hash_anterior=genesis(cadena_facturas(a)),
+                            hash_actual=calcular_hash(b"ajeno", genesis(cadena_facturas(a))), usuario_id=b)
+    db.add(ajeno)
+    db.commit()
+
+    for registro, errores in ((propio, 0), (ajeno, 1)):
+        estado, informe = {"ultimos": {}, "ultimo_global": None, "hash_hasta": None}, _informe()
+        verificador._coser(estado, verificador._verificar_tramo("facturas", registro.id - 1, registro.id), informe)
+        assert informe["n_errores"] == errores
+    db.delete(ajeno)
+    db.commit()
+
+
+def test_tramos_en_pool_propio_sin_tocar_el_de_los_pdfs(db, monkeypatch):
+    import ejecutores
+
+    def prohibido():
+        raise AssertionError("el verificador no debe usar el pool de los PDFs")
+    monkeypatch.setattr(ejecutores, "pool_procesos", prohibido)
+    monkeypatch.setattr(verificador, "VERIFICADOR_TRAMO", 1)
+    a = _usuario(db)
+    for contenido in (b"uno", b"dos", b"tres"):
+        _anexar(db, a, contenido)
+
+    informe = verificador.verificar("facturas", completo=True, guardar=False)
+    assert informe["valida"], informe["errores"]
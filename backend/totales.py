@@ -0,0 +1,119 @@
+# backend/totales.py
+# Motor único de totales: importe de cada línea, desglose de IVA por tipo y total.
+#
+# Reglas (las de una factura española): el importe de cada línea (cantidad × precio)
+# se redondea a céntimos; la base de cada tipo de IVA es la suma de sus líneas; la
+# cuota se calcula sobre esa base y se redondea a céntimos; el total es la suma de
+# bases y cuotas. Todo con redondeo "half up" (0,005 -> 0,01) y sin floats.
+#
+# Con muchas líneas (TOTALES_UMBRAL_NUMPY) se calcula con NumPy en enteros: precios en
+# millonésimas y céntimos en int64. Solo se usa si es exacto (precios con hasta 6
+# decimales y sin riesgo de desbordamiento); si no, se sigue por Decimal. Los dos
+# caminos dan exactamente el mismo resultado. El PDF, RegistroFactura.total/desglose_iva
+# y el JSON del registro salen de aquí.
+
+import json
+import os
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import List, Sequence, Tuple
+
+TOTALES_UMBRAL_NUMPY = int(os.getenv("TOTALES_UMBRAL_NUMPY", "1000"))
+
+CENTIMO = Decimal("0.01")
+_ESCALA_PRECIO = 10 ** 6  # millonésimas de euro
+_MAX_PRECIO = 1e9
+_MAX_INT64 = 2 ** 62  # margen sobre 2**63 para las sumas
+
+
+@dataclass(frozen=True)
+class DesgloseIVA:
+    iva: int
+    base: Decimal
+    cuota: Decimal
+
+
+@dataclass(frozen=True)
+class Totales:
+    importes: Tuple[Decimal, ...]  # importe (sin IVA) de cada línea, en el orden recibido
+    desglose: Tuple[DesgloseIVA, ...]  # por tipo de IVA, de menor a mayor
+    base: Decimal
+    cuota: Decimal
+    total: Decimal
+
+    def desglose_json(self) -> str:
+        """Desglose de IVA tal como se guarda en RegistroFactura.desglose_iva."""
+        return json.dumps([
+            {"iva": d.iva, "base": str(d.base), "cuota": str(d.cuota)} for d in self.desglose
+        ])
+
+
+def _redondear(valor: Decimal) -> Decimal:
+    return valor.quantize(CENTIMO, rounding=ROUND_HALF_UP) + 0  # + 0: sin "-0.00"
+
+
+def _cerrar(importes: Tuple[Decimal, ...], bases: dict) -> Totales:
+    desglose = tuple(
+        DesgloseIVA(iva, base, _redondear(base * iva / 100)) for iva, base in sorted(bases.items())
+    )
+    base = sum((d.base for d in desglose), Decimal("0.00"))
+    cuota = sum((d.cuota for d in desglose), Decimal("0.00"))
+    return Totales(importes, desglose, base, cuota, base + cuota)
+
+
+def _totales_decimal(cantidades, precios, ivas) -> Totales:
+    importes = []
+    bases = {}
+    for cantidad, precio, iva in zip(cantidades, precios, ivas):
+        # repr: el decimal más corto que representa el float (1.1 -> "1.1", no 1.1000000000000000888)
+        importe = _redondear(Decimal(cantidad) * Decimal(repr(precio)))
+        importes.append(importe)
+        bases[iva] = bases.get(iva, Decimal("0.00")) + importe
+    return _cerrar(tuple(importes), bases)
+
+
+def _mitad_arriba(valores, divisor: int):
+    # División entera redondeando las mitades alejándose de cero (como ROUND_HALF_UP)
+    import numpy as np
+    return np.sign(valores) * ((np.abs(valores) + divisor // 2) // divisor)
+
+
+def _totales_numpy(cantidades, precios, ivas):
+    """Totales en enteros con NumPy, o None si no se puede garantizar que sea exacto."""
+    import numpy as np
+
+    precios = np.asarray(precios, dtype=np.float64)
+    cantidades = np.asarray(cantidades, dtype=np.int64)
+    if not np.all(np.abs(precios) < _MAX_PRECIO):
+        return None
+    micros = np.rint(precios * _ESCALA_PRECIO)
+    # Exacto si cada float es el más cercano a su valor con 6 decimales (= su repr)
+    if not np.array_equal(micros / _ESCALA_PRECIO, precios):
+        return None
+    if not np.all(np.abs(micros * cantidades) < _MAX_INT64 / max(len(precios), 1)):
+        return None
+
+    centimos = _mitad_arriba(cantidades * micros.astype(np.int64), _ESCALA_PRECIO // 100)
+    tipos, indices = np.unique(np.asarray(ivas, dtype=np.int64), return_inverse=True)
+    bases = np.zeros(len(tipos), dtype=np.int64)
+    np.add.at(bases, indices, centimos)
+
+    importes = tuple(Decimal(int(c)).scaleb(-2) for c in centimos.tolist())
+    return _cerrar(importes, {int(t): Decimal(int(b)).scaleb(-2) for t, b in zip(tipos.tolist(), bases.tolist())})
+
+
+def calcular_totales(items: Sequence) -> Totales:
+    """Totales de las líneas (objetos con cantidad, precio_unitario e iva)."""
+    cantidades = [item.cantidad for item in items]
+    precios = [item.precio_unitario for item in items]
+    ivas = [item.iva for item in items]
+    if len(items) >= TOTALES_UMBRAL_NUMPY:
+        totales = _totales_numpy(cantidades, precios, ivas)
+        if totales is not None:
+            return totales
+    return _totales_decimal(cantidades, precios, ivas)
+
+
+def desglose_de_json(texto: str) -> List[dict]:
+    """El desglose guardado en RegistroFactura.desglose_iva (lista vacía si no hay)."""
+    return json.loads(texto) if texto else []
@@ -0,0 +1,126 @@
+# backend/uso.py
+# Consumo mensual por usuario y límites de los planes.
+#
+# Cada emisión, anulación o subida suma en la fila (usuario, mes) de uso_mensual dentro
+# de la misma transacción que la encadena (desde el `construir` de cadena.anexar), así
+# que si la transacción se deshace o se reintenta el contador también. Todo cuenta en
+# el mes en que se registra (fecha_creacion, la del servidor), no en fecha_subida: en
+# las externas esa es la fecha que escribe el usuario. Las emisiones hacen
+# comprobación e incremento atómicos: un único
+#   UPDATE ... SET emitidas = emitidas + n WHERE emitidas + n <= limite
+# que no puede pasarse del límite aunque lleguen varias a la vez.
+
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import RegistroFactura, Suscripcion, PlanLimite, UsoMensual
+
+LIMITES_INICIALES = {"Free": 5, "Basic": 20, "Pro": 1000}
+PLAN_POR_DEFECTO = "Free"
+
+CAMPOS_TIPO = {"Alta": "emitidas", "Anulacion": "anuladas", "Externa": "externas"}
+# Anulación de una externa cuyo PDF no se pudo estampar (main.anular_registro_fallido):
+# descuenta la externa y no cuenta como anulación
+MOTIVO_ESTAMPADO_FALLIDO = "Error al estampar el QR en el PDF"
+
+
+class LimitePlanExcedido(Exception):
+    def __init__(self, plan: str, limite: int):
+        super().__init__(f"Límite del plan {plan} alcanzado ({limite} facturas al mes)")
+        self.plan = plan
+        self.limite = limite
+
+
+def sembrar_planes(db: Session):
+    """Crea las filas de planes_limite que falten con los límites de siempre."""
+    existentes = {p for p, in db.query(PlanLimite.plan)}
+    for plan, limite in LIMITES_INICIALES.items():
+        if plan not in existentes:
+            db.add(PlanLimite(plan=plan, facturas_mes=limite))
+    db.commit()
+
+
+def plan_y_limite(db: Session, usuario_id: int) -> Tuple[str, int]:
+    fila = db.query(Suscripcion.plan, PlanLimite.facturas_mes).outerjoin(
+        PlanLimite, PlanLimite.plan == Suscripcion.plan
+    ).filter(Suscripcion.usuario_id == usuario_id).first()
+    plan = fila.plan if fila and fila.plan else PLAN_POR_DEFECTO
+    limite = fila.facturas_mes if fila else None
+    if limite is None:
+        limite = db.query(PlanLimite.facturas_mes).filter(PlanLimite.plan == plan).scalar()
+    return plan, limite if limite is not None else LIMITES_INICIALES[PLAN_POR_DEFECTO]
+
+
+def mes_actual(ahora: Optional[datetime] = None) -> str:
+    return (ahora or datetime.utcnow()).strftime("%Y-%m")
+
+
+def _crear_uso(db: Session, usuario_id: int, mes: str):
+    # Primera vez del mes: se parte de lo que ya hay registrado (datos anteriores a la
+    # tabla). Sesión aparte, como las cabezas de cadena, para no confirmar la petición.
+    inicio = datetime.strptime(mes, "%Y-%m")
+    fin = datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+    with Session(bind=db.get_bind()) as s:
+        contadores = dict.fromkeys(CAMPOS_TIPO.values(), 0)
+        por_tipo = s.query(RegistroFactura.tipo, func.count(RegistroFactura.id)).filter(
+            RegistroFactura.usuario_id == usuario_id,
+            RegistroFactura.fecha_creacion >= inicio,
+            RegistroFactura.fecha_creacion < fin,
+        ).group_by(RegistroFactura.tipo)
+        for tipo, n in por_tipo:
+            if tipo in CAMPOS_TIPO:
+                contadores[CAMPOS_TIPO[tipo]] = n
+        fallidas = s.query(func.count(RegistroFactura.id)).filter(
+            RegistroFactura.usuario_id == usuario_id,
+            RegistroFactura.tipo == "Anulacion",
+            RegistroFactura.motivo_anulacion == MOTIVO_ESTAMPADO_FALLIDO,
+            RegistroFactura.fecha_creacion >= inicio,
+            RegistroFactura.fecha_creacion < fin,
+        ).scalar()
+        contadores["anuladas"] -= fallidas
+        contadores["externas"] -= fallidas
+        try:
+            s.add(UsoMensual(usuario_id=usuario_id, mes=mes, **contadores))
+            s.commit()
+        except IntegrityError:
+            s.rollback()  # otro worker la creó a la vez
+
+
+def _sumar(db: Session, usuario_id: int, campo: str, n: int, limite: Optional[int] = None) -> bool:
+    mes = mes_actual()
+    # La fila se crea antes del primer UPDATE: en SQLite, una vez que esta transacción
+    # escribe, la sesión aparte de _crear_uso quedaría esperando su bloqueo.
+    existe = db.query(UsoMensual.usuario_id).filter(UsoMensual.usuario_id == usuario_id, UsoMensual.mes == mes).first()
+    if existe is None:
+        _crear_uso(db, usuario_id, mes)
+    columna = getattr(UsoMensual, campo)
+    consulta = update(UsoMensual).where(UsoMensual.usuario_id == usuario_id, UsoMensual.mes == mes)
+    if limite is not None:
+        consulta = consulta.where(columna + n <= limite)
+    resultado = db.execute(consulta.values({campo: columna + n}).execution_options(synchronize_session=False))
+    return resultado.rowcount == 1
+
+
+def consumir_emisiones(db: Session, usuario_id: int, n: int, plan: str, limite: int):
+    """Suma n emisiones al mes o lanza LimitePlanExcedido (todo o nada para un lote)."""
+    if not _sumar(db, usuario_id, "emitidas", n, limite):
+        raise LimitePlanExcedido(plan, limite)
+
+
+def registrar_uso(db: Session, usuario_id: int, tipo: str, n: int = 1):
+    """Anulaciones y facturas externas: cuentan, pero no tienen límite (n < 0 descuenta)."""
+    _sumar(db, usuario_id, CAMPOS_TIPO[tipo], n)
+
+
+def uso_del_mes(db: Session, usuario_id: int) -> UsoMensual:
+    mes = mes_actual()
+    consulta = db.query(UsoMensual).filter(UsoMensual.usuario_id == usuario_id, UsoMensual.mes == mes)
+    uso = consulta.first()
+    if uso is None:
+        _crear_uso(db, usuario_id, mes)
+        uso = consulta.first()
+    return uso
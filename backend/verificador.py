@@ -0,0 +1,306 @@
+# backend/verificador.py
+# Verificación de la integridad de las cadenas de hashes (facturas y bitácora).
+#
+#  - Recorre las filas en orden de id con yield_per (nunca toda la tabla en memoria)
+#    y comprueba que cada hash_anterior es el hash_actual del eslabón previo de su
+#    cadena (la del usuario en facturas, la única en bitácora). Los registros
+#    anteriores a las cadenas por usuario enlazan con el registro previo global:
+#    se aceptan y se cuentan aparte como "enlaces_legado". El primer eslabón de cada
+#    cadena enlaza con su génesis (cadena.genesis) o con el génesis global de legado.
+#  - Recalcula el hash cuando sus datos están guardados: anulaciones y eventos de
+#    bitácora. Las altas y facturas externas se hashearon sobre datos que no se
+#    guardan (el PDF, el NIF de ese momento): de esas solo se comprueba el enlace.
+#    Los eventos de bitácora escritos antes de guardar la fecha hasheada no se
+#    pueden reproducir y se informan como "no_reproducibles", no como errores.
+#  - Si no hay errores guarda un punto de control firmado con HMAC
+#    (VERIFICADOR_CLAVE); las siguientes ejecuciones continúan desde él. Como en el
+#    sellador Merkle, el punto no pasa del id más alto visto en la ejecución anterior:
+#    una transacción que tenía reservado un id menor ya ha confirmado para entonces,
+#    y su fila no se queda fuera para siempre.
+#  - La primera pasada (o --completo) reparte los tramos de ids entre procesos y
+#    cose los resultados: cada tramo devuelve el primer y último eslabón que ve de
+#    cada cadena, y el enlace entre tramos se comprueba al juntarlos. Los procesos son
+#    un pool propio de VERIFICADOR_PROCESOS que se cierra al terminar, no el de los
+#    PDFs (ejecutores.pool_procesos): una verificación larga no deja a emitir esperando.
+#
+# Uso: python verificador.py [--cadena facturas|bitacora] [--completo] [--sin-procesos]
+
+import argparse
+import copy
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+
+from models import SessionLocal, RegistroFactura, EventoBitacora, PuntoControl
+from cadena import calcular_hash, cadena_facturas, genesis, HASH_GENESIS, CADENA_BITACORA
+
+VERIFICADOR_CLAVE = os.getenv("VERIFICADOR_CLAVE", "clave_verificador_cambiar_en_produccion")
+VERIFICADOR_TRAMO = int(os.getenv("VERIFICADOR_TRAMO", "200000")) # ids por tramo en paralelo
+VERIFICADOR_LOTE = int(os.getenv("VERIFICADOR_LOTE", "5000")) # filas por viaje a la BD
+VERIFICADOR_MAX_ERRORES = int(os.getenv("VERIFICADOR_MAX_ERRORES", "100")) # detalle en el informe
+VERIFICADOR_PROCESOS = int(os.getenv("VERIFICADOR_PROCESOS", "2")) # pool propio; <= 1: en este proceso
+
+CADENAS = ("facturas", "bitacora")
+
+
+def _consulta(db, cadena: str, desde_id: int, hasta_id: int):
+    if cadena == "facturas":
+        R = RegistroFactura
+        columnas = (R.id, R.usuario_id, R.tipo, R.numero_factura, R.motivo_anulacion, R.hash_anterior, R.hash_actual)
+    else:
+        R = EventoBitacora
+        columnas = (R.id, R.fecha, R.categoria, R.descripcion, R.usuario_id, R.hash_anterior, R.hash_actual)
+    return db.query(*columnas).filter(R.id > desde_id, R.id <= hasta_id).order_by(R.id).yield_per(VERIFICADOR_LOTE)
+
+
+def _recalcular(cadena: str, fila):
+    """Hash recalculado de la fila, o None si sus datos de origen no se guardan."""
+    if cadena == "facturas":
+        _, _, tipo, numero_factura, motivo, hash_anterior, _ = fila
+        if tipo != "Anulacion":
+            return None
+        return calcular_hash(f"ANULACION_{numero_factura}_{motivo}".encode('utf-8'), hash_anterior)
+    _, fecha, categoria, descripcion, usuario_id, hash_anterior, _ = fila
+    contenido = f"{fecha.isoformat()}{categoria}{descripcion}{usuario_id}".encode('utf-8')
+    return calcular_hash(contenido, hash_anterior)
+
+
+def _verificar_tramo(cadena: str, desde_id: int, hasta_id: int) -> dict:
+    """
+    Verifica las filas (desde_id, hasta_id] sin conocer lo anterior. El primer eslabón
+    de cada cadena dentro del tramo se devuelve en "primeros" para comprobarlo al coser.
+    Función de módulo: se ejecuta en el pool de procesos.
+    """
+    r = {
+        "desde": desde_id, "hasta": hasta_id, "filas": 0,
+        "primeros": [], "ultimos": {}, "ultimo_global": None, "hash_hasta": None,
+        "errores": [], "n_errores": 0, "enlaces_legado": 0, "solo_enlace": 0,
+        "no_reproducibles": [], "n_no_reproducibles": 0,
+    }
+
+    def error(registro_id, tipo, detalle):
+        r["n_errores"] += 1
+        if len(r["errores"]) < VERIFICADOR_MAX_ERRORES:
+            r["errores"].append({"id": registro_id, "tipo": tipo, "detalle": detalle})
+
+    db = SessionLocal()
+    try:
+        ultimos, previo_global = r["ultimos"], None
+        for fila in _consulta(db, cadena, desde_id, hasta_id):
+            registro_id, hash_anterior, hash_actual = fila[0], fila[-2], fila[-1]
+            clave = str(fila[1]) if cadena == "facturas" else cadena
+            r["filas"] += 1
+
+            # 1. Enlace con el eslabón previo de su cadena (o con el previo global, legado)
+            if clave not in ultimos:
+                r["primeros"].append((registro_id, clave, hash_anterior, previo_global))
+            elif hash_anterior != ultimos[clave]:
+                if hash_anterior == previo_global:
+                    r["enlaces_legado"] += 1
+                else:
+                    error(registro_id, "enlace", f"hash_anterior {hash_anterior[:12]}… no es el hash del eslabón previo {ultimos[clave][:12]}…")
+
+            # 2. Contenido
+            recalculado = _recalcular(cadena, fila)
+            if recalculado is None:
+                r["solo_enlace"] += 1
+            elif recalculado != hash_actual:
+                if cadena == "bitacora":
+                    r["n_no_reproducibles"] += 1
+                    if len(r["no_reproducibles"]) < VERIFICADOR_MAX_ERRORES:
+                        r["no_reproducibles"].append(registro_id)
+                else:
+                    error(registro_id, "contenido", "el hash no corresponde a los datos guardados")
+
+            ultimos[clave] = hash_actual
+            previo_global = hash_actual
+        r["ultimo_global"] = previo_global
+        r["hash_hasta"] = previo_global
+    finally:
+        db.close()
+    return r
+
+
+def _tramos(desde_id: int, hasta_id: int, tamano: int) -> list:
+    return [(i, min(i + tamano, hasta_id)) for i in range(desde_id, hasta_id, tamano)]
+
+
+def _coser(estado: dict, tramo: dict, informe: dict):
+    """Comprueba los primeros eslabones del tramo contra el estado acumulado y lo avanza."""
+    ultimos = estado["ultimos"]
+    for registro_id, clave, hash_anterior, previo_en_tramo in tramo["primeros"]:
+        previo_global = previo_en_tramo if previo_en_tramo is not None else estado["ultimo_global"]
+        if clave in ultimos:
+            if hash_anterior == ultimos[clave]:
+                continue
+        elif hash_anterior in (genesis(cadena_facturas(clave) if informe["cadena"] == "facturas" else CADENA_BITACORA), HASH_GENESIS):
+            continue
+        if hash_anterior == previo_global:
+            informe["enlaces_legado"] += 1
+            continue
+        informe["n_errores"] += 1
+        if len(informe["errores"]) < VERIFICADOR_MAX_ERRORES:
+            esperado = ultimos.get(clave, "génesis")
+            informe["errores"].append({"id": registro_id, "tipo": "enlace", "detalle": f"hash_anterior {hash_anterior[:12]}… no es el hash del eslabón previo {esperado[:12]}…"})
+
+    ultimos.update(tramo["ultimos"])
+    if tramo["ultimo_global"] is not None:
+        estado["ultimo_global"] = tramo["ultimo_global"]
+        estado["hash_hasta"] = tramo["hash_hasta"]
+
+    for campo in ("filas", "n_errores", "enlaces_legado", "solo_enlace", "n_no_reproducibles"):
+        informe[campo] += tramo[campo]
+    informe["errores"].extend(tramo["errores"][:max(0, VERIFICADOR_MAX_ERRORES - len(informe["errores"]))])
+    informe["no_reproducibles"].extend(tramo["no_reproducibles"][:max(0, VERIFICADOR_MAX_ERRORES - len(informe["no_reproducibles"]))])
+
+
+# --- Puntos de control firmados ---
+
+def _firmar(cadena: str, hasta_id: int, estado_json: str) -> str:
+    mensaje = f"{cadena}|{hasta_id}|{estado_json}".encode('utf-8')
+    return hmac.new(VERIFICADOR_CLAVE.encode('utf-8'), mensaje, hashlib.sha256).hexdigest()
+
+
+def _cargar_punto(db, cadena: str, informe: dict):
+    """
+    Último punto de control: (hasta_id, estado). Si está alterado, o la fila en la que
+    se cortó ya no tiene el mismo hash, es un error y se verifica desde el principio.
+    El estado lleva también "visto_hasta": el id más alto que vio esa ejecución.
+    """
+    vacio = (0, {"ultimos": {}, "ultimo_global": None, "hash_hasta": None})
+    punto = db.query(PuntoControl).filter(PuntoControl.cadena == cadena).order_by(PuntoControl.id.desc()).first()
+    if punto is None:
+        return vacio
+    if not hmac.compare_digest(punto.firma or "", _firmar(cadena, punto.hasta_id, punto.estado)):
+        informe["n_errores"] += 1
+        informe["errores"].append({"id": punto.hasta_id, "tipo": "punto_control", "detalle": f"Punto de control {punto.id} con firma inválida"})
+        return vacio
+    estado = json.loads(punto.estado)
+    # La fila en la que se cortó debe seguir teniendo el mismo hash
+    modelo = RegistroFactura if cadena == "facturas" else EventoBitacora
+    actual = db.query(modelo.hash_actual).filter(modelo.id == punto.hasta_id).scalar() if punto.hasta_id else None
+    if actual != estado["hash_hasta"]:
+        informe["n_errores"] += 1
+        informe["errores"].append({"id": punto.hasta_id, "tipo": "punto_control", "detalle": f"La fila cambió desde el punto de control {punto.id}"})
+        return vacio
+    informe["punto_control_previo"] = punto.id
+    return punto.hasta_id, estado
+
+
+def verificar(cadena: str, completo: bool = False, en_procesos: bool = True, guardar: bool = True) -> dict:
+    """Verifica una cadena ("facturas" o "bitacora") y devuelve el informe."""
+    if cadena not in CADENAS:
+        raise ValueError(f"Cadena desconocida: {cadena}")
+    inicio = time.monotonic()
+    informe = {
+        "cadena": cadena, "desde_id": 0, "hasta_id": 0, "filas": 0,
+        "valida": True, "n_errores": 0, "errores": [],
+        "enlaces_legado": 0, "solo_enlace": 0, "n_no_reproducibles": 0, "no_reproducibles": [],
+        "punto_control_previo": None, "punto_control": None,
+    }
+    modelo = RegistroFactura if cadena == "facturas" else EventoBitacora
+
+    db = SessionLocal()
+    pool = None
+    try:
+        desde_id, estado = (0, {"ultimos": {}, "ultimo_global": None, "hash_hasta": None})
+        if not completo:
+            desde_id, estado = _cargar_punto(db, cadena, informe)
+        visto_antes = estado.pop("visto_hasta", desde_id)
+        hasta_id = max(desde_id, db.query(modelo.id).order_by(modelo.id.desc()).limit(1).scalar() or 0)
+        informe["desde_id"], informe["hasta_id"] = desde_id, hasta_id
+
+        # Se verifica hasta hasta_id, pero el punto de control se queda en "tope": lo
+        # que ya vio la ejecución anterior (ids más altos pueden tener huecos aún sin confirmar)
+        tope = min(max(visto_antes, desde_id), hasta_id)
+        tramos = _tramos(desde_id, tope, VERIFICADOR_TRAMO) + _tramos(tope, hasta_id, VERIFICADOR_TRAMO)
+
+        # Tramos en paralelo solo si merece la pena (la primera pasada o --completo)
+        if en_procesos and len(tramos) > 1 and VERIFICADOR_PROCESOS > 1:
+            pool = ProcessPoolExecutor(max_workers=min(VERIFICADOR_PROCESOS, len(tramos)), mp_context=multiprocessing.get_context("spawn"))
+            resultados = pool.map(_verificar_tramo, repeat(cadena), *zip(*tramos))
+        else:
+            resultados = (_verificar_tramo(cadena, a, b) for a, b in tramos)
+        estado_tope = copy.deepcopy(estado) if tope == desde_id else None
+        for (_, b), tramo in zip(tramos, resultados):
+            _coser(estado, tramo, informe)
+            if b == tope:
+                estado_tope = copy.deepcopy(estado)
+
+        informe["valida"] = informe["n_errores"] == 0
+
+        # Punto de control firmado (solo si todo lo verificado es correcto y hay algo nuevo)
+        if guardar and informe["valida"] and (tope > desde_id or hasta_id > visto_antes):
+            estado_json = json.dumps({**estado_tope, "visto_hasta": hasta_id}, sort_keys=True)
+            punto = PuntoControl(cadena=cadena, hasta_id=tope, estado=estado_json, fecha=datetime.utcnow(), firma=_firmar(cadena, tope, estado_json))
+            db.add(punto)
+            db.commit()
+            informe["punto_control"] = punto.id
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        db.close()
+
+    informe["duracion_s"] = round(time.monotonic() - inicio, 3)
+    return informe
+
+
+class VerificacionEnFondo:
+    """Verificación de todas las cadenas en un hilo (una a la vez por proceso) y su último estado."""
+
+    def __init__(self):
+        self.estado = {"estado": "sin_ejecutar"}
+        self._hilo = None
+        self._lock = threading.Lock()
+
+    def lanzar(self, completo: bool = False, al_terminar=None) -> bool:
+        """Arranca una verificación si no hay otra en curso. `al_terminar(informes)` se llama al acabar."""
+        with self._lock:
+            if self._hilo is not None and self._hilo.is_alive():
+                return False
+            self.estado = {"estado": "en_curso", "completo": completo, "inicio": datetime.utcnow().isoformat() + "Z"}
+            self._hilo = threading.Thread(target=self._ejecutar, args=(completo, al_terminar), name="verificador", daemon=True)
+            self._hilo.start()
+            return True
+
+    def esperar(self, timeout: float = None):
+        hilo = self._hilo
+        if hilo is not None:
+            hilo.join(timeout)
+
+    def _ejecutar(self, completo: bool, al_terminar):
+        try:
+            informes = {cadena: verificar(cadena, completo=completo) for cadena in CADENAS}
+            resultado = {"estado": "terminada", "informes": informes}
+        except Exception as e:
+            print(f"❌ Error verificando las cadenas: {e}")
+            informes, resultado = None, {"estado": "error", "error": str(e)}
+        self.estado = {**self.estado, **resultado, "fin": datetime.utcnow().isoformat() + "Z"}
+        if al_terminar is not None and informes is not None:
+            al_terminar(informes)
+
+
+en_fondo = VerificacionEnFondo()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica la integridad de las cadenas de hashes de INALTERA")
+    parser.add_argument("--cadena", choices=CADENAS, action="append", help="Cadena a verificar (por defecto, todas)")
+    parser.add_argument("--completo", action="store_true", help="Ignora los puntos de control y verifica desde el principio")
+    parser.add_argument("--sin-procesos", action="store_true", help="Verifica en este proceso, sin repartir tramos")
+    parser.add_argument("--no-guardar", action="store_true", help="No guarda un nuevo punto de control")
+    args = parser.parse_args()
+
+    valida = True
+    for nombre in args.cadena or CADENAS:
+        resultado = verificar(nombre, completo=args.completo, en_procesos=not args.sin_procesos, guardar=not args.no_guardar)
+        valida &= resultado["valida"]
+        print(json.dumps(resultado, ensure_ascii=False, indent=2, default=str))
+    raise SystemExit(0 if valida else 1)